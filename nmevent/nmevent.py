@@ -96,6 +96,18 @@ function or elsewhere.
 >>> example.x = 10 # handler gets called
 x changed
 
+=============
+Thread safety
+=============
+
+Handlers can be added to and removed from events by any thread, while
+other threads fire the same events. Changes of the collections of
+handlers (and of the data the events keep in their senders) are
+serialized by a lock, but firing an event doesn't take it: it calls
+an immutable snapshot of the handlers (see :class:`CallbackStore`).
+A handler added or removed while the event is being fired in another
+thread may or may not be called by that firing.
+
 =======
 License
 =======
@@ -157,57 +169,371 @@ __all__    = [
     'nmproperty',
     'with_events',
     'with_properties',
+    'batch',
+    'batch_handler',
+    'change_detector',
+    'merge',
+    'stats',
+    'trace',
+    'default_queue',
     'Event',
+    'ChangeDetector',
+    'IdentityChangeDetector',
+    'AlwaysChangeDetector',
+    'KeyChangeDetector',
+    'VersionChangeDetector',
+    'AsyncDispatch',
+    'ExecutorDispatch',
+    'EventStats',
+    'EventQueue',
+    'EventStream',
+    'Publisher',
+    'Subscriber',
+    'SocketServer',
+    'SocketClient',
+    'RemoteEvent',
 ]
 
 import __builtin__
+import collections
+import errno
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import inspect
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
 import weakref
 
 EVENTS_ATTRIBUTE = '__nmevents__'
+LAYOUT_ATTRIBUTE = '__nmevents_layout__'
+
+# Serializes changes of handler collections, event tables and layouts.
+# Reading them (i.e. firing events) doesn't take the lock.
+_lock = threading.RLock()
+
+def _event_layout(clss):
+    """Returns the event layout of ``clss``.
+
+    The layout is a dictionary that maps events to their ordinals, which
+    are indices into the event tables of the class' instances. It is
+    created the first time it's needed, giving ordinals to all events
+    in the class and its bases, and then stored in the class.
+    """
+    layout = clss.__dict__.get(LAYOUT_ATTRIBUTE)
+    if layout is None:
+        with _lock:
+            layout = clss.__dict__.get(LAYOUT_ATTRIBUTE)
+            if layout is None:
+                layout = {}
+                for base in reversed(inspect.getmro(clss)):
+                    for name, attr in sorted(base.__dict__.items()):
+                        if isinstance(attr, Event) and attr not in layout:
+                            layout[attr] = len(layout)
+                setattr(clss, LAYOUT_ATTRIBUTE, layout)
+    return layout
+
+def _identity(value):
+    # Unpickles objects that are pickled as another object.
+    return value
+
+def _event_ordinal(clss, event):
+    """Returns the ordinal of ``event`` in the layout of ``clss``.
+
+    Events that are not attributes of the class (e.g. events added to the
+    class after the layout was created) are appended to the layout.
+    """
+    layout = _event_layout(clss)
+    ordinal = layout.get(event)
+    if ordinal is None:
+        with _lock:
+            ordinal = layout.get(event)
+            if ordinal is None:
+                ordinal = layout[event] = len(layout)
+    return ordinal
+
+class _WeakEventTable(list):
+    """Event table of a sender that has nowhere to keep it.
+
+    Such tables are kept in the :data:`_weak_event_tables` dictionary
+    under the id of their sender. The table holds a weak reference
+    to the sender, which removes the table from the dictionary
+    as soon as the sender dies.
+    """
+
+    __slots__ = ('ref', )
+
+_weak_event_tables = {}
+
+def _instance_events(sender):
+    """Returns the table where ``sender`` keeps its event data.
+
+    The table is a list indexed by event ordinals (see
+    :func:`_event_layout`). It is kept in the instance's ``__dict__``
+    or, if the sender's class uses ``__slots__``, in the
+    :attr:`EVENTS_ATTRIBUTE` slot. If the class' slots don't include
+    it, the table is kept in a side table with weak references to
+    the senders. If the sender has no table, ``None`` is returned.
+    """
+    try:
+        return sender.__dict__.get(EVENTS_ATTRIBUTE)
+    except AttributeError:
+        events = getattr(sender, EVENTS_ATTRIBUTE, None)
+        if events is None and _weak_event_tables:
+            events = _weak_event_tables.get(id(sender))
+            if events is not None and events.ref() is not sender:
+                events = None
+        return events
+
+def _create_instance_events(sender):
+    """Creates the table where ``sender`` keeps its event data.
+
+    The table is made just big enough for all events of the
+    sender's class.
+    """
+    size = len(_event_layout(sender.__class__))
+    events = [None] * size
+    try:
+        sender.__dict__[EVENTS_ATTRIBUTE] = events
+    except AttributeError:
+        try:
+            setattr(sender, EVENTS_ATTRIBUTE, events)
+        except AttributeError:
+            events = _create_weak_event_table(sender, size)
+    return events
+
+def _create_weak_event_table(sender, size):
+    key = id(sender)
+    def remove(ref):
+        with _lock:
+            events = _weak_event_tables.get(key)
+            if events is not None and events.ref is ref:
+                del _weak_event_tables[key]
+    events = _WeakEventTable([None] * size)
+    try:
+        events.ref = weakref.ref(sender, remove)
+    except TypeError:
+        raise TypeError, ("%s instances have nowhere to keep their event "
+            "handlers. Add %r or '__weakref__' to the class' __slots__." %
+                (sender.__class__.__name__, EVENTS_ATTRIBUTE))
+    _weak_event_tables[key] = events
+    return events
 
 class WeakRefCallback(object):
+    """Callback that holds its target by a weak reference.
+
+    If the callback is a bound method, the instance is referenced weakly
+    and the method's function strongly, since the bound method object
+    itself usually dies right after being created. Calling the object
+    after the target died does nothing.
+
+    :param callback: callable object to wrap
+    :param on_death: function to be called with this object
+                     as the only argument when the target dies
+
+    .. attribute:: on_death
+
+       Function called when the target dies, or ``None``.
+    """
+
     @property
     def is_alive(self):
-        return bool(self.callback and self.callback())
-    
-	def __init__(self, callback):
-		if hasattr(callback, "im_func"):
-			self.callback = weakref.ref(callback.im_self)
-			self.method = callback.im_func
-		else:
-			self.callback = weakref.ref(callback)
-			self.method = None
-	
-	def __repr__(self):
-		return "<WeakRefCallback(callback=%r, method=%r)>" % (self.callback, self.method)
-	
-	def __call__(self, *args, **keywords):
-		callback = self.callback and self.callback()
-		if not callback:
-			self.callback = None
-			return
-		if not self.method:
-			return callback(*args, **keywords)
-		return self.method.__get__(callback, type(callback))(*args, **keywords)
+        """``True`` if the target is still alive."""
+        return self.callback() is not None
+    
+    def __init__(self, callback, on_death = None):
+        instance = getattr(callback, "im_self", None)
+        if instance is not None:
+            self.callback = weakref.ref(instance, self._died)
+            self.method = callback.im_func
+        else:
+            instance = callback
+            self.callback = weakref.ref(callback, self._died)
+            self.method = None
+        self.key = (id(instance), self.method)
+        self.on_death = on_death
+    
+    def __repr__(self):
+        return "<WeakRefCallback(callback=%r, method=%r)>" % (self.callback, self.method)
+    
+    def __call__(self, *args, **keywords):
+        callback = self.callback()
+        if callback is None:
+            return
+        if self.method is None:
+            return callback(*args, **keywords)
+        return self.method.__get__(callback, type(callback))(*args, **keywords)
     
     def __hash__(self):
-        return hash((self.callback, self.method))
+        return hash(self.key)
     
     def __eq__(self, other):
         if not isinstance(other, WeakRefCallback):
             return False
-        return hash(self) == hash(other)
+        return self.key == other.key and self.callback() is other.callback()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _died(self, ref):
+        if self.on_death is not None:
+            self.on_death(self)
  
+# Marks missing values, e.g. of the keyword arguments missing in a call,
+# which no filter matches.
+_MISSING = object()
+
+BATCH_ATTRIBUTE = '__nmevent_batch__'
+
+def batch_handler(function):
+    """Marks ``function`` as a handler receiving fires in batches.
+
+    A batch handler is called with a single argument, the list of
+    ``(sender, args, keywords)`` tuples of the fires. Fires of many
+    senders at once (see :meth:`Event.fire_many`) call it once with
+    the whole list, instead of once per fire, while an ordinary fire
+    calls it with a list of one. Works with methods, too.
+
+    >>> @nmevent.batch_handler
+    ... def handler(fires):
+    ...    print [args for sender, args, keywords in fires]
+    ...
+    >>> event = nmevent.Event()
+    >>> event += handler
+    >>> event.fire_many([(None, (1, )), (None, (2, ))])
+    [(1,), (2,)]
+    >>> event(None, 3)
+    [(3,)]
+    """
+    setattr(function, BATCH_ATTRIBUTE, True)
+    return function
+
+def _is_batch_handler(callback):
+    if isinstance(callback, WeakRefCallback):
+        callback = callback.method or callback.callback()
+    return getattr(callback, BATCH_ATTRIBUTE, False) is True
+
+class _BatchAdapter(object):
+    # Calls a batch handler with a batch of one fire; stands in for the
+    # handler in the snapshot of its collection.
+
+    __slots__ = ('handler', )
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def __call__(*args, **keywords):
+        self, args = args[0], args[1:]
+        return self.handler([(args[0] if args else None, args[1:], keywords)])
+
+def _join_stores(stores):
+    # Returns a new collection calling the callbacks of the ``stores``
+    # (None for an empty one) in turn, or None if they're all empty.
+    # It's built from their snapshots only, never from the mutable
+    # sets, so a callback in several stores is called once per store.
+    joined = None
+    for store in stores:
+        if store is None or (not store.snapshot and store.routes is None):
+            continue
+        if joined is None:
+            joined = CallbackStore()
+            joined.dispatch = store.dispatch
+            joined.routes = ()
+        joined.snapshot += store.snapshot
+        joined.singles += store.singles
+        joined.batches += store.batches
+        joined.routes += store.routes or ()
+    if joined is not None:
+        joined.callbacks.update(joined.singles + joined.batches)
+        joined.routes = joined.routes or None
+    return joined
+
+def _batch_items(items):
+    # Normalizes (sender, args[, keywords]) items to triples.
+    batch = []
+    for item in items:
+        if len(item) == 2:
+            item = (item[0], tuple(item[1]), {})
+        batch.append(item)
+    return batch
+
 class CallbackStore(object):
-    """Collection of callbacks."""
+    """Collection of callbacks.
+
+    Besides the set of callbacks, the collection keeps an immutable
+    snapshot of it (a tuple), which is rebuilt every time the collection
+    is modified. Calling the collection iterates over the snapshot, so
+    it's cheap and handlers may add or remove callbacks while being
+    called. Such changes take effect from the next call on.
+
+    .. attribute:: callbacks
+
+       Set of the callbacks.
+
+    .. attribute:: snapshot
+
+       Tuple of the callbacks, used for calling and iterating.
+       Batch handlers (see :func:`batch_handler`) are wrapped so that
+       calling them with the arguments of a single fire works.
+
+    .. attribute:: batches
+
+       Tuple of the batch handlers of the collection.
+
+    .. attribute:: singles
+
+       Tuple of the other callbacks, called by :meth:`call_many`
+       once per fire.
+
+    .. attribute:: changed
+
+       Function called (with the lock held) whenever the collection
+       changes, or ``None``.
+
+    .. attribute:: dispatch
+
+       Object calling the callbacks on behalf of the collection,
+       e.g. an :class:`ExecutorDispatch`, or ``None`` if they are
+       called directly.
+
+    Callbacks can also be added with filters (see :meth:`subscribe`),
+    so that they are only called when the keyword arguments match.
+
+    .. attribute:: filtered
+
+       Dictionary mapping ``(keys, values)`` pairs of tuples, i.e. the
+       filters, to the sets of callbacks, or ``None`` if there are none.
+
+    .. attribute:: routes
+
+       Index of :attr:`filtered` used for calling: tuple of
+       ``(keys, table)`` pairs, where the table maps the tuples of
+       values to the tuples of callbacks, or ``None``.
+    """
+
+    dispatch = None
+    filtered = None
+    routes = None
+    batches = ()
+    singles = ()
+    changed = None
     
     def __init__(self):
         """Constructor."""
         self.callbacks = set()
+        self.snapshot = ()
     
     def __iter__(self):
         """Returns the collection's iterator object."""
-        return iter(self.callbacks)
+        return iter(self.snapshot)
     
     def __iadd__(self, callback):
         return self.add(callback)
@@ -229,7 +555,9 @@ class CallbackStore(object):
         
         :param callback: callable object to be added
         """
-        self.callbacks.add(callback)
+        with _lock:
+            self.callbacks.add(callback)
+            self._update_snapshot()
         return self
     
     def remove(self, callback):
@@ -237,56 +565,329 @@ class CallbackStore(object):
 
         :param callback: callback to be removed
         """
-        self.callbacks.remove(callback)
+        with _lock:
+            self.callbacks.remove(callback)
+            self._update_snapshot()
+        return self
+
+    def _update_snapshot(self):
+        # Batch handlers are told apart here rather than when called.
+        batches = tuple(callback for callback in self.callbacks
+                        if _is_batch_handler(callback))
+        if not batches and not self.batches:
+            self.snapshot = self.singles = tuple(self.callbacks)
+        else:
+            self.batches = batches
+            self.singles = tuple(callback for callback in self.callbacks
+                                 if callback not in batches)
+            self.snapshot = self.singles + tuple(
+                _BatchAdapter(callback) for callback in batches)
+        self._modified()
+
+    def _modified(self):
+        # Lets the event drop the class chains built from this
+        # collection (see Event.class_chain).
+        if self.changed is not None:
+            self.changed()
+    
+    def subscribe(self, callback, **filters):
+        """Adds a callback called only for the matching keyword arguments.
+
+        The callback is called only if the keyword arguments the
+        collection is called with include all ``filters`` with equal
+        values. Without filters, this is the same as :meth:`add`.
+        Callbacks are looked up by the values of the keyword arguments,
+        so calling the collection doesn't need to check every filtered
+        callback.
+
+        :param callback: callable object to be added
+        :param filters: required values of the keyword arguments,
+                        which must be hashable
+        """
+        if not filters:
+            return self.add(callback)
+        keys = tuple(sorted(filters))
+        route = (keys, tuple(filters[key] for key in keys))
+        with _lock:
+            if self.filtered is None:
+                self.filtered = {}
+            self.filtered.setdefault(route, set()).add(callback)
+            self._update_routes()
+        return self
+
+    def unsubscribe(self, callback, **filters):
+        """Removes a callback added by :meth:`subscribe`.
+
+        :param callback: callback to be removed
+        :param filters: the same filters the callback was added with
+        :raises KeyError: if the callback wasn't added with the filters
+        """
+        if not filters:
+            return self.remove(callback)
+        keys = tuple(sorted(filters))
+        route = (keys, tuple(filters[key] for key in keys))
+        with _lock:
+            if self.filtered is None or route not in self.filtered:
+                raise KeyError(callback)
+            callbacks = self.filtered[route]
+            callbacks.remove(callback)
+            if not callbacks:
+                del self.filtered[route]
+            self._update_routes()
         return self
+
+    def _update_routes(self):
+        routes = {}
+        for (keys, values), callbacks in self.filtered.items():
+            routes.setdefault(keys, {})[values] = tuple(
+                _BatchAdapter(callback) if _is_batch_handler(callback)
+                else callback for callback in callbacks)
+        self.routes = tuple(routes.items()) or None
+        self._modified()
+
+    def select(self, keywords):
+        """Returns the tuple of callbacks to call with ``keywords``."""
+        routes = self.routes
+        if routes is None:
+            return self.snapshot
+        selected = self.snapshot
+        for keys, table in routes:
+            if len(keys) == 1:
+                values = (keywords.get(keys[0], _MISSING), )
+            else:
+                values = tuple(keywords.get(key, _MISSING) for key in keys)
+            try:
+                callbacks = table.get(values)
+            except TypeError:
+                # An unhashable value can't equal any of the filters.
+                continue
+            if callbacks is not None:
+                selected += callbacks
+        return selected
     
     def contains(self, callback):
         """Returns ``True`` is ``callback`` is in the collection.
 
         :param callback: callback to check for
         """
-        return callback in self.callbacks
+        if callback in self.callbacks:
+            return True
+        if self.filtered is None:
+            return False
+        return any(callback in callbacks for callbacks in self.filtered.values())
     
     def count(self):
         """Returns the number of callbacks in the collection."""
-        return len(self.callbacks)
+        count = len(self.callbacks)
+        if self.filtered is not None:
+            count += sum(len(callbacks) for callbacks in self.filtered.values())
+        return count
     
     def clear(self):
         """Removes all callbacks from collection."""
-        self.callbacks = set()
+        with _lock:
+            self.callbacks = set()
+            self.snapshot = self.singles = self.batches = ()
+            self.filtered = self.routes = None
+            self._modified()
     
     def call(self, *args, **keywords):
-        """Calls all callbacks with the given arguments."""
-        for callback in self.callbacks:
-            callback(*args, **keywords)
+        """Calls all callbacks with the given arguments.
+
+        If the collection has a :attr:`dispatch` object, it's left to
+        call the callbacks and whatever it returns is returned.
+        """
+        if self.dispatch is not None:
+            return self.dispatch.dispatch(self, args, keywords)
+        if self.routes is None:
+            for callback in self.snapshot:
+                callback(*args, **keywords)
+        else:
+            for callback in self.select(keywords):
+                callback(*args, **keywords)
+
+    def call_many(self, items):
+        """Calls the callbacks with the arguments of many fires.
+
+        Ordinary callbacks are called once per fire, batch handlers
+        once with the whole list. If the collection has a
+        :attr:`dispatch` object or filtered callbacks, each fire
+        is a separate :meth:`call`. With a :attr:`dispatch` object,
+        the list of what each call returned is returned.
+
+        :param items: iterable of ``(sender, args)`` or
+                      ``(sender, args, keywords)`` tuples
+        """
+        items = _batch_items(items)
+        if self.dispatch is not None or self.routes is not None:
+            results = [self.call(sender, *args, **keywords)
+                for sender, args, keywords in items]
+            if self.dispatch is not None:
+                return results
+            return
+        singles, batches = self.singles, self.batches
+        if singles:
+            for sender, args, keywords in items:
+                for callback in singles:
+                    callback(sender, *args, **keywords)
+        for callback in batches:
+            callback(items)
 
 class WeakRefCallbackStore(CallbackStore):
+    """Collection of weakly referenced callbacks.
+
+    The callbacks are wrapped in :class:`WeakRefCallback` objects,
+    so the collection doesn't keep them (or the instances of bound
+    methods) alive. When a callback dies, it's removed from the
+    collection right away, unless the thread it died in was changing
+    a collection at the time (the garbage collector may run anywhere).
+    Then it's removed by the next change or lookup of the collection,
+    and until then calling it does nothing.
+
+    .. attribute:: dead
+
+       List of the ``(callback, filters)`` pairs of the callbacks that
+       died but haven't been removed yet.
+    """
+
+    def __init__(self):
+        super(WeakRefCallbackStore, self).__init__()
+        self.dead = []
+
     def normalize(self, callback):
+        """Returns ``callback`` wrapped in :class:`WeakRefCallback`."""
         if isinstance(callback, WeakRefCallback):
             return callback
         return WeakRefCallback(callback)
     
-    def __init__(self):
-        self.callbacks = {}
-    
     def add(self, callback):
-        super(WeakRefCallbackStore, self).add(self.normalize(callback))
+        callback = self.normalize(callback)
+        store = weakref.ref(self)
+        def remove(callback):
+            store_ = store()
+            if store_ is not None:
+                store_._died(callback, None)
+        with _lock:
+            if callback not in self.callbacks:
+                callback.on_death = remove
+                super(WeakRefCallbackStore, self).add(callback)
+        return self
+
+    def _died(self, callback, filters):
+        # Only queues the callback if this thread holds the lock: it
+        # may be iterating over the very set the callback is in.
+        self.dead.append((callback, filters))
+        if not _lock._is_owned():
+            self._collect()
+
+    def _collect(self):
+        # Removes the dead callbacks, if there are any.
+        if self.dead:
+            with _lock:
+                if self.dead:
+                    self._update_snapshot()
+
+    def _update_snapshot(self):
+        routes = False
+        while self.dead:
+            callback, filters = self.dead.pop()
+            if filters is None:
+                self.callbacks.discard(callback)
+                continue
+            keys = tuple(sorted(filters))
+            route = (keys, tuple(filters[key] for key in keys))
+            callbacks = (self.filtered or {}).get(route)
+            if callbacks is not None and callback in callbacks:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del self.filtered[route]
+                routes = True
+        if routes:
+            self._update_routes()
+        super(WeakRefCallbackStore, self)._update_snapshot()
 
     def remove(self, callback):
-        super(WeakRefCallbackStore, self).remove(self.normalize(callback))
+        return super(WeakRefCallbackStore, self).remove(self.normalize(callback))
+
+    def subscribe(self, callback, **filters):
+        if not filters:
+            return self.add(callback)
+        callback = self.normalize(callback)
+        store = weakref.ref(self)
+        def remove(callback):
+            store_ = store()
+            if store_ is not None:
+                store_._died(callback, filters)
+        # Each subscription has its own wrapper (and so its own
+        # on_death); an equal wrapper already in the route is kept.
+        callback.on_death = remove
+        return super(WeakRefCallbackStore, self).subscribe(callback, **filters)
+
+    def unsubscribe(self, callback, **filters):
+        return super(WeakRefCallbackStore, self).unsubscribe(
+            self.normalize(callback), **filters)
 
     def contains(self, callback):
-        super(WeakRefCallbackStore, self).contains(self.normalize(callback))
+        self._collect()
+        return super(WeakRefCallbackStore, self).contains(self.normalize(callback))
 
-    def call(self, *args, **keywords):
-        all_alive = True
-        for callback in self.callbacks:
-            callback(*args, **keywords)
-            all_alive = all_alive and callback.is_alive
-        if not all_alive:
-            self.callbacks = set([c for c in self.callbacks if c.is_alive])
-
-class Event(object):
+    def count(self):
+        self._collect()
+        return super(WeakRefCallbackStore, self).count()
+
+class EventOperators(object):
+    """Methods deriving new events from an event.
+
+    This class is a base of :class:`Event`, :class:`InstanceEvent` and
+    :class:`DerivedEvent`, so the derived events can be derived from
+    in turn. Each method returns a :class:`DerivedEvent` observing this
+    event; the derived event subscribes to this one only while it has
+    handlers of its own.
+
+    >>> positions = example.x_changed.throttled(0.1) # doctest: +SKIP
+    >>> positions += handler # doctest: +SKIP
+
+    See also :func:`merge`.
+
+    The rate-limited events (see :class:`RateLimitedEvent`) call their
+    handlers from a timer thread, or from the thread of ``loop`` if an
+    asyncio event loop is given.
+    """
+
+    __slots__ = ()
+
+    def filter(self, predicate):
+        """Returns a :class:`FilteredEvent` of this event."""
+        return FilteredEvent(self, predicate)
+
+    def map(self, function):
+        """Returns a :class:`MappedEvent` of this event."""
+        return MappedEvent(self, function)
+
+    def stream(self, maxlen = 1024, overflow = 'drop_oldest'):
+        """Returns an :class:`EventStream` of this event.
+
+        The stream is opened by the ``with`` statement.
+        """
+        return EventStream(self, maxlen, overflow)
+
+    def throttled(self, interval, loop = None):
+        """Returns a :class:`ThrottledEvent` of this event."""
+        return ThrottledEvent(self, interval, loop)
+
+    def debounced(self, delay, loop = None):
+        """Returns a :class:`DebouncedEvent` of this event."""
+        return DebouncedEvent(self, delay, loop)
+
+    def sampled(self, interval, loop = None):
+        """Returns a :class:`SampledEvent` of this event."""
+        return SampledEvent(self, interval, loop)
+
+    def coalesced(self, key = None, interval = 0.05, loop = None):
+        """Returns a :class:`CoalescedEvent` of this event."""
+        return CoalescedEvent(self, key, interval, loop)
+
+class Event(EventOperators):
     """Subject in the observer pattern.
 
     This class represents the subject in the observer pattern.
@@ -302,21 +903,258 @@ class Event(object):
     ...    def fire(self):
     ...       self.event(self)
     ...
+
+    The event can optionally cache its bindings. When ``cached`` is
+    ``True``, each observed instance gets its bound :class:`InstanceEvent`
+    only once (when its first handler is added) and the same object is
+    returned by all subsequent accesses, instead of a new one being
+    created every time. Instances without handlers are left untouched.
+
+    >>> class Example(object):
+    ...    event = nmevent.Event(cached = True)
+    ...
+    >>> example = Example()
+    >>> example.event += lambda sender: None
+    >>> example.event is example.event
+    True
+
+    The cached bound event is stored along with the instance's handlers
+    (see :attr:`EVENTS_ATTRIBUTE`), so it lives as long as the instance.
+    It's not part of the instance's pickled or copied state, only the
+    handlers are.
+
+    The event can also hold its handlers by weak references (see
+    :class:`WeakRefCallbackStore`). Such handlers don't need to be
+    removed from the event by hand, they disappear when they die:
+
+    >>> class Observer(object):
+    ...    def handler(self, sender, **keywords):
+    ...       print "handler called"
+    ...
+    >>> class Example(object):
+    ...    event = nmevent.Event(weak = True)
+    ...
+    >>> example = Example()
+    >>> observer = Observer()
+    >>> example.event += observer.handler
+    >>> example.event()
+    handler called
+    >>> del observer
+    >>> len(example.event)
+    0
+
+    Finally, the handlers of the event can be run by an executor
+    (see :class:`ExecutorDispatch`). Firing such an event submits
+    the handlers and returns their futures instead of waiting for
+    them.
+
+    Besides being fired, the event can be posted (see :meth:`post`),
+    in which case the handlers are called later by the thread
+    draining an :class:`EventQueue`.
+
+    Instrumented events (see :class:`EventStats`) count their fires
+    and measure the latency of their handlers.
+
+    Handlers added to the unbound event, i.e. through the class,
+    observe all instances of the class and its subclasses: they're
+    called whenever the event bound to any of them is fired, along
+    with the instance's own handlers.
+
+    >>> class Base(object):
+    ...    event = nmevent.Event()
+    ...
+    >>> class Derived(Base):
+    ...    pass
+    ...
+    >>> def handler(sender, **keywords):
+    ...    print "fired by", type(sender).__name__
+    ...
+    >>> Base.event += handler
+    >>> Derived().event()
+    fired by Derived
+
+    The class handlers of each concrete class are joined along its
+    method resolution order the first time the class fires the event
+    (see :meth:`class_chain`), and rejoined only after they change.
+    A fire calls the sender's own handlers and then the class handlers,
+    so a handler added both to the class and to the instance is called
+    twice.
+
+    :param cached: ``True`` if the bound events should be cached
+    :param weak: ``True`` if the handlers should be referenced weakly
+    :param executor: :mod:`concurrent.futures` executor or
+                     :class:`ExecutorDispatch` object to run the
+                     handlers, ``None`` to run them synchronously
+    :param queue: :class:`EventQueue` the event is posted to,
+                  ``None`` for the default one
+    :param name: name of the event, used e.g. by :func:`stats`
+    :param instrument: ``True`` or an :class:`EventStats` object
+                       to instrument the event
+
+    .. attribute:: cached
+
+       ``True`` if the instances of this event's owner class cache their
+       bound events. Set it only through the constructor.
+
+    .. attribute:: weak
+
+       ``True`` if the event references its handlers weakly.
+       Set it only through the constructor.
+
+    .. attribute:: dispatch
+
+       :class:`ExecutorDispatch` object running the handlers or ``None``.
+       Set it only through the constructor.
+
+    .. attribute:: queue
+
+       :class:`EventQueue` object the event is posted to or ``None``.
+
+    .. attribute:: name
+
+       Name of the event or ``None``. The :func:`with_events` decorator
+       names the events of the class it decorates.
+
+    .. attribute:: stats
+
+       :class:`EventStats` object of an instrumented event, ``None``
+       otherwise. Set it only through the constructor.
     """
 
-    __slots__ = ('__handlers__', )
+    __slots__ = ('__handlers__', '__classes__', '__chains__', 'cached',
+        'weak', 'dispatch', 'queue', 'name', 'stats', )
 
     @property
     def handlers(self):
         """Collection of this event's handlers."""
         if self.__handlers__ is None:
-            self.__handlers__ = CallbackStore()
+            with _lock:
+                if self.__handlers__ is None:
+                    self.__handlers__ = self.create_handlers()
         return self.__handlers__
         
-    def __init__(self):
+    def __init__(self, cached = False, weak = False, executor = None,
+            queue = None, name = None, instrument = False):
         self.__handlers__ = None
+        self.__classes__ = None
+        self.__chains__ = None
+        self.cached = cached
+        self.weak = weak
+        self.queue = queue
+        self.name = name
+        self.dispatch = None
+        self.stats = None
+        if executor is not None:
+            self.dispatch = _executor_dispatch(executor)
+        if instrument:
+            if executor is not None:
+                raise ValueError, ("An event run by an executor "
+                    "can't be instrumented.")
+            if instrument is True:
+                instrument = EventStats()
+            instrument.attach(self)
+            self.stats = self.dispatch = instrument
+
+    def create_handlers(self):
+        """Creates a new, empty collection of handlers for this event."""
+        if self.weak:
+            handlers = WeakRefCallbackStore()
+        else:
+            handlers = CallbackStore()
+        if self.dispatch is not None:
+            handlers.dispatch = self.dispatch
+        return handlers
+
+    def class_handlers(self, clss, create = True):
+        """Returns the collection of handlers observing instances of ``clss``.
+
+        These are the handlers added to the event unbound to ``clss``.
+        The collection is created unless ``create`` is ``False``,
+        in which case ``None`` may be returned.
+
+        :param clss: class the handlers are bound to
+        :param create: ``False`` if the collection shouldn't be created
+        :returns: :class:`CallbackStore` object or ``None``
+        """
+        classes = self.__classes__
+        if classes is not None:
+            handlers = classes.get(clss)
+            if handlers is not None or not create:
+                return handlers
+        elif not create:
+            return None
+        with _lock:
+            if self.__classes__ is None:
+                self.__classes__ = {}
+            handlers = self.__classes__.get(clss)
+            if handlers is None:
+                handlers = self.create_handlers()
+                handlers.changed = self._invalidate_chains
+                self.__classes__[clss] = handlers
+                self.__chains__ = {}
+        return handlers
+
+    def _invalidate_chains(self):
+        # Called with the lock held when class handlers change.
+        self.__chains__ = {}
+
+    def class_chain(self, clss):
+        """Returns the class handlers called for instances of ``clss``.
+
+        The returned collection joins the class handlers of ``clss`` and
+        its base classes, in the method resolution order; it's computed
+        once and cached until any of the class handlers change.
+        Returns ``None`` if there are none.
+
+        :param clss: concrete class of the sender
+        :returns: :class:`CallbackStore` object or ``None``
+        """
+        chains = self.__chains__
+        if chains is None:
+            return None
+        chain = chains.get(clss, _MISSING)
+        if chain is _MISSING:
+            with _lock:
+                classes = self.__classes__
+                chain = _join_stores([classes[base]
+                    for base in inspect.getmro(clss) if base in classes])
+                self.__chains__[clss] = chain
+        return chain
+
+    def _with_classes(self, handlers, sender):
+        # Returns the single collection a Dispatch calls when the event
+        # bound to sender fires: a temporary join of its own handlers
+        # and the class chain. The fire paths use _call_classes instead.
+        chain = self.class_chain(sender.__class__)
+        if chain is None:
+            return handlers
+        if handlers is None:
+            return chain
+        return _join_stores((handlers, chain))
+
+    def _call_classes(self, handlers, chain, args, keywords):
+        # Calls the sender's own handlers and then the class chain,
+        # each through its own snapshot, so nothing per instance is
+        # joined or cached.
+        if self.dispatch is not None:
+            return self.dispatch.dispatch(_join_stores((handlers, chain)),
+                args, keywords)
+        if handlers is not None:
+            handlers.call(*args, **keywords)
+        chain.call(*args, **keywords)
 
     def __get__(self, obj, objtype = None):
+        if self.cached and obj is not None:
+            # Fast path: the cached bound event is read straight
+            # from the instance's event table.
+            try:
+                entry = obj.__dict__[EVENTS_ATTRIBUTE][
+                    obj.__class__.__dict__[LAYOUT_ATTRIBUTE][self]]
+            except (AttributeError, KeyError, IndexError):
+                pass
+            else:
+                if entry.__class__ is InstanceEvent and entry.im_sender is obj:
+                    return entry
         return self.bind(objtype, obj)
     
     def __set__(self, obj, value):
@@ -327,8 +1165,101 @@ class Event(object):
         raise AttributeError, "Events are read-only attributes."
 
     def bind(self, objtype, obj = None):
-        """Binds the event to a class and optionally an instance."""
-        return InstanceEvent(self, objtype, obj)
+        """Binds the event to a class and optionally an instance.
+
+        If the event is :attr:`cached`, the event bound to ``obj`` is
+        created once ``obj`` has handlers and then reused. Until then,
+        ``obj`` is left untouched and each binding is a new object.
+        """
+        if obj is None or not self.cached:
+            return InstanceEvent(self, objtype, obj)
+        try:
+            entry = self._find_instance_entry(obj)
+        except TypeError:
+            entry = None
+        if entry is None:
+            return InstanceEvent(self, objtype, obj)
+        if entry.__class__ is InstanceEvent:
+            if entry.im_sender is obj:
+                return entry
+            # The table was copied from another instance along with
+            # its bound events, which keep firing the other sender.
+            return InstanceEvent(self, objtype, obj)
+        # Handlers restored without their binding, e.g. by pickle.
+        with _lock:
+            events = _instance_events(obj)
+            ordinal = _event_ordinal(obj.__class__, self)
+            if events.__class__ is not list or events[ordinal] is not entry:
+                return InstanceEvent(self, objtype, obj)
+            bound = events[ordinal] = InstanceEvent(self, objtype, obj)
+            bound.im_handlers = entry
+        return bound
+
+    def instance_handlers(self, sender, create = True):
+        """Returns the collection of handlers bound to ``sender``.
+
+        The collection is created if the sender doesn't have one yet,
+        unless ``create`` is ``False``. In that case, ``None`` is
+        returned and the sender is left untouched.
+
+        :param sender: instance the handlers are bound to
+        :param create: ``False`` if the collection shouldn't be created
+        :returns: :class:`CallbackStore` object or ``None``
+        """
+        if create:
+            entry = self._instance_entry(type(sender), sender)
+        else:
+            entry = self._find_instance_entry(sender)
+        if entry.__class__ is InstanceEvent:
+            return entry.im_handlers
+        return entry
+
+    def _find_instance_entry(self, sender):
+        # Looks the sender's entry up without creating anything.
+        try:
+            events = sender.__dict__.get(EVENTS_ATTRIBUTE)
+        except AttributeError:
+            events = _instance_events(sender)
+        if events is None:
+            return None
+        # The layout is created before the table, except for senders
+        # unpickled before their class got a layout; such tables are
+        # treated as empty until the layout is created.
+        layout = sender.__class__.__dict__.get(LAYOUT_ATTRIBUTE)
+        if layout is None:
+            return None
+        ordinal = layout.get(self)
+        if ordinal is None or ordinal >= len(events):
+            return None
+        return events[ordinal]
+
+    def _instance_entry(self, objtype, sender, create = True):
+        # The sender's entry is the bound event if the event is cached,
+        # otherwise it's just the collection of handlers. Bound events
+        # are not cached in weak event tables, because they would keep
+        # their senders alive.
+        entry = self._find_instance_entry(sender)
+        if entry is not None or not create:
+            return entry
+        with _lock:
+            events = _instance_events(sender)
+            if events is None:
+                events = _create_instance_events(sender)
+            ordinal = _event_ordinal(sender.__class__, self)
+            if ordinal < len(events):
+                entry = events[ordinal]
+                if entry is not None:
+                    return entry
+            else:
+                size = len(_event_layout(sender.__class__))
+                events.extend([None] * (size - len(events)))
+            if self.cached and events.__class__ is list:
+                entry = InstanceEvent(self, objtype, sender)
+                entry.im_handlers = self.create_handlers()
+            else:
+                entry = self.create_handlers()
+            events[ordinal] = entry
+        return entry
     
     def add_handler(self, handler):
         """Adds a handler (observer) to this event.
@@ -349,31 +1280,242 @@ class Event(object):
         Removes a handler (observer) from the collection of
         this event's handlers.
         """
-        self.handlers.remove(handler)
+        if self.__handlers__ is None:
+            raise KeyError(handler)
+        self.__handlers__.remove(handler)
         return self
     __isub__ = remove_handler
 
+    def subscribe(self, handler, **filters):
+        """Adds a handler called only for the matching keyword arguments.
+
+        The handler is only called when the event is fired with all
+        the keyword arguments in ``filters`` and with equal values,
+        e.g. to observe a single property through ``property_changed``:
+
+        >>> example.property_changed.subscribe(handler, name = 'x') # doctest: +SKIP
+
+        Without filters, this is the same as :meth:`add_handler`.
+        See :meth:`CallbackStore.subscribe`.
+        """
+        self.handlers.subscribe(handler, **filters)
+        return self
+
+    def unsubscribe(self, handler, **filters):
+        """Removes a handler added by :meth:`subscribe`.
+
+        The filters must be the same the handler was added with.
+        """
+        if self.__handlers__ is None:
+            raise KeyError(handler)
+        self.__handlers__.unsubscribe(handler, **filters)
+        return self
+
     def has_handler(self, handler):
         """Returns True if handler is this event's handler.
         
         Returns True if the specified handler is contained
         in the collection of this event's handlers.
         """
-        return (handler in self.handlers)
+        return self.__handlers__ is not None and handler in self.__handlers__
     __contains__ = has_handler
+
+    def __len__(self):
+        if self.__handlers__ is None:
+            return 0
+        return len(self.__handlers__)
     
     def fire(self, sender, *args, **keywords):
         """Fires this event and calls all of its handlers.
+
+        Besides the event's own handlers, the class handlers observing
+        the sender (see :meth:`class_chain`) are called.
+
+        Returns ``None``, unless the handlers are run by an executor,
+        see :class:`ExecutorDispatch`, in which case their futures
+        are returned even if the event has no handlers.
         """
-        self.handlers.call(sender, *args, **keywords)
+        handlers = self.__handlers__
+        if self.__chains__ is not None:
+            chain = self.class_chain(sender.__class__)
+            if chain is not None:
+                return self._call_classes(handlers, chain,
+                    (sender, ) + args, keywords)
+        if handlers is not None:
+            return handlers.call(sender, *args, **keywords)
+        if self.dispatch is not None:
+            return self.dispatch.dispatch(None, (sender, ) + args, keywords)
     __call__ = fire
+
+    def fire_many(self, items):
+        """Fires this event many times at once.
+
+        Works like calling :meth:`fire` for each item, except that
+        the batch handlers (see :func:`batch_handler`) are called just
+        once, with all of the fires.
+
+        Returns ``None``, unless the handlers are run by an executor
+        (see :class:`ExecutorDispatch`), in which case the list of what
+        :meth:`fire` returns for each item is returned.
+
+        :param items: iterable of ``(sender, args)`` or
+                      ``(sender, args, keywords)`` tuples
+        """
+        if self.dispatch is not None:
+            return self._dispatch_many(items, lambda sender: self.__handlers__)
+        if self.__chains__ is None:
+            if self.__handlers__ is not None:
+                self.__handlers__.call_many(items)
+            return
+        self._call_many(items, lambda sender: self.__handlers__)
+
+    def _dispatch_many(self, items, find):
+        # Fires the items one by one through the dispatch object,
+        # returning the list of what each fire returned.
+        results = []
+        for sender, args, keywords in _batch_items(items):
+            handlers = self._with_classes(find(sender), sender)
+            results.append(self.dispatch.dispatch(handlers,
+                (sender, ) + args, keywords))
+        return results
+
+    def _call_many(self, items, find):
+        # Calls the handlers returned by find(sender) and the class
+        # handlers, each collection once with all of its items.
+        batches = collections.OrderedDict()
+        chains = self.__chains__ is not None
+        for item in _batch_items(items):
+            sender = item[0]
+            targets = [find(sender)]
+            if chains:
+                targets.append(self.class_chain(sender.__class__))
+            for handlers in targets:
+                if handlers is None:
+                    continue
+                batch = batches.get(id(handlers))
+                if batch is None:
+                    batch = batches[id(handlers)] = (handlers, [])
+                batch[1].append(item)
+        for handlers, batch in batches.itervalues():
+            handlers.call_many(batch)
+
+    def fire_bound(self, sender, *args, **keywords):
+        """Fires this event bound to ``sender``.
+
+        Calls the handlers bound to ``sender``, the same way
+        ``sender.event(*args, **keywords)`` would, except that no
+        bound event gets created. If the sender has no handlers,
+        nothing is allocated and the sender is left untouched.
+        """
+        handlers = self._find_instance_entry(sender)
+        if handlers.__class__ is InstanceEvent:
+            handlers = handlers.im_handlers
+        if self.__chains__ is not None:
+            chain = self.class_chain(sender.__class__)
+            if chain is not None:
+                return self._call_classes(handlers, chain,
+                    (sender, ) + args, keywords)
+        if handlers is not None:
+            return handlers.call(sender, *args, **keywords)
+        if self.dispatch is not None:
+            return self.dispatch.dispatch(None, (sender, ) + args, keywords)
+
+    def fire_bound_many(self, items):
+        """Fires this event bound to the senders of ``items``.
+
+        Works like calling :meth:`fire_bound` for each item, except
+        that the batch handlers of each sender are called just once,
+        with all of its fires. Returns what :meth:`fire_many` would.
+
+        :param items: iterable of ``(sender, args)`` or
+                      ``(sender, args, keywords)`` tuples
+        """
+        if self.dispatch is not None:
+            return self._dispatch_many(items, self._instance_store)
+        self._call_many(items, self._instance_store)
+
+    def _instance_store(self, sender):
+        # Like instance_handlers(sender, False), for cached events too.
+        handlers = self._find_instance_entry(sender)
+        if handlers.__class__ is InstanceEvent:
+            handlers = handlers.im_handlers
+        return handlers
+
+    def fire_async(self, sender, *args, **keywords):
+        """Fires this event and returns an awaitable future.
+
+        Works like :meth:`fire`, except that the handlers may be
+        coroutine functions. Ordinary handlers are called right away,
+        the coroutines (or futures) returned by the others are scheduled
+        to run concurrently on the event loop. The returned future
+        completes when all of them do. Use an :class:`AsyncDispatch`
+        object to select other semantics.
+
+        Requires :mod:`asyncio` or its backport, :mod:`trollius`.
+        """
+        return AsyncDispatch()(self, sender, *args, **keywords)
+
+    def fire_in(self, executor, sender, *args, **keywords):
+        """Fires this event, running its handlers in ``executor``.
+
+        Works like :meth:`fire`, except that each handler is submitted
+        to the executor. Returns the list of the handlers' futures.
+
+        :param executor: :mod:`concurrent.futures` executor or
+                         :class:`ExecutorDispatch` object
+        """
+        return _executor_dispatch(executor)(self, sender, *args, **keywords)
+
+    def post(self, sender, *args, **keywords):
+        """Posts this event to its :attr:`queue`.
+
+        Works like :meth:`fire`, except that the handlers are called
+        later, by whoever drains the queue (see :class:`EventQueue`).
+        If the event has no queue, the one returned by
+        :func:`default_queue` is used.
+
+        :returns: ``False`` if the notification was dropped,
+                  ``True`` otherwise
+        """
+        queue = self.queue
+        if queue is None:
+            queue = default_queue()
+        return queue(self, sender, *args, **keywords)
+
+    def _dispatch_target(self, args):
+        # Returns the handlers called by fire(*args) and their arguments.
+        if self.__chains__ is not None:
+            return self._with_classes(self.__handlers__, args[0]), args
+        return self.__handlers__, args
+
+    def is_observed(self, sender):
+        """Returns ``True`` if the event bound to ``sender`` has handlers.
+
+        In other words, returns ``True`` if :meth:`fire_bound` would call
+        any handlers, including the class handlers observing the sender.
+        The check doesn't allocate anything.
+        """
+        if (self.__chains__ is not None and
+                self.class_chain(sender.__class__) is not None):
+            return True
+        entry = self._find_instance_entry(sender)
+        if entry is None:
+            return False
+        if entry.__class__ is InstanceEvent:
+            entry = entry.im_handlers
+        return len(entry.snapshot) > 0 or entry.routes is not None
     
     def disconnect(self):
         """Disconnects this event from all handlers.
+
+        Removes the event's own handlers and the class handlers.
         """
         self.handlers.clear()
+        with _lock:
+            for handlers in (self.__classes__ or {}).values():
+                handlers.clear()
 
-class InstanceEvent(object):
+class InstanceEvent(EventOperators):
     """Bound or unbound event.
 
     In Python, unbound actually means bound to a class.
@@ -411,9 +1553,14 @@ class InstanceEvent(object):
        The following condition must be always true:
 
        >>> isinstance(self.im_sender, self.im_class) # doctest: +SKIP
+
+    .. attribute:: im_handlers
+
+       Handlers of a cached bound event (see :attr:`Event.cached`),
+       ``None`` otherwise.
     """
     
-    __slots__ = ('im_event', 'im_class', 'im_sender', )
+    __slots__ = ('im_event', 'im_class', 'im_sender', 'im_handlers', )
 
     @property
     def is_bound(self):
@@ -422,58 +1569,184 @@ class InstanceEvent(object):
 
     @property
     def handlers(self):
-        """:class:`CallbackStore` object that stores this event's handlers."""
-        if not self.is_bound:
-            return self.im_event.handlers
-        
-        sender = self.im_sender
-        events = sender.__dict__.setdefault(EVENTS_ATTRIBUTE, {})
-        handlers = events.setdefault(id(self.im_event), CallbackStore())
-        return handlers
+        """:class:`CallbackStore` object that stores this event's handlers.
+
+        For an unbound event, these are the class handlers of
+        :attr:`im_class` (see :meth:`Event.class_handlers`). Note that
+        accessing this property creates the collection if it doesn't
+        exist yet.
+        """
+        if self.im_handlers is not None:
+            return self.im_handlers
+        if not self.is_bound:
+            return self.im_event.class_handlers(self.im_class)
+        return self.im_event.instance_handlers(self.im_sender)
+
+    def _find_handlers(self):
+        # Like the handlers property, but returns None instead
+        # of creating the collection.
+        if self.im_handlers is not None:
+            return self.im_handlers
+        if not self.is_bound:
+            return self.im_event.class_handlers(self.im_class, False)
+        return self.im_event.instance_handlers(self.im_sender, False)
 
     def __init__(self, event, clss, sender = None):
         self.im_event = event
         self.im_class = clss
         self.im_sender = sender
+        self.im_handlers = None
     
     def __call__(self, *args, **keywords):
         sender = self.im_sender
         if sender is None:
-            if len(args) < 1:
-                raise TypeError, ("Unbound event must be called with "
-                    "at least 1 positional argument representing the sender.")
-            if type(args[0]) is not self.im_class:
-                raise TypeError, ("This unbound event must be called with "
-                    "%s instance as the first argument." % 
-                        (self.im_class.__name__))
-            sender = args[0]
-            args = args[1:]
-            return self.im_event.bind(self.im_class, sender)(*args, **keywords)
-        return self.handlers(sender, *args, **keywords)
+            self._check_sender(args)
+            return self.im_event.fire_bound(*args, **keywords)
+        handlers = self._find_handlers()
+        event = self.im_event
+        if event.__chains__ is not None:
+            chain = event.class_chain(sender.__class__)
+            if chain is not None:
+                return event._call_classes(handlers, chain,
+                    (sender, ) + args, keywords)
+        if handlers is not None:
+            return handlers.call(sender, *args, **keywords)
+        if event.dispatch is not None:
+            return event.dispatch.dispatch(None, (sender, ) + args, keywords)
+
+    def _check_sender(self, args):
+        # Checks the arguments an unbound event is called with.
+        if len(args) < 1:
+            raise TypeError, ("Unbound event must be called with "
+                "at least 1 positional argument representing the sender.")
+        if not isinstance(args[0], self.im_class):
+            raise TypeError, ("This unbound event must be called with "
+                "%s instance as the first argument." % 
+                    (self.im_class.__name__))
+
+    def fire_many(self, items):
+        """Fires the event many times at once.
+
+        An unbound event fires the event bound to the sender of each
+        item (see :meth:`Event.fire_bound_many`); a bound event calls
+        its handlers with the items as they are. Returns what
+        :meth:`Event.fire_many` would.
+
+        :param items: iterable of ``(sender, args)`` or
+                      ``(sender, args, keywords)`` tuples
+        """
+        if self.im_sender is None:
+            items = _batch_items(items)
+            for item in items:
+                self._check_sender(item[:1])
+            return self.im_event.fire_bound_many(items)
+        event = self.im_event
+        if event.dispatch is not None:
+            return event._dispatch_many(items, lambda sender: self._find_handlers())
+        if event.__chains__ is not None:
+            return event._call_many(items, lambda sender: self._find_handlers())
+        handlers = self._find_handlers()
+        if handlers is not None:
+            handlers.call_many(items)
+
+    def fire_async(self, *args, **keywords):
+        """Fires the event and returns an awaitable future.
+
+        Works like calling the event, except that the handlers may be
+        coroutine functions. See :meth:`Event.fire_async`.
+        """
+        return AsyncDispatch()(self, *args, **keywords)
+
+    def fire_in(self, executor, *args, **keywords):
+        """Fires the event, running its handlers in ``executor``.
+
+        Works like calling the event, except that the handlers are
+        submitted to the executor. See :meth:`Event.fire_in`.
+        """
+        return _executor_dispatch(executor)(self, *args, **keywords)
+
+    def post(self, *args, **keywords):
+        """Posts the event instead of calling it.
+
+        See :meth:`Event.post`.
+        """
+        queue = self.im_event.queue
+        if queue is None:
+            queue = default_queue()
+        return queue(self, *args, **keywords)
+
+    def _dispatch_target(self, args):
+        # Returns the handlers called by self(*args) and their arguments.
+        event = self.im_event
+        if self.im_sender is None:
+            self._check_sender(args)
+            handlers, sender = event._instance_store(args[0]), args[0]
+        else:
+            handlers, sender = self._find_handlers(), self.im_sender
+            args = (sender, ) + args
+        if event.__chains__ is not None:
+            handlers = event._with_classes(handlers, sender)
+        return handlers, args
     
     def __iadd__(self, handler):
-        if self.is_bound:
-            self.handlers.add(handler)
-        else:
-            self.im_event += handler
-        return self
+        self.handlers.add(handler)
+        return self._assigned()
 
     def __isub__(self, handler):
-        if self.is_bound:
-            self.handlers.remove(handler)
-        else:
-            self.im_event -= handler
+        handlers = self._find_handlers()
+        if handlers is None:
+            raise KeyError(handler)
+        handlers.remove(handler)
+        return self._assigned()
+
+    def _assigned(self):
+        # ``Class.event += handler`` assigns the result to the class
+        # attribute, which must stay the event (the descriptor).
+        if self.im_sender is None:
+            return self.im_event
+        return self
+
+    def subscribe(self, handler, **filters):
+        """Adds a handler called only for the matching keyword arguments.
+
+        See :meth:`Event.subscribe`.
+        """
+        self.handlers.subscribe(handler, **filters)
+        return self
+
+    def unsubscribe(self, handler, **filters):
+        """Removes a handler added by :meth:`subscribe`."""
+        handlers = self._find_handlers()
+        if handlers is None:
+            raise KeyError(handler)
+        handlers.unsubscribe(handler, **filters)
         return self
 
     def __contains__(self, handler):
-        if self.is_bound:
-            return handler in self.handlers
-        else:
-            return handler in self.im_event
+        handlers = self._find_handlers()
+        return handlers is not None and handler in handlers
+
+    def __len__(self):
+        handlers = self._find_handlers()
+        if handlers is None:
+            return 0
+        return len(handlers)
 
     def __getattr__(self, name):
+        # The im_* slots are only missing from a half-built object,
+        # e.g. while unpickling; don't look them up in the event.
+        if name.startswith('im_'):
+            raise AttributeError, name
         return getattr(self.im_event, name)
 
+    def __reduce__(self):
+        # A bound event cached in its sender's event table is pickled
+        # (and copied) as just its handlers: the binding belongs to
+        # the sender and is rebuilt by Event.bind.
+        if self.im_handlers is None:
+            raise TypeError, "Events can't be pickled."
+        return (_identity, (self.im_handlers, ))
+
     def __str__(self):
         if self.is_bound:
             return "<bound event>"
@@ -490,7 +1763,130 @@ class InstanceEvent(object):
         
         if self.is_bound:
             return self
-        return InstanceEvent(self.im_event, self.im_class, obj)
+        return self.im_event.bind(self.im_class, obj)
+
+    def fire_bound(self, sender, *args, **keywords):
+        """Fires the event bound to ``sender``.
+
+        Works like :meth:`Event.fire_bound`. If this event is already
+        bound, it's simply fired, which is consistent with :meth:`bind`.
+        """
+        if self.is_bound:
+            return self(*args, **keywords)
+        return self.im_event.fire_bound(sender, *args, **keywords)
+
+    def is_observed(self, sender):
+        """Returns ``True`` if the event bound to ``sender`` has handlers.
+
+        Works like :meth:`Event.is_observed`. If this event is already
+        bound, ``sender`` is ignored.
+        """
+        if self.im_sender is not None:
+            return self.im_event.is_observed(self.im_sender)
+        return self.im_event.is_observed(sender)
+
+class ChangeDetector(object):
+    """Strategy deciding whether the value of a :class:`Property` changed.
+
+    This base class compares the values for equality. When a property
+    is being set, :meth:`snapshot` is called with the old value before
+    the setter function is called, and :meth:`changed` is called with
+    the snapshot and the new value after it.
+    """
+
+    def snapshot(self, value):
+        """Returns what :meth:`changed` needs to know about the old value."""
+        return value
+
+    def changed(self, snapshot, value):
+        """Returns ``True`` if ``value`` differs from the snapshot."""
+        return snapshot != value
+
+class IdentityChangeDetector(ChangeDetector):
+    """Considers the value changed if it's a different object.
+
+    The comparison takes constant time, no matter how big the values
+    are, and works with values that can't be compared for equality
+    (e.g. NumPy arrays).
+    """
+
+    def changed(self, snapshot, value):
+        return snapshot is not value
+
+class AlwaysChangeDetector(ChangeDetector):
+    """Considers the value changed every time the property is set."""
+
+    def snapshot(self, value):
+        return None
+
+    def changed(self, snapshot, value):
+        return True
+
+class KeyChangeDetector(ChangeDetector):
+    """Compares the values by a key function.
+
+    :param key: function that takes a value and returns the key
+                to be compared for equality
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def snapshot(self, value):
+        return self.key(value)
+
+    def changed(self, snapshot, value):
+        return snapshot != self.key(value)
+
+class VersionChangeDetector(ChangeDetector):
+    """Compares the values by identity and version counter.
+
+    Meant for mutable buffers that count their modifications in
+    an attribute. The value is considered changed if it's a different
+    object, or if its version differs from the version the old value
+    had before the setter function was called (e.g. because the setter
+    copied the new data into the buffer).
+
+    :param attribute: name of the version counter attribute
+    """
+
+    def __init__(self, attribute = 'version'):
+        self.attribute = attribute
+
+    def snapshot(self, value):
+        return (value, getattr(value, self.attribute, None))
+
+    def changed(self, snapshot, value):
+        old_value, old_version = snapshot
+        return (old_value is not value or
+            old_version != getattr(value, self.attribute, None))
+
+CHANGE_DETECTORS = {
+    'equality': ChangeDetector,
+    'identity': IdentityChangeDetector,
+    'always':   AlwaysChangeDetector,
+    'version':  VersionChangeDetector,
+}
+
+def change_detector(compare):
+    """Returns a :class:`ChangeDetector` for the given ``compare`` value.
+
+    :param compare: ``None`` (the same as ``'equality'``), name of
+                    a detector in :data:`CHANGE_DETECTORS`, key function
+                    (see :class:`KeyChangeDetector`), or an object with
+                    the :class:`ChangeDetector` interface
+    :returns: :class:`ChangeDetector` object
+    """
+    if compare is None:
+        return ChangeDetector()
+    if isinstance(compare, basestring):
+        try:
+            return CHANGE_DETECTORS[compare]()
+        except KeyError:
+            raise ValueError, "Unknown change detector %r." % (compare, )
+    if hasattr(compare, 'changed') and hasattr(compare, 'snapshot'):
+        return compare
+    return KeyChangeDetector(compare)
 
 class Property(object):
     """Eventful property descriptor.
@@ -506,6 +1902,7 @@ class Property(object):
     :param fdel: deleter function
     :param changed: value changed notification event
     :param property_changed: a value changed notification event
+    :param compare: change detection strategy (see :func:`change_detector`)
 
     Usage:
 
@@ -580,6 +1977,39 @@ class Property(object):
        This event has been inspired by the .NET framework's
        ``INotifyPropertyChanged`` interface (see
        http://msdn.microsoft.com/en-US/library/system.componentmodel.inotifypropertychanged.aspx)
+
+    .. attribute:: detector
+
+       :class:`ChangeDetector` deciding whether the value changed,
+       or ``None`` if the values are simply compared for equality.
+
+       By default, the old and new values are compared using the ``!=``
+       operator, which may be expensive for big values and doesn't work
+       at all for values like NumPy arrays. Other strategies can be
+       selected by the ``compare`` parameter:
+
+       >>> class Example(object):
+       ...    @nmevent.nmproperty(compare = 'identity')
+       ...    def items(self):
+       ...       return self._items
+       ...
+       ...    @items.setter
+       ...    def items(self, value):
+       ...       self._items = value
+       ...
+       ...    items_changed = nmevent.Event()
+       ...    items.changed = items_changed
+       ...
+       ...    def __init__(self):
+       ...       self._items = []
+       ...
+       >>> def handler(sender, **keywords):
+       ...    print "items changed"
+       ...
+       >>> example = Example()
+       >>> example.items_changed += handler
+       >>> example.items = [] # equal, but not the same list
+       items changed
     """
     
     @property
@@ -595,7 +2025,7 @@ class Property(object):
         return None
     
     def __init__(self, fget = None, fset = None, fdel = None,
-                 changed = None, property_changed = None):
+                 changed = None, property_changed = None, compare = None):
         """Constructor."""
         self.fget = fget
         self.fset = fset
@@ -603,6 +2033,11 @@ class Property(object):
         
         self.changed = changed
         self.property_changed = property_changed
+
+        if compare is None:
+            self.detector = None
+        else:
+            self.detector = change_detector(compare)
     
     def __get__(self, obj, objtype = None):
         if obj is None:
@@ -614,26 +2049,61 @@ class Property(object):
     def __set__(self, obj, value):
         if self.fset is None:
             raise AttributeError, "Can't set attribute."
-        if self.fget is None:
+        if self.fget is None or not self.is_observed(obj):
             self.fset(obj, value)
             return
         old_value = self.fget(obj)
+        detector = self.detector
+        if detector is None:
+            self.fset(obj, value)
+            if old_value != value:
+                self.fire_changed(obj.__class__, obj, old_value)
+            return
+        snapshot = detector.snapshot(old_value)
         self.fset(obj, value)
-        if old_value != value:
-            self.fire_changed(obj.__class__, obj, old_value)
+        if detector.changed(snapshot, value):
+            self.fire_changed(obj.__class__, obj, old_value, snapshot)
     
     def __delete__(self, obj):
         if self.fdel is None:
             raise AttributeError, "Can't delete attribute."
         self.fdel(obj)
     
-    def fire_changed(self, objtype, obj, old_value):
-        changed = self.changed and self.changed.bind(objtype, obj)
-        if changed:
-            changed(old_value = old_value)
-        property_changed = self.property_changed and self.property_changed.bind(objtype, obj)
-        if self.property_changed:
-            property_changed(old_value = old_value, name = self.name)
+    def is_observed(self, obj):
+        """Returns ``True`` if any handlers watch the property of ``obj``.
+
+        If nothing watches the property, there is no need to retrieve
+        and compare the old value when it's being set, so only
+        :attr:`fset` gets called.
+        """
+        changed = self.changed
+        if changed is not None and changed.is_observed(obj):
+            return True
+        property_changed = self.property_changed
+        if property_changed is not None and property_changed.is_observed(obj):
+            return True
+        # Changes inside a batch are recorded for the batch's handlers.
+        return _batch_count > 0 and _find_batch(obj) is not None
+    
+    def fire_changed(self, objtype, obj, old_value, snapshot = _MISSING):
+        """Fires the change notification events.
+
+        If ``obj`` takes part in a :func:`batch`, the change is recorded
+        and the events are fired when the batch ends.
+
+        :param snapshot: the :attr:`detector`'s snapshot of ``old_value``
+                         taken before the value was set, if any
+        """
+        if _batch_count > 0:
+            batch = _find_batch(obj)
+            if batch is not None:
+                batch.record(self, obj, old_value, snapshot)
+                return
+        if self.changed is not None:
+            self.changed.fire_bound(obj, old_value = old_value)
+        if self.property_changed is not None:
+            self.property_changed.fire_bound(obj, old_value = old_value,
+                                             name = self.name)
     
     def setter(self, function):
         """Sets the setter function and returns self.
@@ -678,7 +2148,7 @@ class Property(object):
         self.fdel = function
         return self
     
-def nmproperty(function):
+def nmproperty(function = None, **options):
     """Eventful property decorator.
     
     Creates new :class:`Property` object using the decorated method
@@ -717,15 +2187,23 @@ def nmproperty(function):
     The :attr:`Property.changed` events can be automatically created and set
     by the :func:`with_events` decorator when used on the class.
     
+    The decorator can also be called with keyword arguments of the
+    :class:`Property` constructor, e.g. ``@nmproperty(compare = 'identity')``,
+    in which case it returns the actual decorator.
+    
     :param function: function to be used as the property getter function
     :returns: new `Property` object
     """
-    return Property(function)
+    if function is None:
+        return lambda function: Property(function, **options)
+    return Property(function, **options)
 
-def with_events(clss):
+def with_events(clss = None, **options):
     """Decorates a class with some automatic event slots.
 
     :param clss: class object to be decorated
+    :param options: keyword arguments passed to the constructor of
+                    each created :class:`Event` (e.g. ``cached``)
     :returns:    decorated class
 
     Automatically adds property change notification events of the name
@@ -771,26 +2249,97 @@ def with_events(clss):
     events that are raised when the value of ``Example.x`` changes.
     ``x_changed`` gets called only when ``Example.x`` changes,
     ``property_changed`` gets called when any property changes.
+
+    The class also gets a ``properties_changed`` event, which is fired
+    by aggregating batches (see :func:`batch`).
+
+    All events of the class that don't have a name yet are named
+    after the class and their attribute, e.g. ``"Example.x_changed"``.
+
+    When called with keyword arguments only, the function returns
+    a decorator that passes them on to the created events:
+
+    >>> @nmevent.with_events(cached = True)
+    ... class CachedExample(object):
+    ...    @nmevent.nmproperty
+    ...    def x(self):
+    ...       return self._x
+    ...
+    >>> example = CachedExample()
+    >>> example.x_changed += lambda sender, **keywords: None
+    >>> example.x_changed is example.x_changed
+    True
     """
     
-    property_changed = Event()
+    if clss is None:
+        return lambda clss: with_events(clss, **options)
+
+    property_changed = Event(**options)
     setattr(clss, "property_changed", property_changed)
+    setattr(clss, "properties_changed", Event(**options))
 
     for name, attr in clss.__dict__.items():
         changed_attr = "%s_changed" % name
         if isinstance(attr, __builtin__.property):
-            setattr(clss, changed_attr, Event())
+            setattr(clss, changed_attr, Event(**options))
         elif isinstance(attr, Property):
-            setattr(clss, changed_attr, Event())
+            setattr(clss, changed_attr, Event(**options))
             # Use getattr to bind the event to the class.
             attr.changed = getattr(clss, changed_attr)
             attr.property_changed = property_changed
+
+    for name, attr in clss.__dict__.items():
+        if isinstance(attr, Event) and attr.name is None:
+            attr.name = "%s.%s" % (clss.__name__, name)
     return clss
 
-def with_properties(clss):
+_GETTER_TEMPLATE = """\
+def %(name)s(self):
+    try:
+        return self.%(attr)s
+    except AttributeError:
+        self.%(attr)s = None
+        return None
+"""
+
+_SETTER_TEMPLATE = """\
+def %(name)s(self, value):
+    self.%(attr)s = value
+"""
+
+def _compile_accessor(template, name, attr):
+    """Compiles an accessor function from one of the templates."""
+    namespace = {}
+    exec template % {'name': name, 'attr': attr} in namespace
+    return namespace[name]
+
+def _with_slots(clss, attrs):
+    """Returns a copy of ``clss`` that stores ``attrs`` in ``__slots__``.
+
+    The copy's slots also include :attr:`EVENTS_ATTRIBUTE`, unless
+    the class already has it.
+    """
+    namespace = dict(clss.__dict__)
+    slots = namespace.get('__slots__', ())
+    if isinstance(slots, basestring):
+        slots = (slots, )
+    slots = list(slots)
+    for name in slots + ['__dict__', '__weakref__', LAYOUT_ATTRIBUTE]:
+        namespace.pop(name, None)
+    for attr in attrs:
+        if attr not in slots and not hasattr(clss, attr):
+            slots.append(attr)
+    if not hasattr(clss, EVENTS_ATTRIBUTE):
+        slots.append(EVENTS_ATTRIBUTE)
+    namespace['__slots__'] = tuple(slots)
+    return type(clss)(clss.__name__, clss.__bases__, namespace)
+
+def with_properties(clss = None, slots = False):
     """Decorates a class with automatic "private" attributes.
     
     :param clss: class object to decorate.
+    :param slots: ``True`` if the "private" attributes should be
+                  stored in ``__slots__``
     :returns:    decorated class
     
     For every :class:`Property` instance within the class'
@@ -800,7 +2349,11 @@ def with_properties(clss):
     that the same name as the property prepended with an
     underscore. In other words, for a property ``foo``,
     you get an attribute called ``_foo`` where the actual
-    value is stored.
+    value is stored. The getter returns ``None`` if the
+    attribute hasn't been set yet.
+
+    The getters and setters are compiled for each attribute, so they
+    access it directly, as if they were written by hand.
     
     Usage:
     
@@ -825,27 +2378,43 @@ def with_properties(clss):
     ... class NextExample(object):
     ...     bar = nmevent.Property()
     ...
+
+    If ``slots`` is ``True``, the decorator returns a new class, which
+    stores the "private" attributes and the event data (see
+    :attr:`EVENTS_ATTRIBUTE`) in ``__slots__``. Its instances only
+    save memory if all the bases use ``__slots__`` too. Apply
+    :func:`with_events` after this decorator, so that the events
+    get bound to the new class.
+
+    Unless a base class has one, the instances of the new class have
+    no ``__dict__``, so setting any other attribute (e.g. in
+    ``__init__``) raises :exc:`AttributeError`. List such attributes
+    in the class' own ``__slots__``, which are kept, or add
+    ``'__dict__'`` to them to allow any attribute.
+
+    >>> @nmevent.with_events
+    ... @nmevent.with_properties(slots = True)
+    ... class SlotExample(object):
+    ...     bar = nmevent.Property()
+    ...
+    >>> SlotExample.__slots__
+    ('_bar', '__nmevents__')
     """
-    
-    def make_getter(attr):
-        def getter(self):
-            if not hasattr(self, attr):
-                setattr(self, attr, None)
-            return getattr(self, attr)
-        return getter
 
-    def make_setter(attr):
-        def setter(self, value):
-            setattr(self, attr, value)
-        return setter
+    if clss is None:
+        return lambda clss: with_properties(clss, slots)
     
-    for name, attr in clss.__dict__.items():
+    attrs = []
+    for name, attr in sorted(clss.__dict__.items()):
         if isinstance(attr, Property):
             private_attr = "_%s" % name
+            attrs.append(private_attr)
             if not attr.fget:
-                attr.fget = make_getter(private_attr)
+                attr.fget = _compile_accessor(_GETTER_TEMPLATE, name, private_attr)
             if not attr.fset:
-                attr.fset = make_setter(private_attr)
+                attr.fset = _compile_accessor(_SETTER_TEMPLATE, name, private_attr)
+    if slots:
+        clss = _with_slots(clss, attrs)
     return clss
 
 def decorated(clss):
@@ -854,6 +2423,2406 @@ def decorated(clss):
     """
     return with_events(with_properties(clss))
 
+_batch_local = threading.local()
+_batch_lock = threading.Lock()
+_batch_count = 0
+
+def _find_batch(sender):
+    """Returns the current thread's batch ``sender`` takes part in."""
+    batches = getattr(_batch_local, 'batches', None)
+    if not batches:
+        return None
+    return batches.get(id(sender))
+
+class Batch(object):
+    """Group of senders whose property change notifications are deferred.
+
+    This class is meant to be instantiated by the :func:`batch` function.
+    See its documentation for details.
+
+    :param senders: sequence of senders taking part in the batch
+    :param aggregate: ``True`` if the changes should be reported by
+                      the ``properties_changed`` event
+
+    .. attribute:: changes
+
+       List of ``(sender, properties, old_values)`` tuples, one for
+       each sender owned by the batch, where ``properties`` is the list
+       of properties changed so far and ``old_values`` is a dictionary
+       mapping them to their values before the first change.
+    """
+
+    def __init__(self, senders, aggregate = False):
+        self.senders = senders
+        self.aggregate = aggregate
+        self.changes = []
+        self._changes = {}
+        self._snapshots = {}
+
+    def __enter__(self):
+        global _batch_count
+        batches = getattr(_batch_local, 'batches', None)
+        if batches is None:
+            batches = _batch_local.batches = {}
+        for sender in self.senders:
+            # Senders already in a batch stay in the outer one.
+            if id(sender) in batches:
+                continue
+            batches[id(sender)] = self
+            change = (sender, [], {})
+            self.changes.append(change)
+            self._changes[id(sender)] = change
+        with _batch_lock:
+            _batch_count += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _batch_count
+        with _batch_lock:
+            _batch_count -= 1
+        batches = _batch_local.batches
+        for sender, properties, old_values in self.changes:
+            del batches[id(sender)]
+        self.flush()
+
+    def record(self, prop, sender, old_value, snapshot = _MISSING):
+        """Records a change of the value of ``prop``.
+
+        The old value is compared with the final one when the batch
+        ends, using the property's change detector and ``snapshot``,
+        its snapshot of the old value. Without ``snapshot``, it's taken
+        now, since the old value may be changed in place later (e.g. a
+        buffer with a version).
+        """
+        sender, properties, old_values = self._changes[id(sender)]
+        if prop not in old_values:
+            if snapshot is _MISSING:
+                snapshot = (prop.detector or ChangeDetector()).snapshot(old_value)
+            properties.append(prop)
+            old_values[prop] = old_value
+            self._snapshots[id(sender), prop] = snapshot
+
+    def flush(self):
+        """Fires the notifications of the recorded changes.
+
+        Properties that ended up with their original value are skipped.
+        """
+        changes, self.changes, self._changes = self.changes, [], {}
+        snapshots, self._snapshots = self._snapshots, {}
+        for sender, properties, old_values in changes:
+            changed = []
+            for prop in properties:
+                value = prop.__get__(sender)
+                detector = prop.detector or ChangeDetector()
+                if detector.changed(snapshots[id(sender), prop], value):
+                    changed.append(prop)
+            if not changed:
+                continue
+            properties_changed = getattr(sender.__class__, 'properties_changed', None)
+            if self.aggregate and properties_changed is not None:
+                properties_changed.fire_bound(sender, old_values = dict(
+                    (prop.name, old_values[prop]) for prop in changed))
+                continue
+            for prop in changed:
+                prop.fire_changed(sender.__class__, sender, old_values[prop])
+
+def batch(*senders, **options):
+    """Defers property change notifications of ``senders``.
+
+    Returns a context manager. While the current thread is inside it,
+    changes of the senders' properties (see :class:`Property`) are only
+    recorded. When it's left, one notification is fired for every
+    property that changed, carrying the value the property had before
+    the first change. If the ``aggregate`` keyword argument is ``True``,
+    a single ``properties_changed`` notification (see :func:`with_events`)
+    is fired for each sender instead, with an ``old_values`` dictionary
+    mapping the names of the changed properties to their old values.
+
+    >>> @nmevent.with_events
+    ... @nmevent.with_properties
+    ... class Example(object):
+    ...    x = nmevent.Property()
+    ...    y = nmevent.Property()
+    ...
+    >>> def handler(sender, **keywords):
+    ...    print "%s changed, old value: %r" % (keywords['name'], keywords['old_value'])
+    ...
+    >>> example = Example()
+    >>> example.property_changed += handler
+    >>> with nmevent.batch(example):
+    ...    example.x = 1
+    ...    example.x = 2
+    ...    example.y = 3
+    ...
+    x changed, old value: None
+    y changed, old value: None
+
+    Batches can be nested. A sender that is already in a batch
+    stays in the outer one.
+
+    :param senders: objects whose notifications should be deferred
+    :param aggregate: ``True`` to fire ``properties_changed`` instead
+                      of the individual notifications
+    :returns: :class:`Batch` object
+    """
+    return Batch(senders, **options)
+
+_asyncio = None
+
+def _import_asyncio():
+    """Imports :mod:`asyncio`, or :mod:`trollius` if it's not available."""
+    global _asyncio
+    if _asyncio is None:
+        try:
+            import asyncio
+        except ImportError:
+            try:
+                import trollius as asyncio
+            except ImportError:
+                raise ImportError, ("Asynchronous dispatch requires "
+                    "the asyncio or trollius module.")
+        _asyncio = asyncio
+    return _asyncio
+
+def _is_awaitable(asyncio, value):
+    return (isinstance(value, asyncio.Future)
+        or asyncio.iscoroutine(value)
+        or hasattr(value, '__await__'))
+
+def _chain_future(source, target):
+    """Makes ``target`` complete the same way ``source`` does.
+
+    Cancelling ``target`` cancels ``source``.
+    """
+    def copy(source):
+        if target.done():
+            return
+        if source.cancelled():
+            target.cancel()
+        elif source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+    def cancel(target):
+        if target.cancelled():
+            source.cancel()
+    source.add_done_callback(copy)
+    target.add_done_callback(cancel)
+
+class Dispatch(object):
+    """Base class of the strategies calling the handlers of an event.
+
+    Calling the object with an event (bound or not) and the arguments
+    the event would be called with fires the event, leaving it to
+    :meth:`dispatch` to call the handlers.
+    """
+
+    def __call__(*args, **keywords):
+        # Unpacked by hand, so that the handlers' keyword arguments
+        # can't clash with the parameter names.
+        self, event, args = args[0], args[1], args[2:]
+        handlers, args = event._dispatch_target(args)
+        return self.dispatch(handlers, args, keywords)
+
+    def dispatch(self, handlers, args, keywords):
+        """Calls ``handlers`` with the given arguments.
+
+        :param handlers: :class:`CallbackStore` object or ``None``
+        :param args: tuple of positional arguments, including the sender
+        :param keywords: dictionary of keyword arguments
+        """
+        raise NotImplementedError
+
+ASYNC_MODES = ('all', 'first_exception', 'detach', )
+
+class AsyncDispatch(Dispatch):
+    """Strategy firing events with coroutine handlers.
+
+    Calling the object fires the event (see :class:`Dispatch`).
+    Handlers are called in turn, but
+    whenever one returns a coroutine or a future, it's scheduled on
+    the event loop instead of being waited for, so the coroutine
+    handlers run concurrently. The call returns a future, which
+    completes depending on ``mode``:
+
+    ``'all'``
+       when all scheduled handlers finish; its result is the list of
+       their results and it fails with the first error that occurs,
+       like :func:`asyncio.gather` does,
+
+    ``'first_exception'``
+       when all scheduled handlers finish or as soon as one of them
+       fails, in which case the others are cancelled,
+
+    ``'detach'``
+       right away; the handlers keep running and their errors are
+       reported to the loop's exception handler.
+
+    Exceptions raised by the handlers that are not coroutine functions
+    propagate from the call, just as they do when an event is fired
+    synchronously.
+
+    >>> dispatch = nmevent.AsyncDispatch('detach', limit = 10)
+    >>> dispatch(example.event) # doctest: +SKIP
+
+    The object can be reused, which is necessary for ``limit`` to take
+    effect across calls. It should only be used by one event loop.
+
+    :param mode: one of the modes listed above
+    :param limit: maximum number of handlers running at once, ``None``
+                  for no limit; handlers over the limit wait in a queue
+    :param loop: event loop to use, the current one by default
+
+    .. attribute:: in_flight
+
+       Number of scheduled handlers that are running.
+    """
+
+    def __init__(self, mode = 'all', limit = None, loop = None):
+        if mode not in ASYNC_MODES:
+            raise ValueError, "Unknown dispatch mode: %r" % (mode, )
+        self.mode = mode
+        self.limit = limit
+        self.loop = loop
+        self.in_flight = 0
+        self._waiting = collections.deque()
+
+    def dispatch(self, handlers, args, keywords):
+        """Calls ``handlers``, see :meth:`Dispatch.dispatch`.
+
+        :returns: future object
+        """
+        asyncio = _import_asyncio()
+        loop = self.loop or asyncio.get_event_loop()
+        futures = []
+        if handlers is not None:
+            for handler in handlers.select(keywords):
+                result = handler(*args, **keywords)
+                if result is not None and _is_awaitable(asyncio, result):
+                    futures.append(self._schedule(asyncio, loop, result))
+        if self.mode == 'detach':
+            for future in futures:
+                future.add_done_callback(self._report)
+            return self._completed(asyncio, loop, None)
+        if not futures:
+            return self._completed(asyncio, loop, [])
+        if self.mode == 'all':
+            return asyncio.gather(*futures)
+        return self._first_exception(asyncio, loop, futures)
+
+    def _completed(self, asyncio, loop, result):
+        future = asyncio.Future(loop = loop)
+        future.set_result(result)
+        return future
+
+    def _schedule(self, asyncio, loop, awaitable):
+        if self.limit is None or self.in_flight < self.limit:
+            return self._start(asyncio, loop, awaitable)
+        future = asyncio.Future(loop = loop)
+        self._waiting.append((loop, awaitable, future))
+        return future
+
+    def _start(self, asyncio, loop, awaitable):
+        ensure_future = getattr(asyncio, 'ensure_future', None)
+        if ensure_future is None:
+            ensure_future = getattr(asyncio, 'async')
+        self.in_flight += 1
+        task = ensure_future(awaitable, loop = loop)
+        task.add_done_callback(self._finished)
+        return task
+
+    def _finished(self, task):
+        self.in_flight -= 1
+        while self._waiting and self.in_flight < self.limit:
+            loop, awaitable, future = self._waiting.popleft()
+            if future.cancelled():
+                # Keeps the coroutine from complaining it was never run.
+                close = getattr(awaitable, 'close', None)
+                if close is not None:
+                    close()
+                continue
+            _chain_future(self._start(_asyncio, loop, awaitable), future)
+
+    def _report(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        (self.loop or _asyncio.get_event_loop()).call_exception_handler({
+            'message': "Exception in a detached event handler",
+            'exception': future.exception(),
+            'future': future, })
+
+    def _first_exception(self, asyncio, loop, futures):
+        result = asyncio.Future(loop = loop)
+        remaining = [len(futures)]
+        def done(future):
+            if result.done():
+                return
+            if future.cancelled():
+                result.set_exception(asyncio.CancelledError())
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    result.set_result([f.result() for f in futures])
+                return
+            for other in futures:
+                other.cancel()
+        def cancel(result):
+            if result.cancelled():
+                for future in futures:
+                    future.cancel()
+        for future in futures:
+            future.add_done_callback(done)
+        result.add_done_callback(cancel)
+        return result
+
+def _import_futures():
+    """Imports :mod:`concurrent.futures`."""
+    try:
+        import concurrent.futures as futures
+    except ImportError:
+        raise ImportError, ("Executor dispatch requires the concurrent.futures "
+            "module (the futures package on Python 2).")
+    return futures
+
+def _combine_futures(futures):
+    """Returns a future of the list of the results of ``futures``.
+
+    The future fails as soon as one of ``futures`` does.
+    """
+    futures_module = _import_futures()
+    combined = futures_module.Future()
+    # The combined future can't be cancelled once it's running.
+    combined.set_running_or_notify_cancel()
+    if not futures:
+        combined.set_result([])
+        return combined
+    lock = threading.Lock()
+    remaining = [len(futures)]
+    def done(future):
+        with lock:
+            if combined.done():
+                return
+            if future.cancelled():
+                combined.set_exception(futures_module.CancelledError())
+            elif future.exception() is not None:
+                combined.set_exception(future.exception())
+            else:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    combined.set_result([f.result() for f in futures])
+    for future in futures:
+        future.add_done_callback(done)
+    return combined
+
+def _executor_dispatch(executor):
+    if isinstance(executor, ExecutorDispatch):
+        return executor
+    return ExecutorDispatch(executor)
+
+EXECUTOR_ORDERINGS = ('parallel', 'serial', )
+
+class ExecutorDispatch(Dispatch):
+    """Strategy running the handlers of events in an executor.
+
+    Calling the object fires the event (see :class:`Dispatch`) by
+    submitting each handler to ``executor``, which may be any
+    :mod:`concurrent.futures` executor, and returns the list of the
+    handlers' futures. If ``combine`` is ``True``, a single future is
+    returned instead, whose result is the list of the handlers' results.
+
+    The object can be passed to the :class:`Event` constructor, so that
+    firing the event always works this way, or to :meth:`Event.fire_in`.
+
+    With the ``'parallel'`` ordering, the handlers run as the executor
+    schedules them. With the ``'serial'`` ordering, the handlers fired
+    for the same sender run one after another, in the order they were
+    submitted in, while the handlers of different senders still run in
+    parallel. Serial ordering works only with thread pools.
+
+    :param executor: executor to submit the handlers to
+    :param ordering: ``'parallel'`` or ``'serial'``
+    :param limit: maximum number of submitted handlers that haven't
+                  finished yet, ``None`` for no limit; firing the event
+                  blocks while the limit is reached
+    :param combine: ``True`` to return one combined future
+    """
+
+    def __init__(self, executor, ordering = 'parallel', limit = None,
+            combine = False):
+        if ordering not in EXECUTOR_ORDERINGS:
+            raise ValueError, "Unknown ordering: %r" % (ordering, )
+        self.executor = executor
+        self.ordering = ordering
+        self.limit = limit
+        self.combine = combine
+        self._slots = None
+        if limit is not None:
+            self._slots = threading.BoundedSemaphore(limit)
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def dispatch(self, handlers, args, keywords):
+        """Submits ``handlers``, see :meth:`Dispatch.dispatch`.
+
+        :returns: list of futures or a combined future
+        """
+        if self.ordering == 'serial':
+            submit = self._enqueue
+        else:
+            submit = self._submit
+        futures = []
+        if handlers is not None:
+            for handler in handlers.select(keywords):
+                if self._slots is not None:
+                    self._slots.acquire()
+                try:
+                    futures.append(submit(handler, args, keywords))
+                except:
+                    if self._slots is not None:
+                        self._slots.release()
+                    raise
+        if self.combine:
+            return _combine_futures(futures)
+        return futures
+
+    def _release(self, future = None):
+        self._slots.release()
+
+    def _submit(self, handler, args, keywords):
+        future = self.executor.submit(handler, *args, **keywords)
+        if self._slots is not None:
+            future.add_done_callback(self._release)
+        return future
+
+    def _enqueue(self, handler, args, keywords):
+        # Each sender with pending handlers has a queue, which is
+        # drained by a single task submitted to the executor.
+        future = _import_futures().Future()
+        key = id(args[0])
+        with self._lock:
+            queue = self._queues.get(key)
+            start = queue is None
+            if start:
+                queue = self._queues[key] = collections.deque()
+            queue.append((future, handler, args, keywords))
+        if start:
+            try:
+                self.executor.submit(self._drain, key)
+            except:
+                with self._lock:
+                    del self._queues[key]
+                raise
+        return future
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                future, handler, args, keywords = queue.popleft()
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = handler(*args, **keywords)
+                except BaseException, error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            if self._slots is not None:
+                self._release()
+
+def _event_name(event):
+    """Returns the name of ``event`` or a made-up one."""
+    if event is None or event.name is None:
+        return "<event %x>" % (id(event), )
+    return event.name
+
+def _handler_name(handler):
+    """Returns a name identifying the code of ``handler``."""
+    if isinstance(handler, _BatchAdapter):
+        handler = handler.handler
+    if isinstance(handler, WeakRefCallback):
+        target = handler.callback()
+        if handler.method is not None:
+            return "%s.%s" % (type(target).__name__, handler.method.__name__)
+        handler = target
+    instance = getattr(handler, 'im_self', None)
+    if instance is not None:
+        return "%s.%s" % (type(instance).__name__, handler.__name__)
+    name = getattr(handler, '__name__', None)
+    if name is None:
+        return type(handler).__name__
+    return "%s.%s" % (getattr(handler, '__module__', None), name)
+
+class LatencyHistogram(object):
+    """Histogram of latencies in fixed memory.
+
+    Latencies are counted in :attr:`BUCKETS` buckets. The bucket ``i``
+    counts the latencies of at least ``2 ** (i - 1)`` and less than
+    ``2 ** i`` microseconds, the first one counts the latencies under
+    a microsecond and the last one all the longest.
+
+    .. attribute:: count
+
+       Number of measured latencies.
+
+    .. attribute:: total
+
+       Sum of the latencies in seconds.
+
+    .. attribute:: max
+
+       Longest latency in seconds.
+    """
+
+    __slots__ = ('buckets', 'count', 'total', 'max', )
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.buckets = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """Counts a latency of ``seconds``."""
+        index = int(seconds * 1e6).bit_length()
+        if index >= self.BUCKETS:
+            index = self.BUCKETS - 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Adds the counts of the ``other`` histogram to this one."""
+        for index, count in enumerate(other.buckets):
+            self.buckets[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction):
+        """Returns the upper bound of the bucket with the given percentile.
+
+        :param fraction: percentile as a fraction, e.g. ``0.99``
+        :returns: latency in seconds
+        """
+        if not self.count:
+            return 0.0
+        remaining = fraction * self.count
+        for index, count in enumerate(self.buckets):
+            remaining -= count
+            if remaining <= 0:
+                break
+        if index == self.BUCKETS - 1:
+            return self.max
+        return min(2 ** index / 1e6, self.max)
+
+    def as_dict(self):
+        """Returns the histogram as a dictionary."""
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'buckets': list(self.buckets),
+        }
+
+_clock = time.time
+
+_instrumented = weakref.WeakSet()
+
+class EventStats(Dispatch):
+    """Instrumentation of an event.
+
+    An instrumented event calls its handlers through this object, which
+    counts the fires and the handler calls and keeps a
+    :class:`LatencyHistogram` for each handler (handlers are identified
+    by the names of their functions, so for example the same method of
+    all instances shares one histogram). Events that are not
+    instrumented don't pay anything for it.
+
+    >>> class Example(object):
+    ...    event = nmevent.Event(name = 'Example.event', instrument = True)
+    ...
+    >>> def handler(sender):
+    ...    pass
+    ...
+    >>> example = Example()
+    >>> example.event += handler
+    >>> example.event()
+    >>> Example.event.stats.fires
+    1
+    >>> nmevent.stats()['Example.event']['calls']
+    1
+
+    :param slow_threshold: latency in seconds over which the handler
+                           is reported to ``on_slow``
+    :param on_slow: function called with this object, the handler and
+                    its latency in seconds when the handler is slow
+
+    .. attribute:: fires
+
+       Number of fires of the event. Fires that can't call any handlers,
+       because no handler has ever been added to the event (or to the
+       event bound to the sender), are not counted.
+
+    .. attribute:: calls
+
+       Number of handler calls.
+
+    .. attribute:: errors
+
+       Number of handler calls that raised an exception.
+
+    .. attribute:: slow
+
+       Number of handler calls slower than ``slow_threshold``.
+
+    .. attribute:: latencies
+
+       Dictionary mapping the names of the handlers to their
+       :class:`LatencyHistogram` objects.
+    """
+
+    def __init__(self, slow_threshold = None, on_slow = None):
+        self.slow_threshold = slow_threshold
+        self.on_slow = on_slow
+        self.event = None
+        self.fires = 0
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+        self.latencies = {}
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        """Name of the instrumented event."""
+        return _event_name(self.event)
+
+    def attach(self, event):
+        """Makes this object the instrumentation of ``event``.
+
+        This is done by the :class:`Event` constructor.
+        """
+        if self.event is not None and self.event is not event:
+            raise ValueError, "The stats belong to another event already."
+        self.event = event
+        _instrumented.add(self)
+
+    def dispatch(self, handlers, args, keywords):
+        """Calls ``handlers`` and measures them, see :meth:`Dispatch.dispatch`."""
+        if handlers is None:
+            return
+        with self._lock:
+            self.fires += 1
+        for handler in handlers.select(keywords):
+            failed = True
+            start = _clock()
+            try:
+                handler(*args, **keywords)
+                failed = False
+            finally:
+                self._record(handler, _clock() - start, failed)
+
+    def _record(self, handler, seconds, failed):
+        name = _handler_name(handler)
+        slow = self.slow_threshold is not None and seconds > self.slow_threshold
+        with self._lock:
+            self.calls += 1
+            if failed:
+                self.errors += 1
+            if slow:
+                self.slow += 1
+            histogram = self.latencies.get(name)
+            if histogram is None:
+                histogram = self.latencies[name] = LatencyHistogram()
+            histogram.add(seconds)
+        if slow and self.on_slow is not None:
+            self.on_slow(self, handler, seconds)
+
+    def merge(self, other):
+        """Adds the counts of the ``other`` stats to this object."""
+        self.fires += other.fires
+        self.calls += other.calls
+        self.errors += other.errors
+        self.slow += other.slow
+        for name, histogram in other.latencies.items():
+            if name not in self.latencies:
+                self.latencies[name] = LatencyHistogram()
+            self.latencies[name].merge(histogram)
+
+    def reset(self):
+        """Sets all counts to zero."""
+        with self._lock:
+            self.fires = self.calls = self.errors = self.slow = 0
+            self.latencies = {}
+
+    def as_dict(self):
+        """Returns the counts as a dictionary."""
+        return {
+            'fires': self.fires,
+            'calls': self.calls,
+            'errors': self.errors,
+            'slow': self.slow,
+            'handlers': dict((name, histogram.as_dict())
+                for name, histogram in self.latencies.items()),
+        }
+
+def stats():
+    """Returns a snapshot of the statistics of all instrumented events.
+
+    The snapshot is a dictionary mapping the names of the events to
+    the dictionaries returned by :meth:`EventStats.as_dict`. The stats
+    of events that share a name are added up.
+    """
+    merged = {}
+    for event_stats in list(_instrumented):
+        with event_stats._lock:
+            total = merged.get(event_stats.name)
+            if total is None:
+                total = merged[event_stats.name] = EventStats()
+            total.merge(event_stats)
+    return dict((name, total.as_dict()) for name, total in merged.items())
+
+_tracer = None
+
+TRACE_FORMATS = ('chrome', 'collapsed', )
+
+class Tracer(object):
+    """Records the fires of all events as spans.
+
+    While the tracer is started, every fire of any event is recorded
+    as a span annotated with the name of the event (see
+    :attr:`Event.name`) and the type of the sender, and every handler
+    call within it as a nested span named after the handler. Fires
+    caused by handlers, e.g. property change notifications, are nested
+    in the spans of the handlers. When the tracer is stopped, the spans
+    are written to ``path`` either in the Chrome trace-event format,
+    which can be opened in ``chrome://tracing`` and other trace viewers,
+    or in the collapsed-stack format used to draw flame graphs.
+
+    Only one tracer can be started at a time. When it's not started,
+    tracing costs nothing, because it's done by temporarily replacing
+    the methods firing the events.
+
+    >>> with nmevent.trace('/tmp/events.json'): # doctest: +SKIP
+    ...    example.x = 10
+
+    :param path: path of the output file
+    :param format: ``'chrome'`` or ``'collapsed'``
+    :param max_events: maximum number of spans (or distinct stacks for
+                       the collapsed format) kept; more are dropped
+
+    .. attribute:: dropped
+
+       Number of spans dropped because the buffer was full.
+    """
+
+    def __init__(self, path, format = 'chrome', max_events = 100000):
+        if format not in TRACE_FORMATS:
+            raise ValueError, "Unknown trace format: %r" % (format, )
+        self.path = path
+        self.format = format
+        self.max_events = max_events
+        self.dropped = 0
+        self.spans = []
+        self.stacks = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._originals = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Starts recording the fires."""
+        global _tracer
+        with _lock:
+            if _tracer is not None:
+                raise RuntimeError, "Another tracer is started already."
+            _tracer = self
+            self._originals = (Event.__dict__['fire'],
+                Event.__dict__['fire_bound'], InstanceEvent.__dict__['__call__'])
+            self._install()
+
+    def stop(self):
+        """Stops recording the fires and writes the output file."""
+        global _tracer
+        with _lock:
+            if _tracer is not self:
+                return
+            fire, fire_bound, call = self._originals
+            Event.fire = Event.__call__ = fire
+            Event.fire_bound = fire_bound
+            InstanceEvent.__call__ = call
+            _tracer = None
+        self.write()
+
+    def _install(self):
+        traced = self._traced
+        def fire(self, sender, *args, **keywords):
+            return traced(self, *self._dispatch_target((sender, ) + args),
+                keywords = keywords)
+        def fire_bound(self, sender, *args, **keywords):
+            handlers = self._instance_store(sender)
+            if self.__chains__ is not None:
+                handlers = self._with_classes(handlers, sender)
+            return traced(self, handlers, (sender, ) + args, keywords)
+        def call(self, *args, **keywords):
+            if self.im_sender is None:
+                self._check_sender(args)
+                return self.im_event.fire_bound(*args, **keywords)
+            handlers, args = self._dispatch_target(args)
+            return traced(self.im_event, handlers, args, keywords)
+        Event.fire = Event.__call__ = fire
+        Event.fire_bound = fire_bound
+        InstanceEvent.__call__ = call
+
+    def _traced(self, event, handlers, args, keywords):
+        self._begin(_event_name(event), 'event',
+            {'sender': type(args[0]).__name__})
+        try:
+            if handlers is None:
+                if event.dispatch is not None:
+                    return event.dispatch.dispatch(None, args, keywords)
+                return None
+            if handlers.dispatch is not None:
+                return handlers.call(*args, **keywords)
+            for handler in handlers.select(keywords):
+                self._begin(_handler_name(handler), 'handler', None)
+                try:
+                    handler(*args, **keywords)
+                finally:
+                    self._end()
+        finally:
+            self._end()
+
+    def _begin(self, name, category, args):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        # Each frame is [name, category, args, start, time of children].
+        stack.append([name, category, args, _clock(), 0.0])
+
+    def _end(self):
+        stack = self._local.stack
+        end = _clock()
+        name, category, args, start, children = stack[-1]
+        duration = end - start
+        if len(stack) > 1:
+            stack[-2][4] += duration
+        if self.format == 'chrome':
+            span = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': start * 1e6,
+                'dur': duration * 1e6,
+                'pid': os.getpid(),
+                'tid': threading.current_thread().ident,
+            }
+            if args:
+                span['args'] = args
+            with self._lock:
+                if len(self.spans) < self.max_events:
+                    self.spans.append(span)
+                else:
+                    self.dropped += 1
+        else:
+            key = ';'.join(frame[0].replace(';', ',') for frame in stack)
+            with self._lock:
+                if key in self.stacks or len(self.stacks) < self.max_events:
+                    self.stacks[key] = self.stacks.get(key, 0.0) + duration - children
+                else:
+                    self.dropped += 1
+        stack.pop()
+
+    def write(self):
+        """Writes the recorded spans to the output file."""
+        with self._lock:
+            spans, stacks, dropped = list(self.spans), dict(self.stacks), self.dropped
+        with open(self.path, 'w') as output:
+            if self.format == 'chrome':
+                json.dump({
+                    'traceEvents': spans,
+                    'displayTimeUnit': 'ms',
+                    'otherData': {'dropped': dropped},
+                }, output)
+            else:
+                for key, seconds in sorted(stacks.items()):
+                    output.write("%s %d\n" % (key, round(seconds * 1e6)))
+
+def trace(path, format = 'chrome', max_events = 100000):
+    """Returns a :class:`Tracer` to be used as a context manager.
+
+    The fires of all events, in all threads, are recorded while the
+    ``with`` block runs, and the output file is written when it's left.
+    See :class:`Tracer` for the description of the arguments.
+    """
+    return Tracer(path, format, max_events)
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest', 'coalesce', )
+
+class EventQueue(Dispatch):
+    """Bounded queue of posted events.
+
+    Calling the object (see :class:`Dispatch`), or posting an event
+    that uses the queue (see :meth:`Event.post`), puts the notification
+    in the queue and returns right away. The handlers are called later,
+    by a thread started by :meth:`start`, by an event loop the queue is
+    attached to (see :meth:`attach`), or by whoever calls :meth:`drain`.
+
+    The queue holds at most ``capacity`` notifications. When it's full,
+    the ``overflow`` policy decides what happens to the next one:
+
+    ``'block'``
+       the thread posting it waits until there's room in the queue,
+
+    ``'drop_oldest'``
+       the oldest notification in the queue is dropped to make room,
+
+    ``'drop_newest'``
+       the new notification is dropped,
+
+    ``'coalesce'``
+       like ``'block'``, except that a notification of an event and
+       sender that is already waiting in the queue never takes more
+       room: it replaces the arguments of the waiting one instead.
+
+    Notifications posted by the handlers run by the queue's own thread
+    never block; they are queued even if the queue is full.
+
+    >>> queue = nmevent.EventQueue(capacity = 2, overflow = 'drop_newest')
+    >>> def handler(sender, **keywords):
+    ...    print "handled %r" % (keywords, )
+    ...
+    >>> event = nmevent.Event(queue = queue)
+    >>> event += handler
+    >>> event.post(None, n = 1), event.post(None, n = 2), event.post(None, n = 3)
+    (True, True, False)
+    >>> queue.drain()
+    handled {'n': 1}
+    handled {'n': 2}
+    2
+    >>> queue.dropped
+    1
+
+    :param capacity: maximum number of queued notifications
+    :param overflow: one of the overflow policies listed above
+    :param on_error: function called with the result of :func:`sys.exc_info`
+                     when a handler fails, the traceback is printed
+                     by default
+
+    .. attribute:: posted
+
+       Number of notifications posted so far, including the dropped
+       and coalesced ones.
+
+    .. attribute:: delivered
+
+       Number of notifications taken from the queue to be delivered.
+
+    .. attribute:: dropped
+
+       Number of notifications dropped because the queue was full.
+
+    .. attribute:: coalesced
+
+       Number of notifications merged with a waiting one.
+
+    .. attribute:: errors
+
+       Number of handler failures.
+    """
+
+    def __init__(self, capacity = 1024, overflow = 'block', on_error = None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError, "Unknown overflow policy: %r" % (overflow, )
+        self.capacity = capacity
+        self.overflow = overflow
+        self.on_error = on_error
+        self.posted = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._items = collections.deque()
+        self._waiting = {}
+        self._condition = threading.Condition(threading.Lock())
+        self._thread = None
+        self._running = False
+        self._loop = None
+
+    @property
+    def depth(self):
+        """Number of notifications waiting in the queue."""
+        return len(self._items)
+
+    def __call__(*args, **keywords):
+        # Like Dispatch.__call__, but the event is kept to coalesce
+        # the notifications by; the handlers may be a temporary join.
+        self, event, args = args[0], args[1], args[2:]
+        handlers, args = event._dispatch_target(args)
+        if event.__class__ is InstanceEvent:
+            event = event.im_event
+        return self.dispatch(handlers, args, keywords, event)
+
+    def dispatch(self, handlers, args, keywords, event = None):
+        """Queues a notification, see :meth:`Dispatch.dispatch`.
+
+        :param event: event the notification belongs to, notifications
+                      are coalesced by it and their sender; by their
+                      handlers if it's ``None``
+        :returns: ``False`` if the notification was dropped,
+                  ``True`` otherwise
+        """
+        if handlers is None:
+            return True
+        with self._condition:
+            self.posted += 1
+            key = None
+            if self.overflow == 'coalesce':
+                if event is None:
+                    event = handlers
+                key = (event, id(args[0]))
+                item = self._waiting.get(key)
+                if item is not None:
+                    item[1] = args
+                    item[2] = keywords
+                    self.coalesced += 1
+                    return True
+            while len(self._items) >= self.capacity:
+                if self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                if self.overflow == 'drop_oldest':
+                    self._pop()
+                    self.dropped += 1
+                    break
+                if threading.current_thread() is self._thread:
+                    break
+                self._condition.wait()
+            item = [handlers, args, keywords, key]
+            self._items.append(item)
+            if key is not None:
+                self._waiting[key] = item
+            self._condition.notify_all()
+            loop = self._loop
+            wake = loop is not None and len(self._items) == 1
+        if wake:
+            loop.call_soon_threadsafe(self.drain)
+        return True
+
+    def _pop(self):
+        item = self._items.popleft()
+        if item[3] is not None:
+            del self._waiting[item[3]]
+        return item
+
+    def _take(self):
+        # Takes the next notification to be delivered.
+        item = self._pop()
+        self.delivered += 1
+        self._condition.notify_all()
+        return item
+
+    def _deliver(self, handlers, args, keywords, key = None):
+        try:
+            handlers.call(*args, **keywords)
+        except Exception:
+            with self._condition:
+                self.errors += 1
+            if self.on_error is not None:
+                self.on_error(sys.exc_info())
+            else:
+                traceback.print_exc()
+
+    def drain(self, limit = None):
+        """Delivers the queued notifications in the calling thread.
+
+        :param limit: maximum number of notifications to deliver,
+                      ``None`` to empty the queue
+        :returns: number of delivered notifications
+        """
+        count = 0
+        while limit is None or count < limit:
+            with self._condition:
+                if not self._items:
+                    break
+                item = self._take()
+            self._deliver(*item)
+            count += 1
+        return count
+
+    def start(self):
+        """Starts a daemon thread delivering the notifications."""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._thread = threading.Thread(target = self._run,
+                name = "nmevent.EventQueue")
+            self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout = None):
+        """Stops the thread started by :meth:`start`.
+
+        The thread delivers all notifications queued so far first.
+        """
+        with self._condition:
+            thread, self._running = self._thread, False
+            self._condition.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+            with self._condition:
+                if self._thread is thread and not thread.is_alive():
+                    self._thread = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._items and self._running:
+                    self._condition.wait()
+                if not self._items:
+                    return
+                item = self._take()
+            self._deliver(*item)
+
+    def attach(self, loop):
+        """Makes an :mod:`asyncio` event loop deliver the notifications.
+
+        Whenever a notification is queued, a call of :meth:`drain` is
+        scheduled on the loop, so the handlers run in the loop's thread.
+        Note that the ``'block'`` and ``'coalesce'`` policies would block
+        the loop if an event was posted from its thread to a full queue.
+
+        :param loop: event loop, or ``None`` to detach the queue
+        """
+        with self._condition:
+            self._loop = loop
+            wake = loop is not None and len(self._items) > 0
+        if wake:
+            loop.call_soon_threadsafe(self.drain)
+
+_default_queue = None
+
+def default_queue():
+    """Returns the :class:`EventQueue` events are posted to by default.
+
+    The queue is created, with the default capacity and overflow policy,
+    and started the first time it's needed.
+    """
+    global _default_queue
+    if _default_queue is None:
+        with _lock:
+            if _default_queue is None:
+                queue = EventQueue()
+                queue.start()
+                _default_queue = queue
+    return _default_queue
+
+class Publisher(object):
+    """Publishes fired events to other processes.
+
+    Events are mirrored by the publisher (see :meth:`mirror`) under
+    names that the receiving :class:`Subscriber` objects know them by.
+    Every time a mirrored event is fired, the notification is added to
+    the current batch. The batch is pickled and sent to all connections
+    when it reaches ``batch_size`` notifications, or by a background
+    thread at most ``flush_interval`` seconds after the first
+    notification was added to it.
+
+    The connections are the ends of :func:`multiprocessing.Pipe` or any
+    objects with the same ``send_bytes`` and ``recv_bytes`` methods.
+    A connection that fails is dropped.
+
+    >>> import multiprocessing
+    >>> ours, theirs = multiprocessing.Pipe()
+    >>> publisher = nmevent.Publisher([ours], batch_size = 10)
+    >>> subscriber = nmevent.Subscriber(theirs)
+    >>> def handler(sender, **keywords):
+    ...    print "%s: %r" % (sender, keywords)
+    ...
+    >>> remote_changed = subscriber.event('changed')
+    >>> remote_changed += handler
+    >>> class Example(object):
+    ...    changed = nmevent.Event()
+    ...
+    >>> example = Example()
+    >>> mirrored = publisher.mirror(example.changed, 'changed',
+    ...    sender = lambda sender: 'example')
+    >>> example.changed(value = 1)
+    >>> publisher.flush()
+    >>> subscriber.receive(1)
+    example: {'value': 1}
+    1
+
+    :param connections: connections to send the batches to
+    :param batch_size: number of notifications that makes the batch
+                       to be sent right away
+    :param flush_interval: maximum time in seconds a notification
+                           waits to be sent, ``None`` if the batches
+                           are sent only when full or :meth:`flush`
+                           is called
+    """
+
+    def __init__(self, connections = (), batch_size = 64,
+            flush_interval = 0.05):
+        self.connections = list(connections)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._batch = []
+        self._condition = threading.Condition(threading.Lock())
+        self._send_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def mirror(self, event, name, sender = None):
+        """Publishes ``event`` under ``name``.
+
+        The senders themselves usually can't be sent to other
+        processes, so the remote handlers get ``None`` as the sender,
+        unless ``sender`` is given to convert the senders to something
+        that can be pickled.
+
+        :param event: :class:`Event` or bound :class:`InstanceEvent`
+        :param name: name of the event for the subscribers
+        :param sender: function converting the sender, or ``None``
+        :returns: the handler added to the event
+        """
+        publish = self.publish
+        def handler(*args, **keywords):
+            if sender is None:
+                args = (None, ) + args[1:]
+            else:
+                args = (sender(args[0]), ) + args[1:]
+            publish(name, args, keywords)
+        event += handler
+        return handler
+
+    def publish(self, name, args, keywords):
+        """Adds a notification of the event ``name`` to the batch.
+
+        :param args: positional arguments of the event, including the sender
+        :param keywords: keyword arguments of the event
+        """
+        with self._condition:
+            self._batch.append((name, args, keywords))
+            full = len(self._batch) >= self.batch_size
+            if (not full and self._thread is None
+                    and self.flush_interval is not None):
+                self._start()
+            self._condition.notify()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Sends the current batch right away."""
+        with self._send_lock:
+            with self._condition:
+                batch, self._batch = self._batch, []
+            if not batch:
+                return
+            data = pickle.dumps(batch, pickle.HIGHEST_PROTOCOL)
+            for connection in list(self.connections):
+                try:
+                    connection.send_bytes(data)
+                except (EnvironmentError, EOFError):
+                    self.connections.remove(connection)
+
+    def _start(self):
+        self._running = True
+        self._thread = threading.Thread(target = self._run,
+            name = "nmevent.Publisher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._batch:
+                    self._condition.wait()
+                if not self._running:
+                    return
+            # Gives the batch a chance to fill up.
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def close(self):
+        """Stops the background thread and sends the last batch."""
+        with self._condition:
+            thread, self._running = self._thread, False
+            self._thread = None
+            self._condition.notify()
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+class Subscriber(object):
+    """Receives the events sent by a :class:`Publisher`.
+
+    The events are fired locally, as :class:`Event` objects that can be
+    obtained by the names they were published under (see :meth:`event`).
+    The batches are received by :meth:`receive`, or by a background
+    thread started by :meth:`start`.
+
+    The batches are unpickled, which can run arbitrary code, so only
+    connect the subscriber to trusted publishers (see
+    :class:`SocketServer`).
+
+    :param connection: connection the publisher sends the batches to
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._events = {}
+        self._thread = None
+        self._running = False
+
+    def event(self, name):
+        """Returns the local event fired for the event ``name``."""
+        event = self._events.get(name)
+        if event is None:
+            with _lock:
+                event = self._events.setdefault(name, Event())
+        return event
+    __getitem__ = event
+
+    def receive(self, timeout = None):
+        """Receives a batch and fires the events in it.
+
+        :param timeout: maximum time in seconds to wait for the batch,
+                        ``None`` to wait as long as it takes
+        :returns: number of fired events, ``0`` on time-out
+        :raises EOFError: if the connection is closed
+        """
+        if timeout is not None and not self.connection.poll(timeout):
+            return 0
+        batch = pickle.loads(self.connection.recv_bytes())
+        events = self._events
+        for name, args, keywords in batch:
+            event = events.get(name)
+            if event is not None:
+                event.fire(*args, **keywords)
+        return len(batch)
+
+    def start(self, poll_interval = 0.1):
+        """Starts a daemon thread receiving the batches."""
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target = self._run,
+            args = (poll_interval, ), name = "nmevent.Subscriber")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, poll_interval):
+        while self._running:
+            try:
+                self.receive(poll_interval)
+            except (EnvironmentError, EOFError):
+                return
+            except Exception:
+                traceback.print_exc()
+
+    def stop(self):
+        """Stops the thread started by :meth:`start`."""
+        thread, self._running = self._thread, False
+        self._thread = None
+        if thread is not None:
+            thread.join()
+
+_FRAME_HEADER = struct.Struct('!I')
+_SEQUENCE = struct.Struct('!Q')
+_HELLO = struct.Struct('!8sQ')
+
+def _frame(data):
+    """Returns ``data`` prefixed by its length."""
+    return _FRAME_HEADER.pack(len(data)) + data
+
+def _recv_exactly(sock, size):
+    data = ''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError, "Connection closed."
+        data += chunk
+    return data
+
+def _recv_frame(sock):
+    size, = _FRAME_HEADER.unpack(_recv_exactly(sock, _FRAME_HEADER.size))
+    return _recv_exactly(sock, size)
+
+def _create_socket(address):
+    # Strings are paths of Unix domain sockets, tuples are (host, port).
+    if isinstance(address, basestring):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+class SocketServer(object):
+    """Connection sending the batches of a :class:`Publisher` over sockets.
+
+    The server listens on ``address``, which is either the path of
+    a Unix domain socket or a ``(host, port)`` tuple, and sends every
+    batch to all connected :class:`SocketClient` objects. Each batch is
+    written as one frame, prefixed by its length.
+
+    The client sockets are non-blocking, so a client that stops reading
+    never blocks the publisher (or the thread firing the events): what
+    can't be sent right away is buffered for the client and sent by the
+    server's thread. A client with more than ``max_pending`` bytes
+    buffered is disconnected; it reconnects and the frames it missed
+    are replayed. Likewise, the server's thread doesn't wait for the
+    handshake of a new client, which is disconnected unless it
+    completes the handshake within :attr:`handshake_timeout` seconds.
+
+    The server keeps the last ``backlog`` frames. When a client that
+    lost its connection reconnects, the frames it missed are replayed,
+    as long as they're still kept.
+
+    The connections aren't authenticated and the clients unpickle the
+    batches, so the server must only be reachable by trusted clients
+    (e.g. a Unix domain socket with suitable permissions), and vice versa.
+
+    >>> server = nmevent.SocketServer(('127.0.0.1', 0)) # doctest: +SKIP
+    >>> publisher = nmevent.Publisher([server]) # doctest: +SKIP
+
+    :param address: address to listen on
+    :param backlog: number of frames kept for replay
+    :param max_pending: maximum number of bytes buffered for a client
+
+    .. attribute:: address
+
+       Address the server listens on, as returned by ``getsockname``.
+
+    .. attribute:: handshake_timeout
+
+       Seconds a new client has to complete the handshake.
+    """
+
+    handshake_timeout = 5.0
+
+    def __init__(self, address, backlog = 256, max_pending = 1 << 20):
+        self.socket = _create_socket(address)
+        if self.socket.family != socket.AF_UNIX:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(address)
+        self.socket.listen(16)
+        self.address = self.socket.getsockname()
+        self.server_id = os.urandom(8)
+        self.sequence = 0
+        self.backlog = collections.deque(maxlen = backlog)
+        self.max_pending = max_pending
+        self.clients = []
+        self._pending = {}
+        # Clients being accepted, mapped to [deadline, received data];
+        # only used by the server's thread.
+        self._accepting = {}
+        self._lock = threading.Lock()
+        # Wakes the server's thread up when data is left pending.
+        self._wake_read, self._wake_write = os.pipe()
+        self._woken = False
+        self._thread = threading.Thread(target = self._serve,
+            name = "nmevent.SocketServer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _serve(self):
+        accepting = self._accepting
+        while True:
+            with self._lock:
+                writers = [client for client in self.clients
+                    if self._pending.get(client)]
+            timeout = None
+            if accepting:
+                timeout = max(0, min(deadline for deadline, data
+                    in accepting.itervalues()) - _clock())
+            try:
+                readable, writable, failed = select.select(
+                    [self.socket, self._wake_read] + accepting.keys(),
+                    writers, [], timeout)
+            except (select.error, socket.error, ValueError):
+                return
+            if self._wake_read in readable:
+                try:
+                    os.read(self._wake_read, 4096)
+                except OSError:
+                    return
+                with self._lock:
+                    self._woken = False
+            if writable:
+                with self._lock:
+                    for client in writable:
+                        if client in self.clients:
+                            self._write(client)
+            for client in readable:
+                if client in accepting:
+                    self._greet(client)
+            if accepting:
+                now = _clock()
+                for client, (deadline, data) in accepting.items():
+                    if deadline <= now:
+                        del accepting[client]
+                        client.close()
+            if self.socket in readable and not self._accept():
+                return
+
+    def _accept(self):
+        # Accepts a client; returns False once the server is closed.
+        # Its handshake is read by _greet as it arrives.
+        try:
+            client, address = self.socket.accept()
+        except socket.error:
+            return False
+        client.setblocking(False)
+        self._accepting[client] = [_clock() + self.handshake_timeout, '']
+        return True
+
+    def _greet(self, client):
+        # Reads the client's hello; once complete, the client is
+        # connected and the frames it missed are replayed.
+        item = self._accepting[client]
+        size = _FRAME_HEADER.size + _HELLO.size
+        try:
+            chunk = client.recv(size - len(item[1]))
+        except socket.error, error:
+            if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            chunk = ''
+        if chunk:
+            item[1] += chunk
+            if len(item[1]) < size:
+                return
+        del self._accepting[client]
+        data = item[1]
+        if (len(data) < size or
+                _FRAME_HEADER.unpack(data[:_FRAME_HEADER.size])[0] != _HELLO.size):
+            client.close()
+            return
+        server_id, last = _HELLO.unpack(data[_FRAME_HEADER.size:])
+        try:
+            if client.family != socket.AF_UNIX:
+                # The batches are coalesced by the publisher already.
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except socket.error:
+            client.close()
+            return
+        with self._lock:
+            replay = []
+            if server_id == self.server_id:
+                replay = [frame for sequence, frame in self.backlog
+                    if sequence > last]
+            self.clients.append(client)
+            self._pending[client] = _frame(self.server_id) + ''.join(replay)
+            self._write(client)
+
+    def _write(self, client):
+        # Sends as much pending data as the client takes without
+        # blocking; called with the lock held.
+        data = self._pending[client]
+        try:
+            sent = client.send(data)
+        except socket.error, error:
+            if error.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._drop(client)
+                return
+            sent = 0
+        self._pending[client] = data = data[sent:]
+        if data:
+            self._wake()
+
+    def _wake(self):
+        # Called with the lock held; at most one byte is ever in the pipe.
+        if not self._woken:
+            self._woken = True
+            try:
+                os.write(self._wake_write, 'x')
+            except OSError:
+                pass
+
+    def _drop(self, client):
+        # Disconnects a client; called with the lock held.
+        self.clients.remove(client)
+        self._pending.pop(client, None)
+        client.close()
+
+    def send_bytes(self, data):
+        """Sends ``data`` as one frame to all clients.
+
+        Never blocks on a client; slow clients are disconnected when
+        they fall more than :attr:`max_pending` bytes behind.
+        """
+        with self._lock:
+            self.sequence += 1
+            frame = _frame(_SEQUENCE.pack(self.sequence) + data)
+            self.backlog.append((self.sequence, frame))
+            for client in list(self.clients):
+                pending = self._pending.get(client, '') + frame
+                if len(pending) > self.max_pending:
+                    self._drop(client)
+                    continue
+                self._pending[client] = pending
+                self._write(client)
+
+    def close(self):
+        """Stops listening and disconnects all clients."""
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.socket.close()
+        with self._lock:
+            clients, self.clients = self.clients, []
+            self._pending = {}
+            self._wake()
+        for client in clients:
+            client.close()
+        self._thread.join()
+        for client in self._accepting.keys():
+            client.close()
+        self._accepting.clear()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+        if isinstance(self.address, basestring):
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+class SocketClient(object):
+    """Connection receiving batches from a :class:`SocketServer`.
+
+    This is the connection of a :class:`Subscriber`. It connects to the
+    server when it's first used and whenever the connection is lost,
+    waiting ``retry_interval`` seconds between attempts. After it
+    reconnects, it receives the frames it missed in the meantime, if
+    the server still has them.
+
+    :param address: address of the server
+    :param retry_interval: time in seconds between connection attempts
+    """
+
+    def __init__(self, address, retry_interval = 0.1):
+        self.address = address
+        self.retry_interval = retry_interval
+        self.server_id = '\0' * 8
+        self.last_sequence = 0
+        self.closed = False
+        self._socket = None
+        self._buffer = ''
+        self._ready = collections.deque()
+
+    def connect(self):
+        """Connects to the server unless connected, returns ``True`` on success."""
+        if self.closed:
+            raise EOFError, "Connection closed."
+        if self._socket is not None:
+            return True
+        sock = _create_socket(self.address)
+        try:
+            sock.settimeout(5)
+            sock.connect(self.address)
+            sock.sendall(_frame(_HELLO.pack(self.server_id, self.last_sequence)))
+            server_id = _recv_frame(sock)
+            sock.settimeout(None)
+        except (socket.error, EOFError):
+            sock.close()
+            return False
+        if server_id != self.server_id:
+            # A different server doesn't know our sequence numbers.
+            self.server_id = server_id
+            self.last_sequence = 0
+        self._socket = sock
+        self._buffer = ''
+        return True
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _parse(self):
+        buffer = self._buffer
+        header = _FRAME_HEADER.size
+        while len(buffer) >= header:
+            size, = _FRAME_HEADER.unpack(buffer[:header])
+            if len(buffer) < header + size:
+                break
+            frame, buffer = buffer[header:header + size], buffer[header + size:]
+            sequence, = _SEQUENCE.unpack(frame[:_SEQUENCE.size])
+            if sequence > self.last_sequence:
+                self.last_sequence = sequence
+                self._ready.append(frame[_SEQUENCE.size:])
+        self._buffer = buffer
+
+    def poll(self, timeout = 0):
+        """Returns ``True`` if a batch can be received without blocking.
+
+        :param timeout: maximum time in seconds to wait for the batch,
+                        ``None`` to wait as long as it takes
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while not self._ready:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+            if not self.connect():
+                if remaining == 0:
+                    return False
+                time.sleep(self.retry_interval if remaining is None
+                    else min(self.retry_interval, remaining))
+                continue
+            try:
+                readable = select.select([self._socket], [], [], remaining)[0]
+                if readable:
+                    data = self._socket.recv(65536)
+                    if not data:
+                        self._disconnect()
+                        continue
+                    self._buffer += data
+                    self._parse()
+                    continue
+            except (socket.error, select.error):
+                self._disconnect()
+                continue
+            return False
+        return True
+
+    def recv_bytes(self):
+        """Receives a batch, waiting for it if necessary."""
+        self.poll(None)
+        return self._ready.popleft()
+
+    def close(self):
+        """Closes the connection for good."""
+        self.closed = True
+        self._disconnect()
+
+class RemoteEvent(object):
+    """Proxy of an event published by another process.
+
+    Handlers are added and removed with the ``+=`` and ``-=`` operators,
+    as with :class:`InstanceEvent`. They're called by the
+    :class:`Subscriber`'s thread, which is started when the first
+    handler is added.
+
+    >>> subscriber = nmevent.Subscriber(
+    ...    nmevent.SocketClient('/tmp/events.sock')) # doctest: +SKIP
+    >>> tick = nmevent.RemoteEvent(subscriber, 'tick') # doctest: +SKIP
+    >>> tick += handler # doctest: +SKIP
+
+    :param subscriber: :class:`Subscriber` receiving the event
+    :param name: name the event is published under
+    """
+
+    def __init__(self, subscriber, name):
+        self.subscriber = subscriber
+        self.name = name
+
+    @property
+    def handlers(self):
+        """:class:`CallbackStore` object with the handlers of the event."""
+        return self.subscriber.event(self.name).handlers
+
+    def __iadd__(self, handler):
+        self.handlers.add(handler)
+        self.subscriber.start()
+        return self
+
+    def __isub__(self, handler):
+        self.handlers.remove(handler)
+        return self
+
+    def __contains__(self, handler):
+        return handler in self.handlers
+
+    def __len__(self):
+        return len(self.handlers)
+
+class DerivedEvent(EventOperators):
+    """Event fired by other events.
+
+    Handlers are added with the ``+=`` and ``-=`` operators, as with
+    :class:`InstanceEvent`, and they're called with the arguments the
+    source events were fired with (including the sender). The derived
+    event subscribes to its sources only while it has handlers: it
+    attaches when the first handler is added and detaches when the
+    last one is removed, so nobody observing it costs the sources
+    nothing.
+
+    Note that a derived event of a bound event keeps the sender alive
+    while attached.
+
+    :param sources: events (bound, unbound or derived) the derived
+                    event observes
+
+    .. attribute:: sources
+
+       Tuple of the source events.
+
+    .. attribute:: handlers
+
+       :class:`CallbackStore` object with the handlers of the event.
+
+    .. attribute:: attached
+
+       ``True`` while the event is subscribed to its sources.
+    """
+
+    def __init__(self, *sources):
+        self.sources = sources
+        self.handlers = CallbackStore()
+        self.attached = False
+
+    def _update(self):
+        # Attaches to the sources or detaches from them, following
+        # the handlers; called with the lock held.
+        observed = (len(self.handlers.snapshot) > 0 or
+                    self.handlers.routes is not None)
+        if observed == self.attached:
+            return
+        for source in self.sources:
+            if observed:
+                source += self._receive
+            else:
+                source -= self._receive
+        self.attached = observed
+        if not observed:
+            self._reset()
+
+    def _reset(self):
+        # Called when the event detaches from its sources.
+        pass
+
+    def _receive(*args, **keywords):
+        # Handler of the source events; unpacked by hand like
+        # Dispatch.__call__.
+        self, args = args[0], args[1:]
+        self.handlers.call(*args, **keywords)
+
+    def add_handler(self, handler):
+        """Adds a handler, attaching to the sources if it's the first one."""
+        with _lock:
+            self.handlers.add(handler)
+            self._update()
+        return self
+    __iadd__ = add_handler
+
+    def remove_handler(self, handler):
+        """Removes a handler, detaching from the sources if it's the last one."""
+        with _lock:
+            self.handlers.remove(handler)
+            self._update()
+        return self
+    __isub__ = remove_handler
+
+    def subscribe(self, handler, **filters):
+        """Adds a handler called only for the matching keyword arguments.
+
+        See :meth:`Event.subscribe`.
+        """
+        with _lock:
+            self.handlers.subscribe(handler, **filters)
+            self._update()
+        return self
+
+    def unsubscribe(self, handler, **filters):
+        """Removes a handler added by :meth:`subscribe`."""
+        with _lock:
+            self.handlers.unsubscribe(handler, **filters)
+            self._update()
+        return self
+
+    def has_handler(self, handler):
+        """Returns ``True`` if ``handler`` is this event's handler."""
+        return handler in self.handlers
+    __contains__ = has_handler
+
+    def __len__(self):
+        return len(self.handlers)
+
+    def fire(*args, **keywords):
+        """Calls the handlers of the derived event directly."""
+        self, args = args[0], args[1:]
+        return self.handlers.call(*args, **keywords)
+    __call__ = fire
+
+class FilteredEvent(DerivedEvent):
+    """Derived event delivering only the fires matching a predicate.
+
+    >>> big = nmevent.Event()
+    >>> small = big.filter(lambda sender, size: size < 10)
+    >>> def handler(sender, size):
+    ...    print "size", size
+    ...
+    >>> small += handler
+    >>> big(None, 5)
+    size 5
+    >>> big(None, 50)
+
+    :param source: event to be filtered
+    :param predicate: function called with the arguments of each fire,
+                      returning ``True`` if the fire should be delivered
+    """
+
+    def __init__(self, source, predicate):
+        DerivedEvent.__init__(self, source)
+        self.predicate = predicate
+
+    def _receive(*args, **keywords):
+        self, args = args[0], args[1:]
+        if self.predicate(*args, **keywords):
+            self.handlers.call(*args, **keywords)
+
+class MappedEvent(DerivedEvent):
+    """Derived event delivering a value computed from each fire.
+
+    The handlers are called with the sender and the value returned
+    by ``function``, which is called with the arguments of the fire:
+
+    >>> changed = nmevent.Event()
+    >>> doubled = changed.map(lambda sender, value: value * 2)
+    >>> def handler(sender, value):
+    ...    print value
+    ...
+    >>> doubled += handler
+    >>> changed(None, 21)
+    42
+
+    :param source: event to be mapped
+    :param function: function computing the value delivered
+    """
+
+    def __init__(self, source, function):
+        DerivedEvent.__init__(self, source)
+        self.function = function
+
+    def _receive(*args, **keywords):
+        self, args = args[0], args[1:]
+        sender = args[0] if args else None
+        self.handlers.call(sender, self.function(*args, **keywords))
+
+def merge(*events):
+    """Returns a :class:`DerivedEvent` fired by any of ``events``.
+
+    >>> a, b = nmevent.Event(), nmevent.Event()
+    >>> either = nmevent.merge(a, b)
+    >>> def handler(sender):
+    ...    print "fired by", sender
+    ...
+    >>> either += handler
+    >>> a('a')
+    fired by a
+    >>> b('b')
+    fired by b
+
+    Like the other derived events, the merged event subscribes to
+    the events only while it has handlers.
+    """
+    return DerivedEvent(*events)
+
+class RateLimitedEvent(DerivedEvent):
+    """Base class of the derived events limiting the rate of their source.
+
+    The fires received from the source are held back and delivered
+    later, when a timer expires. Without ``loop``, the timer is
+    a :class:`threading.Timer` and the handlers are called by its
+    thread, otherwise they're called by the thread of the asyncio
+    event loop.
+
+    Fires held back when the event detaches are discarded.
+
+    :param source: event to be rate-limited
+    :param interval: interval (or delay) in seconds
+    :param loop: asyncio event loop to call the handlers, ``None``
+                 to use timer threads
+
+    .. attribute:: interval
+
+       Interval (or delay) of the event in seconds.
+
+    .. attribute:: loop
+
+       Event loop calling the handlers or ``None``.
+
+    .. attribute:: scheduled
+
+       ``True`` while the timer is running.
+    """
+
+    def __init__(self, source, interval, loop = None):
+        DerivedEvent.__init__(self, source)
+        self.interval = interval
+        self.loop = loop
+        self.scheduled = False
+        self._pending = None
+        self._state = threading.Lock()
+
+    def _schedule(self, delay):
+        # Starts the timer; called with self._state held.
+        self.scheduled = True
+        delay = max(delay, 0)
+        if self.loop is None:
+            timer = threading.Timer(delay, self._expire)
+            timer.daemon = True
+            timer.start()
+        else:
+            self.loop.call_soon_threadsafe(
+                self.loop.call_later, delay, self._expire)
+
+    def _take(self):
+        # Returns the held back fires and forgets them.
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return ()
+        return (pending, )
+
+    def _expired(self, now):
+        # Returns the fires to be delivered when the timer expires;
+        # called with self._state held.
+        return self._take()
+
+    def _expire(self):
+        with self._state:
+            self.scheduled = False
+            pending = self._expired(_clock())
+        self._deliver(pending)
+
+    def _deliver(self, pending):
+        for args, keywords in pending:
+            self.handlers.call(*args, **keywords)
+
+    def _reset(self):
+        with self._state:
+            self._take()
+
+    def flush(self):
+        """Delivers the fires held back right away."""
+        with self._state:
+            pending = self._take()
+        self._deliver(pending)
+
+class ThrottledEvent(RateLimitedEvent):
+    """Derived event delivered at most once per interval.
+
+    The first fire is delivered right away. The fires received during
+    the following ``interval`` seconds are held back and only the last
+    of them is delivered when the interval ends, which starts the next
+    interval.
+    """
+
+    def __init__(self, source, interval, loop = None):
+        RateLimitedEvent.__init__(self, source, interval, loop)
+        self._next = 0.0
+
+    def _receive(*args, **keywords):
+        self, args = args[0], args[1:]
+        now = _clock()
+        with self._state:
+            if self.scheduled or now < self._next:
+                self._pending = (args, keywords)
+                if not self.scheduled:
+                    self._schedule(self._next - now)
+                return
+            self._next = now + self.interval
+        self.handlers.call(*args, **keywords)
+
+    def _expired(self, now):
+        pending = self._take()
+        if pending:
+            self._next = now + self.interval
+        return pending
+
+class DebouncedEvent(RateLimitedEvent):
+    """Derived event delivered once its source calms down.
+
+    Only the last fire is delivered, after no other fire has been
+    received for ``interval`` seconds (the delay).
+    """
+
+    def __init__(self, source, delay, loop = None):
+        RateLimitedEvent.__init__(self, source, delay, loop)
+        self._deadline = 0.0
+
+    def _receive(*args, **keywords):
+        self, args = args[0], args[1:]
+        with self._state:
+            self._pending = (args, keywords)
+            self._deadline = _clock() + self.interval
+            if not self.scheduled:
+                self._schedule(self.interval)
+
+    def _expired(self, now):
+        # The timer isn't restarted by every fire; instead, it's
+        # started again for the rest of the delay when it expires.
+        if now < self._deadline:
+            self._schedule(self._deadline - now)
+            return ()
+        return self._take()
+
+class SampledEvent(RateLimitedEvent):
+    """Derived event delivering the last fire at the end of each interval.
+
+    Unlike :class:`ThrottledEvent`, even the first fire is held back
+    until the interval ends. No timer runs while the source is idle.
+    """
+
+    def _receive(*args, **keywords):
+        self, args = args[0], args[1:]
+        with self._state:
+            self._pending = (args, keywords)
+            if not self.scheduled:
+                self._schedule(self.interval)
+
+class CoalescedEvent(RateLimitedEvent):
+    """Derived event delivering the last fire of each key per interval.
+
+    The fires are held back for ``interval`` seconds, then the last
+    fire of each key is delivered, in the order the keys were first
+    seen. For example, coalescing ``property_changed`` by ``'name'``
+    delivers one fire per changed property:
+
+    >>> changes = example.property_changed.coalesced('name') # doctest: +SKIP
+
+    :param key: ``None`` to coalesce by the sender, name of the keyword
+                argument to coalesce by, or function called with the
+                arguments of the fire, returning the key
+    """
+
+    def __init__(self, source, key = None, interval = 0.05, loop = None):
+        RateLimitedEvent.__init__(self, source, interval, loop)
+        self.key = key
+        self._pending = collections.OrderedDict()
+
+    def _key(self, args, keywords):
+        key = self.key
+        if key is None:
+            return args[0] if args else None
+        if isinstance(key, basestring):
+            return keywords.get(key)
+        return key(*args, **keywords)
+
+    def _receive(*args, **keywords):
+        self, args = args[0], args[1:]
+        key = self._key(args, keywords)
+        with self._state:
+            self._pending[key] = (args, keywords)
+            if not self.scheduled:
+                self._schedule(self.interval)
+
+    def _take(self):
+        pending, self._pending = self._pending, collections.OrderedDict()
+        return pending.values()
+
+STREAM_POLICIES = ('drop_oldest', 'drop_newest', 'block', )
+
+_StopAsyncIteration = getattr(__builtin__, 'StopAsyncIteration', StopIteration)
+
+class EventStream(object):
+    """Bounded buffer of the fires of an event, consumed by pulling.
+
+    While open, the stream is a handler of the event, buffering each
+    fire as a ``(sender, args, keywords)`` tuple. The consumer takes
+    the fires by iterating over the stream, which blocks until a fire
+    is buffered and stops when the stream is closed and empty, or
+    takes everything buffered at once by :meth:`drain`:
+
+    >>> ticks = nmevent.Event()
+    >>> with ticks.stream(maxlen = 2) as stream:
+    ...    for i in range(3):
+    ...       ticks(None, i)
+    ...    stream.drain()
+    ...
+    [(None, (1,), {}), (None, (2,), {})]
+
+    When the buffer is full, the oldest fire is dropped
+    (``'drop_oldest'``), the new fire is dropped (``'drop_newest'``),
+    or the firing thread waits for the consumer (``'block'``; the
+    consumer mustn't be the thread firing the event then).
+
+    In :mod:`trollius` (or :mod:`asyncio`) code, the stream can also
+    be consumed without blocking the event loop: :meth:`__anext__`
+    returns a future of the next fire, resolved in the loop that asked
+    for it. The module runs on Python 2, which has no ``async for``, so
+    a coroutine waits for the futures itself::
+
+        @trollius.coroutine
+        def consume(stream):
+            while True:
+                try:
+                    sender, args, keywords = yield trollius.From(
+                        stream.__anext__())
+                except StopIteration:
+                    break
+                ...
+
+    The future fails with :exc:`StopIteration` once the stream is
+    closed and empty; catch it, or the coroutine silently returns.
+
+    :param event: event (bound, unbound or derived) to be consumed
+    :param maxlen: maximum number of buffered fires
+    :param overflow: ``'drop_oldest'``, ``'drop_newest'`` or ``'block'``
+
+    .. attribute:: dropped
+
+       Number of fires dropped because the buffer was full.
+
+    .. attribute:: closed
+
+       ``True`` unless the stream is open.
+    """
+
+    def __init__(self, event, maxlen = 1024, overflow = 'drop_oldest'):
+        if overflow not in STREAM_POLICIES:
+            raise ValueError, "Unknown overflow policy: %r" % (overflow, )
+        self.event = event
+        self.maxlen = maxlen
+        self.overflow = overflow
+        self.dropped = 0
+        self.closed = True
+        self._items = collections.deque()
+        self._waiters = []
+        self._condition = threading.Condition(threading.Lock())
+
+    def open(self):
+        """Starts buffering the fires of the event."""
+        with self._condition:
+            if not self.closed:
+                return self
+            self.closed = False
+        event = self.event
+        event += self._receive
+        return self
+
+    def close(self):
+        """Stops buffering; the fires already buffered can still be taken."""
+        with self._condition:
+            if self.closed:
+                return
+            self.closed = True
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, []
+        event = self.event
+        event -= self._receive
+        self._wake(waiters)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _receive(*args, **keywords):
+        # Unpacked by hand like Dispatch.__call__.
+        self, args = args[0], args[1:]
+        item = (args[0] if args else None, args[1:], keywords)
+        with self._condition:
+            while len(self._items) >= self.maxlen and not self.closed:
+                if self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    return
+                if self.overflow == 'drop_oldest':
+                    self._items.popleft()
+                    self.dropped += 1
+                    break
+                self._condition.wait()
+            self._items.append(item)
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, []
+        self._wake(waiters)
+
+    def _take(self):
+        # Takes the oldest buffered fire; called with the lock held.
+        item = self._items.popleft()
+        if self.overflow == 'block':
+            self._condition.notify_all()
+        return item
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """Returns the oldest buffered fire, waiting for one if needed.
+
+        :raises StopIteration: if the stream is closed and empty
+        """
+        with self._condition:
+            while not self._items:
+                if self.closed:
+                    raise StopIteration
+                self._condition.wait()
+            return self._take()
+
+    def drain(self, limit = None):
+        """Returns a list of the buffered fires without waiting.
+
+        :param limit: maximum number of fires to take, ``None``
+                      to take all of them
+        """
+        with self._condition:
+            if limit is None or limit >= len(self._items):
+                items = list(self._items)
+                self._items.clear()
+            else:
+                items = [self._items.popleft() for i in xrange(limit)]
+            if items and self.overflow == 'block':
+                self._condition.notify_all()
+        return items
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        """Returns a future of the next fire in the current event loop."""
+        asyncio = _import_asyncio()
+        loop = asyncio.get_event_loop()
+        future = asyncio.Future(loop = loop)
+        with self._condition:
+            if self._items:
+                future.set_result(self._take())
+            elif self.closed:
+                future.set_exception(_StopAsyncIteration())
+            else:
+                self._waiters.append((loop, future))
+        return future
+
+    def _wake(self, waiters):
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(self._resolve, loop, future)
+
+    def _resolve(self, loop, future):
+        # Runs in the waiter's loop; another consumer may have taken
+        # the fire meanwhile, in which case the waiter waits again.
+        if future.done():
+            return
+        with self._condition:
+            if self._items:
+                future.set_result(self._take())
+            elif self.closed:
+                future.set_exception(_StopAsyncIteration())
+            else:
+                self._waiters.append((loop, future))
+
 def discover_handlers(observer, subject, prefix):
     """Discovers event handlers for the subject's events in the observer.
     
@@ -0,0 +1,414 @@
+# -*- coding: utf8 -*-
+
+"""Benchmarks of the :mod:`nmevent` module.
+
+Run with ``python test/bench_nmevent.py`` (or ``make bench``) to run
+the benchmark suite and compare the results with the baseline, if there
+is one. The results are absolute times, so the baseline is only
+meaningful on the machine it was recorded on and none is shipped with
+the sources: record it locally first with ``--save-baseline`` (``make
+bench-baseline``), before the changes to be measured. With ``--check``
+(``make bench-check``) the script fails if there is no baseline or if
+any benchmark got slower than the baseline by more than the threshold.
+Run it with ``--help`` to see the other options, e.g. ``--comparisons``
+to print the tables comparing the current implementation with the
+former ones.
+"""
+
+import json
+import optparse
+import os
+import platform
+import sys
+import timeit
+sys.path.insert(1, sys.path[0] + '/../nmevent')
+
+import nmevent
+
+HANDLER_COUNTS = (1, 10, 100, 1000, )
+
+class SetCallbackStore(nmevent.CallbackStore):
+	"""Callback store that iterates over its set of callbacks
+	on every call, like :class:`nmevent.CallbackStore` did before
+	it started keeping a snapshot.
+	"""
+	def call(self, *args, **keywords):
+		for callback in self.callbacks:
+			callback(*args, **keywords)
+
+def make_handler():
+	def handler(sender, *args, **keywords):
+		pass
+	return handler
+
+def measure(function, min_time = 0.2):
+	"""Returns the time of one call of ``function`` in microseconds."""
+	timer = timeit.Timer(function)
+	number = 1
+	while True:
+		elapsed = min(timer.repeat(3, number))
+		if elapsed >= min_time:
+			return elapsed / number * 1e6
+		number *= 10
+
+def bench_store_call():
+	"""Cost of calling a callback store (set iteration vs snapshot)."""
+	results = []
+	for count in HANDLER_COUNTS:
+		handlers = [make_handler() for x in range(count)]
+		row = [count]
+		for clss in (SetCallbackStore, nmevent.CallbackStore):
+			store = clss()
+			for handler in handlers:
+				store += handler
+			row.append(measure(lambda: store(None, old_value = 1)))
+		results.append(row)
+	return results
+
+def bench_instance_memory(count = 1000000):
+	"""Memory taken by the event data of ``count`` instances, each with
+	a handler on one of its three events. Compares the size of the
+	instances' event tables with the size of the dictionaries keyed by
+	``id(event)`` that were used before event layouts.
+	"""
+	class Model(object):
+		a_changed = nmevent.Event()
+		b_changed = nmevent.Event()
+		c_changed = nmevent.Event()
+	event = Model.__dict__['b_changed']
+	ordinal = nmevent._event_ordinal(Model, event)
+	handler = make_handler()
+	dict_bytes = 0
+	table_bytes = 0
+	for x in xrange(count):
+		instance = Model()
+		instance.b_changed += handler
+		table = instance.__dict__[nmevent.EVENTS_ATTRIBUTE]
+		table_bytes += sys.getsizeof(table)
+		dict_bytes += sys.getsizeof({id(event): table[ordinal]})
+	return dict_bytes, table_bytes
+
+class EagerProperty(nmevent.Property):
+	"""Property that always retrieves and compares the old value,
+	like :class:`nmevent.Property` did before it started checking
+	whether anyone listens.
+	"""
+	def __set__(self, obj, value):
+		old_value = self.fget(obj)
+		self.fset(obj, value)
+		if old_value != value:
+			self.fire_changed(obj.__class__, obj, old_value)
+
+def bench_property_set():
+	"""Cost of setting a property with and without a listener,
+	compared with always reading the old value."""
+	results = []
+	for observed in (False, True):
+		row = [observed]
+		for clss in (EagerProperty, nmevent.Property):
+			@nmevent.with_events
+			@nmevent.with_properties
+			class Model(object):
+				x = clss()
+			model = Model()
+			if observed:
+				model.x_changed += make_handler()
+			def assign(model = model):
+				for value in xrange(100):
+					model.x = value
+			row.append(measure(assign) / 100)
+		results.append(row)
+	return results
+
+def closure_properties(clss):
+	"""Decorates ``clss`` with the getter and setter closures that
+	:func:`nmevent.with_properties` used before it compiled them."""
+	def make_getter(attr):
+		def getter(self):
+			if not hasattr(self, attr):
+				setattr(self, attr, None)
+			return getattr(self, attr)
+		return getter
+	def make_setter(attr):
+		def setter(self, value):
+			setattr(self, attr, value)
+		return setter
+	for name, attr in clss.__dict__.items():
+		if isinstance(attr, nmevent.Property):
+			attr.fget = make_getter("_%s" % name)
+			attr.fset = make_setter("_%s" % name)
+	return clss
+
+def bench_accessors():
+	"""Cost of reading and writing a property created by
+	:func:`nmevent.with_properties`, and size of an instance."""
+	class Plain(object):
+		def __init__(self):
+			self.x = 0
+	@closure_properties
+	class Closures(object):
+		x = nmevent.Property()
+	@nmevent.with_properties
+	class Compiled(object):
+		x = nmevent.Property()
+	@nmevent.with_properties(slots = True)
+	class Slots(object):
+		x = nmevent.Property()
+	results = []
+	for clss in (Plain, Closures, Compiled, Slots):
+		instance = clss()
+		instance.x = 0
+		size = sys.getsizeof(instance)
+		if hasattr(instance, '__dict__'):
+			size += sys.getsizeof(instance.__dict__)
+		def read(instance = instance):
+			instance.x; instance.x; instance.x; instance.x; instance.x
+		def write(instance = instance):
+			instance.x = 1; instance.x = 1; instance.x = 1; instance.x = 1; instance.x = 1
+		results.append((clss.__name__, measure(read) / 5, measure(write) / 5, size))
+	return results
+
+def run():
+	print "CallbackStore.call (microseconds per call)"
+	print "%10s %12s %12s %8s" % ("handlers", "set", "snapshot", "speedup")
+	for count, before, after in bench_store_call():
+		print "%10d %12.3f %12.3f %7.2fx" % (count, before, after, before / after)
+	print
+	print "Property.__set__ (microseconds per assignment)"
+	print "%10s %12s %12s %8s" % ("observed", "eager", "lazy", "speedup")
+	for observed, before, after in bench_property_set():
+		print "%10s %12.3f %12.3f %7.2fx" % (observed, before, after, before / after)
+	print
+	print "with_properties accessors (microseconds per access, bytes per instance)"
+	print "%10s %12s %12s %8s" % ("accessors", "read", "write", "size")
+	for name, read, write, size in bench_accessors():
+		print "%10s %12.3f %12.3f %8d" % (name, read, write, size)
+	print
+	count = 1000000
+	dict_bytes, table_bytes = bench_instance_memory(count)
+	print "Event data of %d instances (MiB)" % (count, )
+	print "%10s %12s %8s" % ("dict", "table", "saving")
+	print "%10.1f %12.1f %7.1f%%" % (dict_bytes / 2.0 ** 20,
+		table_bytes / 2.0 ** 20, 100.0 * (dict_bytes - table_bytes) / dict_bytes)
+
+FIRE_HANDLER_COUNTS = (0, 1, 10, 100, 1000, 10000, )
+DECORATED_SIZE = 200
+ADAPTED_SIZE = 200
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	'bench_baseline.json')
+
+def bench_fire(count):
+	"""``Event.fire`` with ``count`` handlers."""
+	event = nmevent.Event()
+	for x in range(count):
+		event += make_handler()
+	return lambda: event.fire(None, old_value = 1)
+
+def events_model():
+	class Model(object):
+		event = nmevent.Event()
+		cached = nmevent.Event(cached = True)
+	model = Model()
+	model.event += make_handler()
+	model.cached += make_handler()
+	return Model, model
+
+def bench_bound_call():
+	"""Calling a bound event, i.e. ``instance.event()``."""
+	Model, model = events_model()
+	return lambda: model.event()
+
+def bench_unbound_call():
+	"""Calling an unbound event, i.e. ``Class.event(instance)``."""
+	Model, model = events_model()
+	return lambda: Model.event(model)
+
+def bench_held_call():
+	"""Calling a bound event that has been retrieved before."""
+	Model, model = events_model()
+	event = model.event
+	return lambda: event()
+
+def bench_descriptor():
+	"""Accessing an event through an instance."""
+	Model, model = events_model()
+	return lambda: model.event
+
+def bench_cached_descriptor():
+	"""Accessing a cached event through an instance."""
+	Model, model = events_model()
+	return lambda: model.cached
+
+def properties_model(observed):
+	@nmevent.with_events
+	@nmevent.with_properties
+	class Model(object):
+		x = nmevent.Property()
+	model = Model()
+	if observed:
+		model.x_changed += make_handler()
+	return model
+
+def bench_property_get():
+	"""Reading a property."""
+	model = properties_model(False)
+	return lambda: model.x
+
+def bench_property_set_value(observed):
+	"""Setting a property to a new value."""
+	model = properties_model(observed)
+	values = iter(xrange(sys.maxint))
+	def assign(model = model, next = values.next):
+		model.x = next()
+	return assign
+
+def large_class_dict(size):
+	attrs = {}
+	for x in range(size):
+		attrs['event%d' % x] = nmevent.Event()
+		attrs['prop%d' % x] = nmevent.Property()
+	return attrs
+
+def bench_with_events():
+	"""Decorating a class with ``DECORATED_SIZE`` events and properties."""
+	return lambda: nmevent.with_events(
+		type('Large', (object, ), large_class_dict(DECORATED_SIZE)))
+
+def bench_with_properties():
+	"""Decorating a class with ``DECORATED_SIZE`` events and properties."""
+	return lambda: nmevent.with_properties(
+		type('Large', (object, ), large_class_dict(DECORATED_SIZE)))
+
+def bench_adapt():
+	"""Connecting and disconnecting an observer with ``ADAPTED_SIZE``
+	handler methods, plus as many other methods."""
+	subject_attrs = {}
+	observer_attrs = {}
+	for x in range(ADAPTED_SIZE):
+		subject_attrs['event%d' % x] = nmevent.Event()
+		observer_attrs['on_event%d' % x] = lambda self, sender: None
+		observer_attrs['method%d' % x] = lambda self: None
+	subject = type('Subject', (object, ), subject_attrs)()
+	observer = type('Observer', (object, ), observer_attrs)()
+	def adapt():
+		nmevent.adapt(observer, subject)
+		nmevent.adapt(observer, subject, disconnect = True)
+	return adapt
+
+def suite():
+	"""Returns the list of ``(name, setup)`` pairs of the benchmark suite.
+
+	Calling ``setup`` returns the function that is measured.
+	"""
+	cases = []
+	for count in FIRE_HANDLER_COUNTS:
+		cases.append(('fire/%d' % count, lambda count = count: bench_fire(count)))
+	cases += [
+		('call/bound', bench_bound_call),
+		('call/unbound', bench_unbound_call),
+		('call/held', bench_held_call),
+		('access/descriptor', bench_descriptor),
+		('access/cached', bench_cached_descriptor),
+		('property/get', bench_property_get),
+		('property/set', lambda: bench_property_set_value(False)),
+		('property/set-observed', lambda: bench_property_set_value(True)),
+		('decorate/with_events', bench_with_events),
+		('decorate/with_properties', bench_with_properties),
+		('adapt', bench_adapt),
+	]
+	return cases
+
+def run_suite(selected = None, min_time = 0.2):
+	"""Runs the benchmark suite and returns the results as a dictionary
+	mapping the names of the benchmarks to microseconds per call."""
+	results = {}
+	for name, setup in suite():
+		if selected and not any(name.startswith(prefix) for prefix in selected):
+			continue
+		results[name] = measure(setup(), min_time)
+	return results
+
+def compare(results, baseline, threshold):
+	"""Returns the list of ``(name, baseline, result, ratio)`` tuples
+	of the benchmarks that got slower than ``baseline`` by more than
+	``threshold`` (e.g. ``0.25`` for 25%)."""
+	regressions = []
+	for name, result in sorted(results.items()):
+		before = baseline.get(name)
+		if before and result > before * (1 + threshold):
+			regressions.append((name, before, result, result / before))
+	return regressions
+
+def write_json(document, output):
+	json.dump(document, output, indent = 1, sort_keys = True,
+		separators = (',', ': '))
+	output.write('\n')
+
+def main(argv = None):
+	parser = optparse.OptionParser(usage = "%prog [options] [benchmark prefix ...]")
+	parser.add_option('--baseline', default = BASELINE,
+		help = "baseline file [%default]")
+	parser.add_option('--save-baseline', action = 'store_true',
+		help = "store the results as the new baseline")
+	parser.add_option('--check', action = 'store_true',
+		help = "fail if there is no baseline or if a benchmark regressed")
+	parser.add_option('--threshold', type = 'float', default = 0.25,
+		help = "allowed slowdown relative to the baseline [%default]")
+	parser.add_option('--json', metavar = 'FILE',
+		help = "write the results to FILE as JSON, '-' for stdout")
+	parser.add_option('--min-time', type = 'float', default = 0.2,
+		help = "minimum time of one measurement in seconds [%default]")
+	parser.add_option('--comparisons', action = 'store_true',
+		help = "print the comparisons with the former implementations")
+	options, selected = parser.parse_args(argv)
+	if options.comparisons:
+		run()
+		return 0
+	results = run_suite(selected, options.min_time)
+	document = {
+		'python': platform.python_version(),
+		'implementation': platform.python_implementation(),
+		'results': results,
+	}
+	if options.json == '-':
+		write_json(document, sys.stdout)
+	elif options.json:
+		with open(options.json, 'w') as output:
+			write_json(document, output)
+	if options.save_baseline:
+		if selected and os.path.exists(options.baseline):
+			with open(options.baseline) as input:
+				previous = json.load(input)
+			previous['results'].update(results)
+			document['results'] = previous['results']
+		with open(options.baseline, 'w') as output:
+			write_json(document, output)
+		return 0
+	baseline = {}
+	if os.path.exists(options.baseline):
+		with open(options.baseline) as input:
+			baseline = json.load(input)['results']
+	out = sys.stderr if options.json == '-' else sys.stdout
+	if options.check and not baseline:
+		print >> out, "No baseline in %s, record one first with --save-baseline." % (
+			options.baseline, )
+		return 2
+	print >> out, "%-26s %12s %12s %8s" % ("benchmark", "baseline", "result", "ratio")
+	for name, result in sorted(results.items()):
+		before = baseline.get(name)
+		if before:
+			print >> out, "%-26s %12.3f %12.3f %7.2fx" % (name, before, result, result / before)
+		else:
+			print >> out, "%-26s %12s %12.3f" % (name, "-", result)
+	regressions = compare(results, baseline, options.threshold)
+	if regressions:
+		print >> out
+		print >> out, "Regressions over %d%%:" % (options.threshold * 100, )
+		for name, before, result, ratio in regressions:
+			print >> out, "  %s: %.3f -> %.3f us (%.2fx)" % (name, before, result, ratio)
+		if options.check:
+			return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
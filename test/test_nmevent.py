@@ -1,13 +1,34 @@
 # -*- coding: utf8 -*-
 
 import unittest
+import copy
 import doctest
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import socket
 import sys
+import tempfile
+import time
+import threading
+import weakref
 # sys.path.append(sys.path[0] + '/../nmevent')
 sys.path.insert(1, sys.path[0] + '/../nmevent')
 
 import nmevent
 
+try:
+	asyncio = nmevent._import_asyncio()
+except ImportError:
+	asyncio = None
+
+try:
+	futures = nmevent._import_futures()
+except ImportError:
+	futures = None
+
 suite = unittest.TestSuite()
 suite.addTests(doctest.DocFileSuite('../doc/index.rst', globs = {'nmevent': nmevent}))
 suite.addTests(doctest.DocTestSuite(nmevent, {'nmevent': nmevent}))
@@ -51,6 +72,15 @@ class Subject(object):
 	def fire_b(self):
 		self.event_b(self)
 
+@nmevent.with_events
+@nmevent.with_properties
+class PickledSubject(object):
+	event = nmevent.Event()
+	x = nmevent.Property()
+
+class CachedSubject(object):
+	event = nmevent.Event(cached = True)
+
 class Observer(object):
 	def __init__(self):
 		self.event_caught = False
@@ -100,6 +130,17 @@ class WeakRefCallbackTest(unittest.TestCase):
 		del self.obj1
 		self.assertFalse(self.r1_foo.is_alive)
 	
+	def test_on_death(self):
+		died = []
+		callback = nmevent.WeakRefCallback(self.obj1.foo, died.append)
+		del self.obj1
+		self.assertEqual(died, [callback])
+	
+	def test_equality(self):
+		self.assertEqual(self.r1_foo, nmevent.WeakRefCallback(self.obj1.foo))
+		self.assertNotEqual(self.r1_foo, self.r1_bar)
+		self.assertNotEqual(self.r1_foo, self.r2_foo)
+
 	def test_hash(self):
 		self.assertEqual(hash(self.r1_foo),
 			hash(nmevent.WeakRefCallback(self.obj1.foo)))
@@ -224,6 +265,121 @@ class CallbackStoreTest(unittest.TestCase):
 		self.assertEqual(store.count(), 0)
 		self.assertFalse(observer.handler in store)
 
+	def test_mutation_during_call(self):
+		store = nmevent.CallbackStore()
+		observers = [Observer() for x in range(10)]
+		late_observer = Observer()
+
+		def subscribing_handler(*args, **keywords):
+			store.add(late_observer.handler)
+			for observer in observers:
+				if observer.handler in store:
+					store.remove(observer.handler)
+
+		store += subscribing_handler
+		for observer in observers:
+			store += observer.handler
+
+		store(self)
+		self.assertEqual(late_observer.event_count, 0)
+		self.assertEqual(len(store), 2)
+		store(self)
+		self.assertEqual(late_observer.event_count, 1)
+	
+	def test_snapshot(self):
+		store = nmevent.CallbackStore()
+		self.assertEqual(store.snapshot, ())
+		observers = [Observer(), Observer(), ]
+		for observer in observers:
+			store += observer.handler
+		self.assertEqual(set(store.snapshot), store.callbacks)
+		self.assertEqual(set(store), store.callbacks)
+		store -= observers[0].handler
+		self.assertEqual(store.snapshot, (observers[1].handler, ))
+		store.clear()
+		self.assertEqual(store.snapshot, ())
+
+@case
+class WeakRefCallbackStoreTest(unittest.TestCase):
+	def test_bound_methods(self):
+		store = nmevent.WeakRefCallbackStore()
+		observers = [Observer(), Observer(), ]
+		for observer in observers:
+			store += observer.handler
+		store += observers[0].handler
+		self.assertEqual(len(store), 2)
+		self.assertTrue(observers[0].handler in store)
+		store(self)
+		self.assertEqual([o.event_count for o in observers], [1, 1])
+
+		store -= observers[1].handler
+		self.assertFalse(observers[1].handler in store)
+		store(self)
+		self.assertEqual([o.event_count for o in observers], [2, 1])
+	
+	def test_eager_removal(self):
+		store = nmevent.WeakRefCallbackStore()
+		observers = [Observer(), Observer(), ]
+		callable_observer = CallableObserver()
+		for observer in observers:
+			store += observer.handler
+		store += callable_observer
+		self.assertEqual(len(store), 3)
+		del observers[0]
+		self.assertEqual(len(store), 2)
+		self.assertEqual(len(store.snapshot), 2)
+		del callable_observer
+		self.assertEqual(len(store), 1)
+		store(self)
+		self.assertEqual(observers[0].event_count, 1)
+	
+	def test_died_while_changing(self):
+		# The garbage collector may run in the middle of a change and
+		# kill handlers; here they die while the collection is looking
+		# its callbacks up.
+		store = nmevent.WeakRefCallbackStore()
+		victims = [Observer() for i in range(20)]
+		for victim in victims:
+			store += victim.handler
+		del victim
+		class Killer(object):
+			armed = False
+			def __call__(self, sender):
+				pass
+			def __getattr__(self, name):
+				if Killer.armed:
+					del victims[:]
+				raise AttributeError, name
+		killers = [Killer() for i in range(20)]
+		for killer in killers:
+			store += killer
+		Killer.armed = True
+		store += function_observer_a
+		self.assertEqual(len(store), 21)
+		self.assertEqual(len(store.snapshot), 21)
+		store(self)
+	
+	def test_weak_event(self):
+		class TestClass(object):
+			event = nmevent.Event(weak = True)
+		test = TestClass()
+		observer = Observer()
+		event = TestClass.event
+		test.event += observer.handler
+		event += observer.handler
+		self.assertTrue(isinstance(test.event.handlers,
+			nmevent.WeakRefCallbackStore))
+		self.assertTrue(isinstance(event.handlers,
+			nmevent.WeakRefCallbackStore))
+		test.event()
+		# Called once as the instance handler, once as the class handler.
+		self.assertEqual(observer.event_count, 2)
+		ref = weakref.ref(observer)
+		del observer
+		self.assertTrue(ref() is None)
+		self.assertEqual(len(test.event), 0)
+		self.assertEqual(len(event), 0)
+
 @case
 class EventTest(unittest.TestCase):
 	def test_interface(self):
@@ -366,6 +522,117 @@ class EventTest(unittest.TestCase):
 		self.assertRaises(AttributeError, test)
 		self.assertTrue(isinstance(inst.event, nmevent.InstanceEvent))
 
+	def test_cached(self):
+		class TestClass(object):
+			event = nmevent.Event(cached = True)
+		test1 = TestClass()
+		test2 = TestClass()
+		self.assertTrue(test1.event.is_bound)
+		self.assertTrue(test1.event.im_sender is test1)
+		self.assertFalse(nmevent.EVENTS_ATTRIBUTE in test1.__dict__)
+		self.assertFalse(TestClass.event is TestClass.event)
+
+		observer = Observer()
+		test1.event += observer.handler
+		self.assertTrue(test1.event is test1.event)
+		self.assertFalse(test1.event is test2.event)
+		self.assertTrue(
+			TestClass.__dict__['event'].bind(TestClass, test1) is test1.event)
+		self.assertTrue(observer.handler in test1.event)
+		self.assertFalse(observer.handler in test2.event)
+		test1.event()
+		test2.event()
+		self.assertEqual(observer.event_count, 1)
+	
+	def test_cached_slots(self):
+		class TestClass(object):
+			__slots__ = ('foo', nmevent.EVENTS_ATTRIBUTE, )
+			event = nmevent.Event(cached = True)
+		test = TestClass()
+		observer = Observer()
+		test.event += observer.handler
+		self.assertTrue(test.event is test.event)
+		test.event()
+		self.assertEqual(observer.event_count, 1)
+
+	def test_layout(self):
+		class A(object):
+			event_a = nmevent.Event()
+		class B(object):
+			event_b = nmevent.Event()
+		class C(A, B):
+			event_c = nmevent.Event()
+		layout = nmevent._event_layout(C)
+		self.assertEqual(sorted(layout.values()), [0, 1, 2])
+		self.assertEqual(layout[B.__dict__['event_b']], 0)
+		self.assertEqual(layout[A.__dict__['event_a']], 1)
+		self.assertEqual(layout[C.__dict__['event_c']], 2)
+		self.assertEqual(nmevent._event_layout(A), {A.__dict__['event_a']: 0})
+
+		c = C()
+		observers = [Observer(), Observer(), Observer()]
+		c.event_a += observers[0].handler
+		c.event_b += observers[1].handler
+		c.event_c += observers[2].handler
+		self.assertEqual(len(c.__dict__[nmevent.EVENTS_ATTRIBUTE]), 3)
+		c.event_b()
+		self.assertEqual([o.event_count for o in observers], [0, 1, 0])
+	
+	def test_layout_added_event(self):
+		class TestClass(object):
+			event1 = nmevent.Event()
+		test = TestClass()
+		observer1 = Observer()
+		observer2 = Observer()
+		test.event1 += observer1.handler
+		TestClass.event2 = nmevent.Event()
+		test.event2 += observer2.handler
+		self.assertEqual(len(test.__dict__[nmevent.EVENTS_ATTRIBUTE]), 2)
+		test.event2()
+		self.assertEqual(observer1.event_count, 0)
+		self.assertEqual(observer2.event_count, 1)
+	
+	def test_unpickled_without_layout(self):
+		subject = PickledSubject()
+		subject.event += function_observer_a
+		subject.event -= function_observer_a
+		data = pickle.dumps(subject)
+		# As if unpickled in a process where the class has no layout yet.
+		delattr(PickledSubject, nmevent.LAYOUT_ATTRIBUTE)
+		subject = pickle.loads(data)
+		self.assertTrue(nmevent.EVENTS_ATTRIBUTE in subject.__dict__)
+		subject.event()
+		subject.x = 1
+		self.assertFalse(PickledSubject.event.is_observed(subject))
+		observer = Observer()
+		subject.event += observer.handler
+		subject.event()
+		self.assertEqual(observer.event_count, 1)
+	
+	def test_cached_pickle(self):
+		subject = CachedSubject()
+		self.assertTrue(subject.event.im_sender is subject)
+		self.assertFalse(nmevent.EVENTS_ATTRIBUTE in subject.__dict__)
+		subject.event += function_observer_a
+		for protocol in (0, 2, ):
+			restored = pickle.loads(pickle.dumps(subject, protocol))
+			self.assertTrue(function_observer_a in restored.event)
+			self.assertTrue(restored.event is restored.event)
+			self.assertTrue(restored.event.im_sender is restored)
+		self.assertRaises(TypeError, pickle.dumps, CachedSubject.event)
+	
+	def test_cached_copy(self):
+		senders = []
+		subject = CachedSubject()
+		subject.event += lambda sender: senders.append(sender)
+		self.assertTrue(subject.event is subject.event)
+		for duplicate in (copy.copy(subject), copy.deepcopy(subject), ):
+			self.assertTrue(duplicate.event.im_sender is duplicate)
+			duplicate.event()
+			self.assertTrue(senders.pop() is duplicate)
+		subject.event()
+		self.assertTrue(senders.pop() is subject)
+
 @case
 class InstanceEventTest(unittest.TestCase):
 	def setUp(self):
@@ -397,6 +664,119 @@ class InstanceEventTest(unittest.TestCase):
 		except TypeError:
 			self.fail("Cannot call bound event without instance.")
 
+	def test_unobserved(self):
+		observer = Observer()
+		self.bound()
+		self.unbound(self.instance)
+		self.assertFalse(observer.handler in self.bound)
+		self.assertEqual(len(self.bound), 0)
+		self.assertRaises(KeyError, self.bound.__isub__, observer.handler)
+		self.assertFalse(nmevent.EVENTS_ATTRIBUTE in self.instance.__dict__)
+
+		self.bound += observer.handler
+		self.assertTrue(nmevent.EVENTS_ATTRIBUTE in self.instance.__dict__)
+		self.assertTrue(observer.handler in self.bound)
+		self.assertEqual(len(self.bound), 1)
+		self.bound()
+		self.assertEqual(observer.event_count, 1)
+	
+	def test_fire_bound(self):
+		observer = Observer()
+		self.event.fire_bound(self.instance)
+		self.assertFalse(nmevent.EVENTS_ATTRIBUTE in self.instance.__dict__)
+		self.bound += observer.handler
+		self.event.fire_bound(self.instance)
+		self.unbound.fire_bound(self.instance)
+		self.event.fire_bound(self.test_class())
+		self.assertEqual(observer.event_count, 2)
+
+	def test_is_observed(self):
+		observer = Observer()
+		other = self.test_class()
+		self.assertFalse(self.bound.is_observed(None))
+		self.assertFalse(self.unbound.is_observed(self.instance))
+		self.assertFalse(self.event.is_observed(self.instance))
+		self.bound += observer.handler
+		self.assertTrue(self.bound.is_observed(None))
+		self.assertTrue(self.unbound.is_observed(self.instance))
+		self.assertTrue(self.event.is_observed(self.instance))
+		self.assertFalse(self.event.is_observed(other))
+		self.bound -= observer.handler
+		self.assertFalse(self.event.is_observed(self.instance))
+
+@case
+class SlotsTest(unittest.TestCase):
+	def test_events_slot(self):
+		class TestClass(object):
+			__slots__ = ('foo', nmevent.EVENTS_ATTRIBUTE, )
+			event = nmevent.Event()
+		test = TestClass()
+		observer = Observer()
+		test.event()
+		test.event += observer.handler
+		test.event()
+		self.assertEqual(observer.event_count, 1)
+		self.assertFalse(id(test) in nmevent._weak_event_tables)
+	
+	def test_weak_event_table(self):
+		class TestClass(object):
+			__slots__ = ('_x', '__weakref__', )
+			event = nmevent.Event()
+			def get_x(self):
+				return self._x
+			def set_x(self, value):
+				self._x = value
+			x = nmevent.Property(get_x, set_x)
+			x_changed = nmevent.Event()
+			x.changed = x_changed
+		test = TestClass()
+		test._x = None
+		observer = Observer()
+
+		test.event()
+		test.x = 1
+		self.assertFalse(id(test) in nmevent._weak_event_tables)
+
+		test.event += observer.handler
+		test.x_changed += observer.handler
+		self.assertTrue(observer.handler in test.event)
+		test.event()
+		test.x = 2
+		self.assertEqual(observer.event_count, 2)
+		self.assertFalse(observer.handler in TestClass().event)
+
+		key = id(test)
+		ref = weakref.ref(test)
+		self.assertTrue(key in nmevent._weak_event_tables)
+		del test
+		self.assertTrue(ref() is None)
+		self.assertFalse(key in nmevent._weak_event_tables)
+	
+	def test_weak_event_table_cached(self):
+		class TestClass(object):
+			__slots__ = ('__weakref__', )
+			event = nmevent.Event(cached = True)
+		test = TestClass()
+		observer = Observer()
+		test.event += observer.handler
+		test.event()
+		self.assertEqual(observer.event_count, 1)
+		ref = weakref.ref(test)
+		del test
+		self.assertTrue(ref() is None)
+	
+	def test_no_storage(self):
+		class TestClass(object):
+			__slots__ = ('foo', )
+			event = nmevent.Event()
+		test = TestClass()
+		observer = Observer()
+		test.event()
+		self.assertFalse(observer.handler in test.event)
+		def subscribe():
+			test.event += observer.handler
+		self.assertRaises(TypeError, subscribe)
+
 @case
 class PropertyTest(unittest.TestCase):
 	def setUp(self):
@@ -438,6 +818,114 @@ class PropertyTest(unittest.TestCase):
 		self.instance.x = 3
 		self.assertEqual(observer.event_count, 3)
 
+	def test_unobserved(self):
+		self.instance.x = 1
+		self.instance.x = 2
+		self.assertFalse(nmevent.EVENTS_ATTRIBUTE in self.instance.__dict__)
+
+	def test_unobserved_getter(self):
+		calls = []
+		class TestClass(object):
+			def get_x(self):
+				calls.append(self)
+				return self._x
+			def set_x(self, value):
+				self._x = value
+			x = nmevent.Property(get_x, set_x)
+			x_changed = nmevent.Event()
+			x.changed = x_changed
+		test = TestClass()
+		test.x = 1
+		test.x = 2
+		self.assertEqual(calls, [])
+
+		observer = Observer()
+		test.x_changed += observer.handler
+		test.x = 3
+		self.assertEqual(calls, [test])
+		self.assertEqual(observer.event_count, 1)
+
+class Buffer(object):
+	"""Value that can't be compared for equality, like NumPy arrays."""
+	def __init__(self):
+		self.version = 0
+	def __eq__(self, other):
+		return self
+	def __ne__(self, other):
+		return self
+	def __nonzero__(self):
+		raise ValueError("The truth value of a buffer is ambiguous.")
+
+@case
+class ChangeDetectorTest(unittest.TestCase):
+	def create_instance(self, compare, value = None):
+		@nmevent.with_events
+		@nmevent.with_properties
+		class TestClass(object):
+			x = nmevent.Property(compare = compare)
+		instance = TestClass()
+		instance.x = value
+		self.observer = Observer()
+		instance.x_changed += self.observer.handler
+		return instance
+	
+	def test_equality(self):
+		instance = self.create_instance('equality')
+		instance.x = [1]
+		instance.x = [1]
+		self.assertEqual(self.observer.event_count, 1)
+		self.assertRaises(ValueError, setattr, instance, 'x', Buffer())
+	
+	def test_identity(self):
+		instance = self.create_instance('identity')
+		buf = Buffer()
+		instance.x = buf
+		instance.x = buf
+		self.assertEqual(self.observer.event_count, 1)
+		instance.x = [1]
+		instance.x = [1]
+		self.assertEqual(self.observer.event_count, 3)
+	
+	def test_always(self):
+		instance = self.create_instance('always')
+		instance.x = 1
+		instance.x = 1
+		self.assertEqual(self.observer.event_count, 2)
+	
+	def test_key(self):
+		instance = self.create_instance(len, [])
+		instance.x = [1, 2]
+		instance.x = [3, 4]
+		self.assertEqual(self.observer.event_count, 1)
+		instance.x = [1, 2, 3]
+		self.assertEqual(self.observer.event_count, 2)
+	
+	def test_version(self):
+		@nmevent.with_events
+		class TestClass(object):
+			@nmevent.nmproperty(compare = 'version')
+			def data(self):
+				return self._data
+
+			@data.setter
+			def data(self, value):
+				self._data.version += 1
+
+			def __init__(self):
+				self._data = Buffer()
+		instance = TestClass()
+		observer = Observer()
+		instance.data_changed += observer.handler
+		instance.data = instance.data
+		self.assertEqual(observer.event_count, 1)
+	
+	def test_detector_object(self):
+		detector = nmevent.IdentityChangeDetector()
+		self.assertTrue(nmevent.change_detector(detector) is detector)
+		self.assertTrue(isinstance(nmevent.change_detector(None),
+			nmevent.ChangeDetector))
+		self.assertRaises(ValueError, nmevent.change_detector, 'unknown')
+
 @case
 class WithEventsTest(unittest.TestCase):
 	def test_class(self):
@@ -510,6 +998,29 @@ class WithEventsTest(unittest.TestCase):
 		c.x = 2
 		self.assertEqual(observer.event_count, 2)
 
+	def test_cached(self):
+		@nmevent.with_events(cached = True)
+		class C(object):
+			@nmevent.nmproperty
+			def x(self):
+				return self._x
+			
+			@x.setter
+			def x(self, value):
+				self._x = value
+			
+			def __init__(self):
+				self._x = None
+		
+		c = C()
+		observer = Observer()
+		c.x_changed += observer.handler
+		c.property_changed += observer.handler
+		self.assertTrue(c.x_changed is c.x_changed)
+		self.assertTrue(c.property_changed is c.property_changed)
+		c.x = 1
+		self.assertEqual(observer.event_count, 2)
+
 @case
 class WithPropertiesTest(unittest.TestCase):
 	def test_multiple_properties(self):
@@ -553,6 +1064,1536 @@ class WithPropertiesTest(unittest.TestCase):
 		self.assertEqual(observer_a.event_count, 3)
 		self.assertEqual(observer_b.event_count, 0)
 
+	def test_generated_accessors(self):
+		@nmevent.with_properties
+		class A(object):
+			foo = nmevent.Property()
+		a = A()
+		self.assertTrue(a.foo is None)
+		self.assertTrue(a._foo is None)
+		self.assertEqual(A.foo.name, 'foo')
+		a.foo = 1
+		self.assertEqual(a._foo, 1)
+	
+	def test_slots(self):
+		@nmevent.with_events
+		@nmevent.with_properties(slots = True)
+		class A(object):
+			foo = nmevent.Property()
+			bar = nmevent.Property()
+		
+		a = A()
+		self.assertFalse(hasattr(a, '__dict__'))
+		self.assertEqual(A.__slots__,
+			('_bar', '_foo', nmevent.EVENTS_ATTRIBUTE, ))
+		self.assertTrue(a.foo is None)
+
+		observer = Observer()
+		a.foo_changed += observer.handler
+		a.property_changed += observer.handler
+		a.foo = 1
+		a.bar = 2
+		self.assertEqual(observer.event_count, 3)
+		self.assertFalse(id(a) in nmevent._weak_event_tables)
+	
+	def test_slots_merged(self):
+		class Base(object):
+			__slots__ = ('__weakref__', )
+		@nmevent.with_properties(slots = True)
+		class A(Base):
+			__slots__ = ('spam', )
+			foo = nmevent.Property()
+		a = A()
+		a.spam = 1
+		a.foo = 2
+		self.assertEqual(A.__slots__,
+			('spam', '_foo', nmevent.EVENTS_ATTRIBUTE, ))
+		self.assertEqual((a.spam, a.foo), (1, 2))
+	
+	def test_slots_dict(self):
+		@nmevent.with_properties(slots = True)
+		class A(object):
+			foo = nmevent.Property()
+			def __init__(self):
+				self.other = 1
+		self.assertRaises(AttributeError, A)
+		@nmevent.with_properties(slots = True)
+		class B(object):
+			__slots__ = ('__dict__', )
+			foo = nmevent.Property()
+			def __init__(self):
+				self.other = 1
+		b = B()
+		b.foo = 2
+		self.assertEqual((b.other, b.foo, b.__dict__), (1, 2, {'other': 1}))
+
+@case
+class BatchTest(unittest.TestCase):
+	def setUp(self):
+		@nmevent.with_events
+		@nmevent.with_properties
+		class A(object):
+			foo = nmevent.Property()
+			bar = nmevent.Property()
+		self.a = A()
+		self.b = A()
+		self.calls = []
+		def handler(sender, **keywords):
+			self.calls.append((sender, keywords))
+		self.handler = handler
+	
+	def test_coalescing(self):
+		self.a.property_changed += self.handler
+		self.a.foo_changed += self.handler
+		with nmevent.batch(self.a):
+			self.a.foo = 1
+			self.a.foo = 2
+			self.a.bar = 3
+			self.a.bar = None
+			self.assertEqual(self.calls, [])
+		self.assertEqual(len(self.calls), 2)
+		self.assertTrue(
+			(self.a, {'old_value': None, 'name': 'foo'}) in self.calls)
+		self.assertTrue((self.a, {'old_value': None}) in self.calls)
+		self.assertEqual(self.a.foo, 2)
+	
+	def test_version(self):
+		@nmevent.with_events
+		class TestClass(object):
+			@nmevent.nmproperty(compare = 'version')
+			def data(self):
+				return self._data
+
+			@data.setter
+			def data(self, value):
+				self._data.version += 1
+
+			def __init__(self):
+				self._data = Buffer()
+		instance = TestClass()
+		instance.data_changed += self.handler
+		with nmevent.batch(instance):
+			instance.data = instance.data
+		self.assertEqual(len(self.calls), 1)
+	
+	def test_multiple_senders(self):
+		self.a.property_changed += self.handler
+		self.b.property_changed += self.handler
+		with nmevent.batch(self.a, self.b):
+			self.a.foo = 1
+			self.b.foo = 1
+			self.a.foo = 2
+		self.assertEqual(self.calls, [
+			(self.a, {'old_value': None, 'name': 'foo'}),
+			(self.b, {'old_value': None, 'name': 'foo'}), ])
+	
+	def test_aggregate(self):
+		self.a.properties_changed += self.handler
+		self.a.property_changed += self.handler
+		with nmevent.batch(self.a, aggregate = True):
+			self.a.foo = 1
+			self.a.bar = 2
+			self.a.foo = 3
+		self.assertEqual(self.calls, [
+			(self.a, {'old_values': {'foo': None, 'bar': None}}), ])
+	
+	def test_aggregate_unobserved_properties(self):
+		self.a.properties_changed += self.handler
+		with nmevent.batch(self.a, aggregate = True):
+			self.a.foo = 1
+		self.assertEqual(self.calls, [(self.a, {'old_values': {'foo': None}}), ])
+	
+	def test_nested(self):
+		self.a.property_changed += self.handler
+		with nmevent.batch(self.a):
+			with nmevent.batch(self.a, self.b):
+				self.a.foo = 1
+			self.assertEqual(self.calls, [])
+			self.a.foo = 2
+		self.assertEqual(self.calls, [
+			(self.a, {'old_value': None, 'name': 'foo'}), ])
+		self.a.foo = 3
+		self.assertEqual(len(self.calls), 2)
+	
+	def test_other_thread(self):
+		self.a.property_changed += self.handler
+		with nmevent.batch(self.a):
+			thread = threading.Thread(target = setattr, args = (self.a, 'foo', 1))
+			thread.start()
+			thread.join()
+			self.assertEqual(len(self.calls), 1)
+
+@case
+class ThreadSafetyTest(unittest.TestCase):
+	def setUp(self):
+		self.interval = sys.getcheckinterval()
+		# Switch threads as often as possible to provoke races.
+		sys.setcheckinterval(1)
+		self.errors = []
+	
+	def tearDown(self):
+		sys.setcheckinterval(self.interval)
+	
+	def run_threads(self, count, target):
+		gate = threading.Event()
+		def run(*args):
+			gate.wait()
+			try:
+				target(*args)
+			except Exception, error:
+				self.errors.append(error)
+		threads = [threading.Thread(target = run, args = (i, ))
+			for i in range(count)]
+		for thread in threads:
+			thread.start()
+		gate.set()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(self.errors, [])
+	
+	def assertConsistent(self, handlers):
+		self.assertEqual(set(handlers.snapshot), handlers.callbacks)
+	
+	def test_concurrent_creation(self):
+		class Slotted(object):
+			__slots__ = ('__weakref__', )
+			event = nmevent.Event()
+		for clss in (create_class(['event', ]), Slotted):
+			for attempt in range(50):
+				subject = clss()
+				handlers = [lambda sender: None for i in range(8)]
+				def add(i):
+					subject.event += handlers[i]
+				self.run_threads(8, add)
+				self.assertEqual(len(subject.event), 8)
+				self.assertConsistent(subject.event.handlers)
+	
+	def test_stress(self):
+		subject = create_class(['event', ])()
+		weak_event = nmevent.Event(weak = True)
+		calls = []
+		def fire(i):
+			for j in range(300):
+				subject.event()
+				weak_event(subject)
+		def churn(i):
+			handler = lambda sender: calls.append(i)
+			observer = Observer()
+			for j in range(300):
+				subject.event += handler
+				weak_event.add_handler(observer.handler)
+				subject.event -= handler
+				weak_event.remove_handler(observer.handler)
+			subject.event += handler
+		def both(i):
+			if i % 2:
+				fire(i)
+			else:
+				churn(i)
+		self.run_threads(16, both)
+		self.assertEqual(len(subject.event), 8)
+		self.assertConsistent(subject.event.handlers)
+		self.assertConsistent(weak_event.handlers)
+		self.assertEqual(len(weak_event), 0)
+		del calls[:]
+		subject.event()
+		self.assertEqual(sorted(calls), range(0, 16, 2))
+
+@case
+class InstrumentationTest(unittest.TestCase):
+	def test_not_instrumented(self):
+		subject = create_class(['event', ])()
+		subject.event += function_observer_a
+		self.assertEqual(subject.event.stats, None)
+		self.assertEqual(subject.event.handlers.dispatch, None)
+	
+	def test_counts(self):
+		clss = create_class()
+		clss.event = nmevent.Event(name = 'InstrumentationTest.counts',
+			instrument = True)
+		a, b = clss(), clss()
+		observer = Observer()
+		a.event += observer.handler
+		b.event += observer.handler
+		b.event += function_observer_a
+		a.event()
+		b.event(1)
+		clss.event(a)
+		self.assertEqual(observer.event_count, 3)
+		stats = clss.event.stats
+		self.assertEqual((stats.fires, stats.calls, stats.errors), (3, 4, 0))
+		self.assertEqual(sorted(stats.latencies), [
+			'Observer.handler', __name__ + '.function_observer_a'])
+		self.assertEqual(stats.latencies['Observer.handler'].count, 3)
+		snapshot = nmevent.stats()['InstrumentationTest.counts']
+		self.assertEqual(snapshot['calls'], 4)
+		self.assertEqual(snapshot['handlers']['Observer.handler']['count'], 3)
+		stats.reset()
+		self.assertEqual((stats.fires, stats.calls, stats.latencies), (0, 0, {}))
+	
+	def test_errors(self):
+		event = nmevent.Event(instrument = True)
+		def fail(sender):
+			raise ValueError()
+		event += fail
+		self.assertRaises(ValueError, event, None)
+		self.assertEqual((event.stats.calls, event.stats.errors), (1, 1))
+	
+	def test_slow(self):
+		reports = []
+		stats = nmevent.EventStats(0.001,
+			lambda stats, handler, seconds: reports.append((handler, seconds)))
+		event = nmevent.Event(instrument = stats, weak = True)
+		slow = lambda sender: time.sleep(0.002)
+		event += slow
+		event += function_observer_a
+		event(None)
+		self.assertEqual(stats.slow, 1)
+		self.assertEqual(len(reports), 1)
+		self.assertTrue(reports[0][1] >= 0.002)
+		self.assertEqual(stats.latencies[__name__ + '.<lambda>'].count, 1)
+	
+	def test_with_events(self):
+		@nmevent.with_events(instrument = True)
+		@nmevent.with_properties
+		class InstrumentedModel(object):
+			x = nmevent.Property()
+			other = nmevent.Event()
+		self.assertEqual(InstrumentedModel.x_changed.name, 'InstrumentedModel.x_changed')
+		self.assertEqual(InstrumentedModel.other.name, 'InstrumentedModel.other')
+		model = InstrumentedModel()
+		model.property_changed += function_observer_a
+		model.x = 1
+		self.assertEqual(nmevent.stats()['InstrumentedModel.property_changed']['calls'], 1)
+		self.assertEqual(InstrumentedModel.other.stats, None)
+	
+	def test_merge_names(self):
+		events = [nmevent.Event(name = 'InstrumentationTest.same', instrument = True)
+			for i in range(2)]
+		for event in events:
+			event += function_observer_a
+			event(None)
+		self.assertEqual(nmevent.stats()['InstrumentationTest.same']['fires'], 2)
+	
+	def test_invalid(self):
+		stats = nmevent.EventStats()
+		nmevent.Event(instrument = stats)
+		self.assertRaises(ValueError, nmevent.Event, instrument = stats)
+		self.assertRaises(ValueError, nmevent.Event,
+			executor = object(), instrument = True)
+	
+	def test_histogram(self):
+		histogram = nmevent.LatencyHistogram()
+		self.assertEqual(histogram.percentile(0.5), 0.0)
+		for seconds in (0.0000005, 0.000003, 0.000003, 0.001, 100000):
+			histogram.add(seconds)
+		self.assertEqual(histogram.buckets[0], 1)
+		self.assertEqual(histogram.buckets[2], 2)
+		self.assertEqual(histogram.buckets[10], 1)
+		self.assertEqual(histogram.buckets[-1], 1)
+		self.assertEqual(histogram.percentile(0.5), 0.000004)
+		self.assertEqual(histogram.percentile(1), 100000)
+		other = nmevent.LatencyHistogram()
+		other.add(0.000003)
+		histogram.merge(other)
+		self.assertEqual((histogram.count, histogram.buckets[2]), (6, 3))
+
+@case
+class TracerTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'trace')
+		@nmevent.with_events
+		@nmevent.with_properties
+		class Cascade(object):
+			x = nmevent.Property()
+			y = nmevent.Property()
+		self.cascade = Cascade()
+		def copy(sender, **keywords):
+			sender.y = sender.x
+		def log(sender, **keywords):
+			pass
+		self.cascade.x_changed += copy
+		self.cascade.y_changed += log
+	
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	
+	def test_chrome(self):
+		fire = nmevent.Event.__dict__['fire']
+		with nmevent.trace(self.path):
+			self.assertNotEqual(nmevent.Event.__dict__['fire'], fire)
+			self.cascade.x = 1
+		self.assertEqual(nmevent.Event.__dict__['fire'], fire)
+		with open(self.path) as input:
+			trace = json.load(input)
+		spans = dict((span['name'], span) for span in trace['traceEvents'])
+		self.assertEqual(sorted(spans), [
+			'Cascade.property_changed', 'Cascade.x_changed', 'Cascade.y_changed',
+			__name__ + '.copy', __name__ + '.log', ])
+		outer, copy, inner = (spans['Cascade.x_changed'], spans[__name__ + '.copy'],
+			spans['Cascade.y_changed'])
+		self.assertEqual(outer['args'], {'sender': 'Cascade'})
+		self.assertEqual(copy['cat'], 'handler')
+		for parent, child in ((outer, copy), (copy, inner)):
+			self.assertTrue(parent['ts'] <= child['ts'])
+			self.assertTrue(child['ts'] + child['dur'] <= parent['ts'] + parent['dur'])
+		self.assertEqual(trace['otherData']['dropped'], 0)
+	
+	def test_collapsed(self):
+		event = nmevent.Event(name = 'plain')
+		event += function_observer_a
+		with nmevent.trace(self.path, 'collapsed'):
+			self.cascade.x = 1
+			event(None)
+			event(None)
+			self.cascade.__class__.x_changed(self.cascade)
+		with open(self.path) as input:
+			stacks = [line.rsplit(' ', 1)[0] for line in input]
+		self.assertTrue('Cascade.x_changed;%s.copy;Cascade.y_changed;%s.log'
+			% (__name__, __name__) in stacks)
+		self.assertTrue('plain;%s.function_observer_a' % (__name__, ) in stacks)
+		self.assertEqual(stacks.count('plain'), 1)
+	
+	def test_bounded(self):
+		with nmevent.trace(self.path, max_events = 2) as tracer:
+			self.cascade.x = 1
+		self.assertEqual(len(tracer.spans), 2)
+		self.assertEqual(tracer.dropped, 4)
+	
+	def test_single_tracer(self):
+		with nmevent.trace(self.path):
+			self.assertRaises(RuntimeError, nmevent.Tracer(self.path).start)
+		self.assertRaises(ValueError, nmevent.Tracer, self.path, 'some')
+
+@case
+class EventQueueTest(unittest.TestCase):
+	def setUp(self):
+		self.calls = []
+		self.subject = create_class(['event', 'other', ])()
+		self.subject.event += self.handler
+		self.subject.other += self.handler
+	
+	def handler(self, sender, **keywords):
+		self.calls.append(keywords)
+	
+	def post(self, queue, event, count):
+		return [queue(event, n = i) for i in range(count)]
+	
+	def test_post(self):
+		queue = nmevent.EventQueue()
+		self.assertTrue(queue(self.subject.event, n = 1))
+		self.assertEqual(self.calls, [])
+		self.assertEqual(queue.depth, 1)
+		self.assertEqual(queue.drain(), 1)
+		self.assertEqual(self.calls, [{'n': 1}])
+		self.assertEqual((queue.depth, queue.posted, queue.delivered), (0, 1, 1))
+	
+	def test_event_post(self):
+		queue = nmevent.EventQueue()
+		event = nmevent.Event(queue = queue)
+		event += self.handler
+		event.post(self.subject, n = 1)
+		clss = create_class()
+		clss.event = nmevent.Event(queue = queue)
+		subject = clss()
+		subject.event += self.handler
+		subject.event.post(n = 2)
+		clss.event.post(subject, n = 3)
+		self.assertEqual(queue.depth, 3)
+		queue.drain()
+		self.assertEqual(self.calls, [{'n': 1}, {'n': 2}, {'n': 3}])
+		# Events without handlers are not queued.
+		clss().event.post()
+		self.assertEqual(queue.depth, 0)
+	
+	def test_drop_newest(self):
+		queue = nmevent.EventQueue(2, 'drop_newest')
+		self.assertEqual(self.post(queue, self.subject.event, 3), [True, True, False])
+		queue.drain()
+		self.assertEqual(self.calls, [{'n': 0}, {'n': 1}])
+		self.assertEqual(queue.dropped, 1)
+	
+	def test_drop_oldest(self):
+		queue = nmevent.EventQueue(2, 'drop_oldest')
+		self.assertEqual(self.post(queue, self.subject.event, 3), [True, True, True])
+		queue.drain()
+		self.assertEqual(self.calls, [{'n': 1}, {'n': 2}])
+		self.assertEqual(queue.dropped, 1)
+	
+	def test_coalesce(self):
+		queue = nmevent.EventQueue(2, 'coalesce')
+		self.post(queue, self.subject.event, 3)
+		queue(self.subject.other, n = 'other')
+		self.assertEqual(queue.depth, 2)
+		self.assertEqual(queue.coalesced, 2)
+		queue.drain()
+		self.assertEqual(self.calls, [{'n': 2}, {'n': 'other'}])
+		self.post(queue, self.subject.event, 1)
+		self.assertEqual(queue.depth, 1)
+	
+	def test_coalesce_class_handlers(self):
+		queue = nmevent.EventQueue(overflow = 'coalesce')
+		clss = create_class(['event', ])
+		clss.event += self.handler
+		subject = clss()
+		self.post(queue, subject.event, 3)
+		queue(clss.event, subject, n = 3)
+		subject.event += lambda sender, **keywords: None
+		queue(subject.event, n = 4)
+		self.post(queue, clss().event, 1)
+		self.assertEqual(queue.depth, 2)
+		self.assertEqual(queue.coalesced, 4)
+		queue.drain()
+		self.assertEqual(self.calls, [{'n': 4}, {'n': 0}])
+	
+	def test_block(self):
+		queue = nmevent.EventQueue(1)
+		queue(self.subject.event, n = 0)
+		thread = threading.Thread(target = self.post,
+			args = (queue, self.subject.event, 1))
+		thread.start()
+		thread.join(0.05)
+		self.assertTrue(thread.is_alive())
+		self.assertEqual(queue.drain(1), 1)
+		thread.join(5)
+		self.assertFalse(thread.is_alive())
+		self.assertEqual(queue.depth, 1)
+	
+	def test_thread(self):
+		queue = nmevent.EventQueue(4)
+		threads = []
+		def handler(sender, **keywords):
+			threads.append(threading.current_thread())
+		self.subject.event += handler
+		queue.start()
+		thread = queue._thread
+		self.post(queue, self.subject.event, 10)
+		queue.stop(5)
+		self.assertFalse(thread.is_alive())
+		self.assertEqual(len(self.calls), 10)
+		self.assertEqual(set(threads), set([thread]))
+	
+	def test_errors(self):
+		errors = []
+		queue = nmevent.EventQueue(on_error = errors.append)
+		def fail(sender):
+			raise ValueError()
+		self.subject.event += fail
+		queue(self.subject.event)
+		queue.drain()
+		self.assertEqual(queue.errors, 1)
+		self.assertEqual(errors[0][0], ValueError)
+	
+	@unittest.skipIf(asyncio is None, "asyncio is not available")
+	def test_attach(self):
+		loop = asyncio.new_event_loop()
+		try:
+			queue = nmevent.EventQueue()
+			queue.attach(loop)
+			queue(self.subject.event, n = 1)
+			self.assertEqual(self.calls, [])
+			loop.run_until_complete(asyncio.sleep(0.01, loop = loop))
+			self.assertEqual(self.calls, [{'n': 1}])
+		finally:
+			loop.close()
+	
+	def test_unknown_policy(self):
+		self.assertRaises(ValueError, nmevent.EventQueue, 1, 'some')
+	
+	def test_default_queue(self):
+		self.assertTrue(nmevent.default_queue() is nmevent.default_queue())
+		done = threading.Event()
+		self.subject.event += lambda sender: done.set()
+		self.subject.event.post()
+		self.assertTrue(done.wait(5))
+
+def bridge_child(connection, results):
+	subscriber = nmevent.Subscriber(connection)
+	received = []
+	tick = subscriber.event('tick')
+	tick += lambda sender, **keywords: received.append((sender, keywords))
+	while len(received) < 3 and subscriber.receive(5):
+		pass
+	results.send(received)
+
+@case
+class BridgeTest(unittest.TestCase):
+	def setUp(self):
+		self.ours, self.theirs = multiprocessing.Pipe()
+		self.subscriber = nmevent.Subscriber(self.theirs)
+		self.received = []
+		tick = self.subscriber.event('tick')
+		tick += self.handler
+		self.subject = create_class(['tick', 'tock', ])()
+	
+	def handler(self, sender, *args, **keywords):
+		self.received.append((sender, args, keywords))
+	
+	def test_batch_size(self):
+		publisher = nmevent.Publisher([self.ours], 2, None)
+		publisher.mirror(self.subject.tick, 'tick')
+		self.subject.tick(1)
+		self.assertEqual(self.subscriber.receive(0.01), 0)
+		self.subject.tick(2, spam = 3)
+		self.assertEqual(self.subscriber.receive(1), 2)
+		self.assertEqual(self.received, [(None, (1, ), {}), (None, (2, ), {'spam': 3})])
+	
+	def test_sender_and_names(self):
+		publisher = nmevent.Publisher([self.ours], 10, None)
+		publisher.mirror(self.subject.tick, 'tick', sender = lambda sender: 'subject')
+		publisher.mirror(self.subject.tock, 'tock')
+		self.subject.tock()
+		self.subject.tick()
+		publisher.flush()
+		self.assertEqual(self.subscriber.receive(1), 2)
+		self.assertEqual(self.received, [('subject', (), {})])
+	
+	def test_flush_interval(self):
+		publisher = nmevent.Publisher([self.ours], 10, 0.01)
+		publisher.mirror(self.subject.tick, 'tick')
+		self.subject.tick()
+		self.subject.tick()
+		self.assertEqual(self.subscriber.receive(5), 2)
+		publisher.close()
+		self.assertFalse(self.subscriber.receive(0.01))
+	
+	def test_thread(self):
+		publisher = nmevent.Publisher([self.ours], 1, None)
+		publisher.mirror(self.subject.tick, 'tick')
+		done = threading.Event()
+		tick = self.subscriber['tick']
+		tick += lambda sender: done.set()
+		self.subscriber.start(0.01)
+		self.subject.tick()
+		self.assertTrue(done.wait(5))
+		self.subscriber.stop()
+	
+	def test_broken_connection(self):
+		publisher = nmevent.Publisher([self.ours], 1, None)
+		publisher.mirror(self.subject.tick, 'tick')
+		self.theirs.close()
+		self.subject.tick()
+		self.assertEqual(publisher.connections, [])
+	
+	def test_other_process(self):
+		results, child_results = multiprocessing.Pipe()
+		process = multiprocessing.Process(target = bridge_child,
+			args = (self.theirs, child_results))
+		process.start()
+		publisher = nmevent.Publisher([self.ours], 2)
+		publisher.mirror(self.subject.tick, 'tick', sender = lambda sender: 1)
+		for i in range(3):
+			self.subject.tick(n = i)
+		publisher.close()
+		self.assertTrue(results.poll(10))
+		self.assertEqual(results.recv(), [(1, {'n': i}) for i in range(3)])
+		process.join(5)
+
+@case
+class SocketTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.server = nmevent.SocketServer(
+			os.path.join(self.directory, 'events.sock'), backlog = 2)
+		self.publisher = nmevent.Publisher([self.server], 1, None)
+		self.subject = create_class(['tick', ])()
+		self.publisher.mirror(self.subject.tick, 'tick')
+		self.client = nmevent.SocketClient(self.server.address, 0.01)
+		self.subscriber = nmevent.Subscriber(self.client)
+		self.received = []
+		tick = self.subscriber.event('tick')
+		tick += lambda sender, **keywords: self.received.append(keywords['n'])
+	
+	def tearDown(self):
+		self.subscriber.stop()
+		self.client.close()
+		self.server.close()
+		shutil.rmtree(self.directory)
+	
+	def receive(self, count):
+		while len(self.received) < count and self.subscriber.receive(5):
+			pass
+		return self.received
+	
+	def test_framing(self):
+		self.assertTrue(self.client.connect())
+		for i in range(3):
+			self.subject.tick(n = i)
+		self.assertEqual(self.receive(3), [0, 1, 2])
+		self.assertEqual(self.client.last_sequence, 3)
+		self.assertFalse(self.client.poll(0.01))
+	
+	def test_replay(self):
+		self.assertTrue(self.client.connect())
+		self.subject.tick(n = 0)
+		self.assertEqual(self.receive(1), [0])
+		# Drop the connection on the server side.
+		self.server.clients[0].close()
+		del self.server.clients[:]
+		for i in range(1, 4):
+			self.subject.tick(n = i)
+		# Only the last two frames are kept.
+		self.assertEqual(self.receive(3), [0, 2, 3])
+		self.subject.tick(n = 4)
+		self.assertEqual(self.receive(4), [0, 2, 3, 4])
+	
+	def test_other_server(self):
+		self.assertTrue(self.client.connect())
+		self.subject.tick(n = 0)
+		self.assertEqual(self.receive(1), [0])
+		self.server.close()
+		self.server = nmevent.SocketServer(self.server.address)
+		self.publisher.connections = [self.server]
+		self.assertFalse(self.client.poll(0.05))
+		self.subject.tick(n = 1)
+		self.assertEqual(self.receive(2), [0, 1])
+	
+	def test_remote_event(self):
+		done = threading.Event()
+		handler = lambda sender, **keywords: done.set()
+		tick = nmevent.RemoteEvent(self.subscriber, 'tick')
+		tick += handler
+		self.assertTrue(handler in tick)
+		self.assertEqual(len(tick), 2)
+		while not self.server.clients:
+			time.sleep(0.01)
+		self.subject.tick(n = 0)
+		self.assertTrue(done.wait(5))
+		tick -= handler
+		self.assertFalse(handler in tick)
+	
+	def test_large_frame(self):
+		self.assertTrue(self.client.connect())
+		data = 'x' * (4 << 20)
+		server = self.server
+		server.max_pending = 8 << 20
+		start = time.time()
+		server.send_bytes(data)
+		self.assertTrue(time.time() - start < 2)
+		# The rest of the frame is sent by the server's thread.
+		self.assertEqual(self.client.recv_bytes(), data)
+	
+	def test_slow_client(self):
+		server = nmevent.SocketServer(
+			os.path.join(self.directory, 'slow.sock'), max_pending = 1 << 16)
+		try:
+			# A client that completes the handshake but never reads.
+			slow = nmevent.SocketClient(server.address)
+			self.assertTrue(slow.connect())
+			self.assertEqual(len(server.clients), 1)
+			start = time.time()
+			for i in range(200):
+				server.send_bytes('x' * 4096)
+			self.assertTrue(time.time() - start < 2)
+			self.assertEqual(server.clients, [])
+			slow.close()
+		finally:
+			server.close()
+	
+	def test_silent_peer(self):
+		self.server.handshake_timeout = 0.5
+		# A peer that connects but never sends the handshake.
+		silent = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		silent.connect(self.server.address)
+		try:
+			start = time.time()
+			self.assertTrue(self.client.connect())
+			self.subject.tick(n = 0)
+			self.assertEqual(self.receive(1), [0])
+			self.assertTrue(time.time() - start < 0.4)
+			silent.settimeout(5)
+			self.assertEqual(silent.recv(1), '')
+		finally:
+			silent.close()
+	
+	def test_closed(self):
+		self.client.close()
+		self.assertRaises(EOFError, self.client.connect)
+
+@case
+class RoutingTest(unittest.TestCase):
+	def setUp(self):
+		@nmevent.with_events
+		@nmevent.with_properties
+		class A(object):
+			foo = nmevent.Property()
+			bar = nmevent.Property()
+		self.subject = A()
+		self.calls = []
+	
+	def handler(self, sender, **keywords):
+		self.calls.append(keywords['name'])
+	
+	def test_filtered(self):
+		self.subject.property_changed.subscribe(self.handler, name = 'foo')
+		self.subject.bar = 1
+		self.assertEqual(self.calls, [])
+		self.subject.foo = 1
+		self.assertEqual(self.calls, ['foo'])
+		self.assertTrue(self.handler in self.subject.property_changed)
+		self.assertEqual(len(self.subject.property_changed), 1)
+	
+	def test_unfiltered(self):
+		unfiltered = []
+		self.subject.property_changed += \
+			lambda sender, **keywords: unfiltered.append(keywords['name'])
+		self.subject.property_changed.subscribe(self.handler, name = 'bar')
+		self.subject.foo = 1
+		self.subject.bar = 1
+		self.assertEqual(unfiltered, ['foo', 'bar'])
+		self.assertEqual(self.calls, ['bar'])
+	
+	def test_unsubscribe(self):
+		event = self.subject.property_changed
+		event.subscribe(self.handler, name = 'foo')
+		event.subscribe(self.handler, name = 'bar')
+		self.assertRaises(KeyError, event.unsubscribe, self.handler, name = 'x')
+		event.unsubscribe(self.handler, name = 'foo')
+		self.subject.foo = 1
+		self.subject.bar = 1
+		self.assertEqual(self.calls, ['bar'])
+		event.unsubscribe(self.handler, name = 'bar')
+		self.assertEqual(len(event), 0)
+		self.assertEqual(event.handlers.routes, None)
+		self.assertFalse(event.is_observed(self.subject))
+	
+	def test_is_observed(self):
+		event = self.subject.property_changed
+		self.assertFalse(event.is_observed(self.subject))
+		event.subscribe(self.handler, name = 'foo')
+		self.assertTrue(event.is_observed(self.subject))
+	
+	def test_multiple_keys(self):
+		event = nmevent.Event()
+		observer = Observer()
+		event.subscribe(observer.handler, name = 'foo', old_value = 1)
+		event(None, name = 'foo', old_value = 2)
+		event(None, name = 'foo')
+		event(None, old_value = 1)
+		self.assertEqual(observer.event_count, 0)
+		event(None, name = 'foo', old_value = 1, other = 3)
+		self.assertEqual(observer.event_count, 1)
+	
+	def test_unhashable(self):
+		unfiltered = []
+		event = self.subject.property_changed
+		event += lambda sender, **keywords: unfiltered.append(keywords['name'])
+		event.subscribe(self.handler, old_value = None)
+		event.subscribe(self.handler, name = 'foo', old_value = None)
+		self.subject.foo = [1]
+		self.subject.foo = [2]
+		self.assertEqual(unfiltered, ['foo', 'foo'])
+		self.assertEqual(self.calls, ['foo', 'foo'])
+	
+	def test_unbound(self):
+		clss = self.subject.__class__
+		clss.property_changed.subscribe(self.handler, name = 'foo')
+		event = clss.__dict__['property_changed']
+		event.fire(self.subject, name = 'foo')
+		event.fire(self.subject, name = 'bar')
+		self.assertEqual(self.calls, ['foo'])
+		clss.property_changed.unsubscribe(self.handler, name = 'foo')
+		self.assertEqual(len(clss.property_changed), 0)
+	
+	def test_weak(self):
+		event = nmevent.Event(weak = True)
+		observer = Observer()
+		event.subscribe(observer.handler, name = 'foo')
+		event.subscribe(observer.handler, name = 'bar')
+		event(None, name = 'foo')
+		self.assertEqual(observer.event_count, 1)
+		self.assertEqual(len(event), 2)
+		del observer
+		self.assertEqual(len(event), 0)
+		self.assertEqual(event.handlers.routes, None)
+
+@case
+class RateLimitTest(unittest.TestCase):
+	def setUp(self):
+		self.subject = create_class(['event', ])()
+		self.calls = []
+	
+	def handler(self, sender, *args, **keywords):
+		self.calls.append(args)
+	
+	def wait_for(self, condition, timeout = 5):
+		deadline = time.time() + timeout
+		while not condition() and time.time() < deadline:
+			time.sleep(0.005)
+		self.assertTrue(condition())
+	
+	def test_lazy_subscription(self):
+		derived = self.subject.event.throttled(0.01)
+		self.assertEqual(len(self.subject.event), 0)
+		derived += self.handler
+		self.assertTrue(derived.attached)
+		self.assertEqual(len(self.subject.event), 1)
+		derived -= self.handler
+		self.assertFalse(derived.attached)
+		self.assertEqual(len(self.subject.event), 0)
+	
+	def test_throttled(self):
+		derived = self.subject.event.throttled(0.05)
+		derived += self.handler
+		for i in range(10):
+			self.subject.event(i)
+		self.assertEqual(self.calls, [(0, )])
+		self.wait_for(lambda: len(self.calls) == 2)
+		self.assertEqual(self.calls[1], (9, ))
+		time.sleep(0.1)
+		self.assertEqual(len(self.calls), 2)
+	
+	def test_debounced(self):
+		derived = self.subject.event.debounced(0.05)
+		derived += self.handler
+		for i in range(5):
+			self.subject.event(i)
+			time.sleep(0.005)
+		self.assertEqual(self.calls, [])
+		self.wait_for(lambda: len(self.calls) == 1)
+		self.assertEqual(self.calls, [(4, )])
+	
+	def test_sampled(self):
+		derived = self.subject.event.sampled(0.02)
+		derived += self.handler
+		self.subject.event(1)
+		self.subject.event(2)
+		self.assertEqual(self.calls, [])
+		self.wait_for(lambda: len(self.calls) == 1)
+		self.assertEqual(self.calls, [(2, )])
+	
+	def test_coalesced(self):
+		@nmevent.with_events
+		@nmevent.with_properties
+		class A(object):
+			foo = nmevent.Property()
+			bar = nmevent.Property()
+		a = A()
+		derived = a.property_changed.coalesced('name', 10)
+		changes = []
+		derived += lambda sender, **keywords: \
+			changes.append((keywords['name'], getattr(sender, keywords['name'])))
+		a.foo = 1
+		a.bar = 1
+		a.foo = 2
+		self.assertEqual(changes, [])
+		derived.flush()
+		self.assertEqual(changes, [('foo', 2), ('bar', 1)])
+	
+	def test_chained(self):
+		derived = self.subject.event.coalesced(interval = 10).throttled(10)
+		derived += self.handler
+		self.subject.event(1)
+		self.subject.event(2)
+		self.assertEqual(self.calls, [])
+		derived.sources[0].flush()
+		self.assertEqual(self.calls, [(2, )])
+		derived -= self.handler
+		self.assertEqual(len(self.subject.event), 0)
+	
+	@unittest.skipIf(asyncio is None, "asyncio is not available")
+	def test_loop(self):
+		loop = asyncio.new_event_loop()
+		try:
+			derived = self.subject.event.debounced(0.01, loop = loop)
+			done = asyncio.Future(loop = loop)
+			derived += lambda sender, value: done.set_result(value)
+			self.subject.event(1)
+			self.subject.event(2)
+			self.assertEqual(loop.run_until_complete(done), 2)
+		finally:
+			loop.close()
+	
+	def test_detach_discards(self):
+		derived = self.subject.event.sampled(10)
+		derived += self.handler
+		self.subject.event(1)
+		derived -= self.handler
+		derived += self.handler
+		derived.flush()
+		self.assertEqual(self.calls, [])
+
+@case
+class CombinatorTest(unittest.TestCase):
+	def setUp(self):
+		self.subject = create_class(['event', 'other', ])()
+		self.calls = []
+	
+	def handler(self, sender, *args, **keywords):
+		self.calls.append(args)
+	
+	def test_filter(self):
+		derived = self.subject.event.filter(lambda sender, value: value % 2)
+		derived += self.handler
+		for i in range(5):
+			self.subject.event(i)
+		self.assertEqual(self.calls, [(1, ), (3, )])
+	
+	def test_map(self):
+		derived = self.subject.event.map(
+			lambda sender, value, **keywords: value + keywords['offset'])
+		derived += self.handler
+		self.subject.event(1, offset = 10)
+		self.assertEqual(self.calls, [(11, )])
+	
+	def test_merge(self):
+		merged = nmevent.merge(self.subject.event, self.subject.other)
+		merged += self.handler
+		self.subject.event(1)
+		self.subject.other(2)
+		self.assertEqual(self.calls, [(1, ), (2, )])
+		merged -= self.handler
+		self.assertEqual(len(self.subject.event), 0)
+		self.assertEqual(len(self.subject.other), 0)
+	
+	def test_chained(self):
+		derived = self.subject.event \
+			.map(lambda sender, value: value * 2) \
+			.filter(lambda sender, value: value > 4)
+		self.assertEqual(len(self.subject.event), 0)
+		derived += self.handler
+		self.assertEqual(len(self.subject.event), 1)
+		for i in range(4):
+			self.subject.event(i)
+		self.assertEqual(self.calls, [(6, )])
+		derived -= self.handler
+		self.assertFalse(derived.sources[0].attached)
+		self.assertEqual(len(self.subject.event), 0)
+	
+	def test_reference_counting(self):
+		derived = self.subject.event.filter(lambda sender: True)
+		handlers = [lambda sender: None for i in range(3)]
+		for handler in handlers:
+			derived += handler
+		self.assertEqual(len(self.subject.event), 1)
+		for handler in handlers[:-1]:
+			derived -= handler
+		self.assertTrue(derived.attached)
+		derived -= handlers[-1]
+		self.assertFalse(derived.attached)
+		self.assertEqual(len(self.subject.event), 0)
+	
+	def test_subscribe(self):
+		derived = self.subject.event.map(lambda sender, **keywords: keywords)
+		derived.subscribe(self.handler)
+		self.assertTrue(derived.attached)
+		derived.unsubscribe(self.handler)
+		self.assertFalse(derived.attached)
+
+@case
+class StreamTest(unittest.TestCase):
+	def setUp(self):
+		self.subject = create_class(['event', ])()
+	
+	def test_subscription(self):
+		with self.subject.event.stream() as stream:
+			self.assertEqual(len(self.subject.event), 1)
+			self.subject.event(1, key = 'a')
+		self.assertEqual(len(self.subject.event), 0)
+		self.assertTrue(stream.closed)
+		self.assertEqual(list(stream), [(self.subject, (1, ), {'key': 'a'})])
+	
+	def test_drop_oldest(self):
+		with self.subject.event.stream(maxlen = 3) as stream:
+			for i in range(5):
+				self.subject.event(i)
+			self.assertEqual([args for sender, args, keywords in stream.drain()],
+				[(2, ), (3, ), (4, )])
+		self.assertEqual(stream.dropped, 2)
+	
+	def test_drop_newest(self):
+		with self.subject.event.stream(3, 'drop_newest') as stream:
+			for i in range(5):
+				self.subject.event(i)
+			self.assertEqual(len(stream.drain(2)), 2)
+			self.assertEqual(stream.drain(), [(self.subject, (2, ), {})])
+		self.assertEqual(stream.dropped, 2)
+	
+	def test_unknown_policy(self):
+		self.assertRaises(ValueError, self.subject.event.stream, 1, 'coalesce')
+	
+	def test_block(self):
+		received = []
+		with self.subject.event.stream(2, 'block') as stream:
+			def consume():
+				for sender, args, keywords in stream:
+					received.append(args[0])
+					time.sleep(0.001)
+			thread = threading.Thread(target = consume)
+			thread.start()
+			for i in range(20):
+				self.subject.event(i)
+		thread.join(5)
+		self.assertFalse(thread.is_alive())
+		self.assertEqual(received, range(20))
+		self.assertEqual(stream.dropped, 0)
+	
+	def test_derived(self):
+		event = self.subject.event.filter(lambda sender, value: value > 1)
+		with event.stream() as stream:
+			for i in range(4):
+				self.subject.event(i)
+		self.assertEqual(len(stream), 2)
+		self.assertFalse(event.attached)
+	
+	@unittest.skipIf(asyncio is None, "asyncio is not available")
+	def test_async(self):
+		loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+		stream = self.subject.event.stream().open()
+		def fire():
+			for i in range(3):
+				self.subject.event(i)
+			stream.close()
+		def consume():
+			received = []
+			while True:
+				try:
+					sender, args, keywords = \
+						loop.run_until_complete(stream.__anext__())
+				except nmevent._StopAsyncIteration:
+					return received
+				received.append(args[0])
+		try:
+			loop.call_later(0.01, threading.Thread(target = fire).start)
+			self.assertEqual(consume(), [0, 1, 2])
+		finally:
+			asyncio.set_event_loop(None)
+			loop.close()
+
+@case
+class FireManyTest(unittest.TestCase):
+	def setUp(self):
+		self.clss = create_class(['event', ])
+		self.batches = []
+		self.calls = []
+	
+	def batch(self, fires):
+		self.batches.append(fires)
+	batch = nmevent.batch_handler(batch)
+	
+	def handler(self, sender, *args, **keywords):
+		self.calls.append((sender, args, keywords))
+	
+	def test_fire_many(self):
+		event = nmevent.Event()
+		event += self.batch
+		event += self.handler
+		event.fire_many([('a', (1, )), ('b', (2, ), {'key': 3})])
+		self.assertEqual(self.batches, [
+			[('a', (1, ), {}), ('b', (2, ), {'key': 3})]])
+		self.assertEqual(self.calls, [('a', (1, ), {}), ('b', (2, ), {'key': 3})])
+		self.assertEqual(len(event.handlers.batches), 1)
+		self.assertEqual(len(event.handlers.singles), 1)
+	
+	def test_single_fire(self):
+		event = nmevent.Event()
+		event += self.batch
+		event('a', 1, key = 2)
+		self.assertEqual(self.batches, [[('a', (1, ), {'key': 2})]])
+		event -= self.batch
+		self.assertEqual(event.handlers.snapshot, ())
+		self.assertEqual(event.handlers.batches, ())
+	
+	def test_bound_many(self):
+		a, b = self.clss(), self.clss()
+		a.event += self.batch
+		b.event += self.handler
+		self.clss.event.fire_many([(a, (1, )), (b, (2, )), (a, (3, ))])
+		self.assertEqual(self.batches, [[(a, (1, ), {}), (a, (3, ), {})]])
+		self.assertEqual(self.calls, [(b, (2, ), {})])
+		self.assertRaises(TypeError, self.clss.event.fire_many, [(object(), ())])
+	
+	def test_weak(self):
+		event = nmevent.Event(weak = True)
+		observer = create_class()()
+		observer.batch = nmevent.batch_handler(lambda fires: self.batches.append(fires))
+		event += observer.batch
+		event.fire_many([(None, ()), (None, ())])
+		self.assertEqual(len(self.batches), 1)
+	
+	def test_filtered(self):
+		event = nmevent.Event()
+		event.subscribe(self.batch, key = 1)
+		event.fire_many([(None, (), {'key': 1}), (None, (), {'key': 2})])
+		self.assertEqual(self.batches, [[(None, (), {'key': 1})]])
+
+@case
+class ClassHandlersTest(unittest.TestCase):
+	def setUp(self):
+		class Base(object):
+			event = nmevent.Event()
+		class Derived(Base):
+			pass
+		self.base, self.derived = Base, Derived
+		self.calls = []
+	
+	def handler(self, sender, *args, **keywords):
+		self.calls.append(('class', type(sender).__name__))
+	
+	def instance_handler(self, sender, *args, **keywords):
+		self.calls.append(('instance', type(sender).__name__))
+	
+	def test_all_instances(self):
+		self.base.event += self.handler
+		self.assertTrue(isinstance(self.base.__dict__['event'], nmevent.Event))
+		self.assertTrue(self.handler in self.base.event)
+		base, derived = self.base(), self.derived()
+		base.event()
+		derived.event()
+		self.base.event.fire_bound(derived)
+		self.base.event(derived)
+		self.assertEqual(self.calls, [('class', 'Base')] + [('class', 'Derived')] * 3)
+		self.assertFalse(nmevent.EVENTS_ATTRIBUTE in derived.__dict__)
+		self.base.event -= self.handler
+		derived.event()
+		self.assertEqual(len(self.calls), 4)
+	
+	def test_subclass(self):
+		self.derived.event += self.handler
+		self.base().event()
+		self.derived().event()
+		self.assertEqual(self.calls, [('class', 'Derived')])
+		self.assertEqual(len(self.base.event), 0)
+		self.assertEqual(len(self.derived.event), 1)
+		self.assertRaises(TypeError, self.derived.event, self.base())
+	
+	def test_with_instance_handlers(self):
+		self.base.event += self.handler
+		derived = self.derived()
+		derived.event += self.instance_handler
+		derived.event()
+		self.assertEqual(sorted(self.calls),
+			[('class', 'Derived'), ('instance', 'Derived')])
+		derived.event -= self.instance_handler
+		del self.calls[:]
+		derived.event()
+		self.assertEqual(self.calls, [('class', 'Derived')])
+	
+	def test_is_observed(self):
+		base = self.base()
+		event = self.base.__dict__['event']
+		self.assertFalse(event.is_observed(base))
+		self.derived.event += self.handler
+		self.assertFalse(event.is_observed(base))
+		self.assertTrue(event.is_observed(self.derived()))
+		self.assertTrue(self.derived().event.is_observed(None))
+	
+	def test_chain_cache(self):
+		event = self.base.__dict__['event']
+		self.assertEqual(event.class_chain(self.derived), None)
+		self.base.event += self.handler
+		chain = event.class_chain(self.derived)
+		self.assertTrue(event.class_chain(self.derived) is chain)
+		self.derived.event += self.instance_handler
+		self.assertFalse(event.class_chain(self.derived) is chain)
+		self.assertEqual(len(event.class_chain(self.derived)), 2)
+		self.assertEqual(len(event.class_chain(self.base)), 1)
+	
+	def test_event_fire(self):
+		self.base.event += self.handler
+		self.base.__dict__['event'].fire(self.derived())
+		self.assertEqual(self.calls, [('class', 'Derived')])
+	
+	def test_weak(self):
+		class Weak(object):
+			event = nmevent.Event(weak = True)
+		observer = Observer()
+		Weak.event += observer.handler
+		Weak().event()
+		self.assertEqual(observer.event_count, 1)
+		del observer
+		self.assertEqual(len(Weak.event), 0)
+		self.assertEqual(Weak.__dict__['event'].class_chain(Weak), None)
+	
+	def test_fire_many(self):
+		batches = []
+		self.base.event += nmevent.batch_handler(lambda fires: batches.append(fires))
+		a, b = self.derived(), self.derived()
+		a.event += self.instance_handler
+		self.base.event.fire_many([(a, ()), (b, ()), (self.base(), ())])
+		self.assertEqual([len(batch) for batch in batches], [2, 1])
+		self.assertEqual(self.calls, [('instance', 'Derived')])
+	
+	def test_cached(self):
+		class Cached(object):
+			event = nmevent.Event(cached = True)
+		Cached.event += self.handler
+		subject = Cached()
+		subject.event += self.instance_handler
+		subject.event()
+		self.assertEqual(sorted(self.calls),
+			[('class', 'Cached'), ('instance', 'Cached')])
+	
+	def test_class_and_instance(self):
+		self.base.event += self.handler
+		derived = self.derived()
+		derived.event += self.handler
+		derived.event()
+		self.assertEqual(self.calls, [('class', 'Derived')] * 2)
+	
+	def test_added_during_fire(self):
+		late = []
+		def add_late(sender):
+			sender.event += lambda sender: late.append(sender)
+		self.base.event += self.handler
+		derived = self.derived()
+		derived.event += add_late
+		derived.event()
+		self.assertEqual(late, [])
+		derived.event -= add_late
+		derived.event()
+		self.assertEqual(late, [derived])
+	
+	def test_added_while_joining(self):
+		late = []
+		self.base.event += self.handler
+		derived = self.derived()
+		derived.event += self.instance_handler
+		adder = threading.Thread(target = lambda:
+			derived.event.handlers.add(lambda sender: late.append(sender)))
+		join_stores = nmevent._join_stores
+		def slow_join(stores):
+			if not late and adder.ident is None:
+				adder.start()
+			time.sleep(0.05)
+			return join_stores(stores)
+		nmevent._join_stores = slow_join
+		try:
+			derived.event()
+		finally:
+			nmevent._join_stores = join_stores
+		adder.join()
+		derived.event()
+		derived.event()
+		self.assertEqual(late, [derived] * 2)
+		self.assertEqual(len(derived.event), 2)
+
+@case
+class ModuleTest(unittest.TestCase):
+	def test_all(self):
+		namespace = {}
+		exec "from nmevent import *" in namespace
+		for name in nmevent.__all__:
+			self.assertTrue(namespace[name] is getattr(nmevent, name))
+		for name in ('merge', 'stats', 'trace', 'batch_handler', 'default_queue',
+				'EventQueue', 'Publisher', 'Subscriber', 'SocketServer',
+				'SocketClient', 'RemoteEvent', 'EventStats', 'ChangeDetector', ):
+			self.assertTrue(name in namespace, name)
+
+@case
+@unittest.skipIf(asyncio is None, "asyncio is not available")
+class AsyncDispatchTest(unittest.TestCase):
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		self.log = []
+		self.subject = create_class(['event', ])()
+	
+	def tearDown(self):
+		self.loop.close()
+	
+	def delayed(self, name, delay = 0.01, error = None):
+		def handler(sender, **keywords):
+			self.log.append(name)
+			future = asyncio.Future(loop = self.loop)
+			if error is None:
+				self.loop.call_later(delay, future.set_result, name)
+			else:
+				self.loop.call_later(delay, future.set_exception, error)
+			return future
+		return handler
+	
+	def sync(self, sender, **keywords):
+		self.log.append(('sync', keywords))
+	
+	def run_loop(self, future):
+		return self.loop.run_until_complete(future)
+	
+	def test_all(self):
+		self.subject.event += self.delayed('a', 0.02)
+		self.subject.event += self.delayed('b', 0.01)
+		self.subject.event += self.sync
+		future = nmevent.AsyncDispatch(loop = self.loop)(
+			self.subject.event, spam = 1)
+		self.assertEqual(len(self.log), 3)
+		self.assertTrue(('sync', {'spam': 1}) in self.log)
+		self.assertEqual(sorted(self.run_loop(future)), ['a', 'b'])
+	
+	def test_no_handlers(self):
+		dispatch = nmevent.AsyncDispatch(loop = self.loop)
+		self.assertEqual(self.run_loop(dispatch(self.subject.event)), [])
+	
+	def test_fire_async(self):
+		asyncio.set_event_loop(self.loop)
+		try:
+			self.subject.event += self.delayed('a')
+			self.assertEqual(self.run_loop(self.subject.event.fire_async()), ['a'])
+			event = self.subject.__class__.event
+			self.assertEqual(self.run_loop(event.fire_async(self.subject)), ['a'])
+			self.assertRaises(TypeError, event.fire_async, object())
+		finally:
+			asyncio.set_event_loop(None)
+	
+	def test_first_exception(self):
+		slow = asyncio.Future(loop = self.loop)
+		self.subject.event += lambda sender: slow
+		self.subject.event += self.delayed('a', error = ValueError())
+		dispatch = nmevent.AsyncDispatch('first_exception', loop = self.loop)
+		self.assertRaises(ValueError, self.run_loop, dispatch(self.subject.event))
+		self.assertTrue(slow.cancelled())
+	
+	def test_detach(self):
+		self.subject.event += self.delayed('a')
+		errors = []
+		self.loop.set_exception_handler(
+			lambda loop, context: errors.append(context['exception']))
+		self.subject.event += self.delayed('b', error = ValueError())
+		dispatch = nmevent.AsyncDispatch('detach', loop = self.loop)
+		future = dispatch(self.subject.event)
+		self.assertTrue(future.done())
+		self.assertEqual(dispatch.in_flight, 2)
+		self.run_loop(asyncio.sleep(0.05, loop = self.loop))
+		self.assertEqual(dispatch.in_flight, 0)
+		self.assertEqual(len(errors), 1)
+	
+	def test_limit(self):
+		waiting = []
+		def handler(sender):
+			# Not a future yet, so that the limit can hold it back.
+			future = asyncio.Future(loop = self.loop)
+			waiting.append(future)
+			return asyncio.wait_for(future, None, loop = self.loop)
+		for i in range(3):
+			self.subject.event += lambda sender, handler = handler: handler(sender)
+		dispatch = nmevent.AsyncDispatch(limit = 1, loop = self.loop)
+		future = dispatch(self.subject.event)
+		self.assertEqual(dispatch.in_flight, 1)
+		self.assertEqual(len(dispatch._waiting), 2)
+		for i, waiter in enumerate(waiting):
+			waiter.set_result(i)
+		self.assertEqual(sorted(self.run_loop(future)), [0, 1, 2])
+		self.assertEqual(dispatch.in_flight, 0)
+	
+	def test_unknown_mode(self):
+		self.assertRaises(ValueError, nmevent.AsyncDispatch, 'some')
+
+@case
+@unittest.skipIf(futures is None, "concurrent.futures is not available")
+class ExecutorDispatchTest(unittest.TestCase):
+	def setUp(self):
+		self.executor = futures.ThreadPoolExecutor(4)
+		self.subject = create_class(['event', ])()
+		self.other = create_class(['event', ])()
+		self.log = []
+	
+	def tearDown(self):
+		self.executor.shutdown()
+	
+	def blocking(self, name, gate):
+		def handler(sender, **keywords):
+			gate.wait(5)
+			self.log.append(name)
+			return name
+		return handler
+	
+	def test_fire_in(self):
+		gate = threading.Event()
+		self.subject.event += self.blocking('a', gate)
+		self.subject.event += self.blocking('b', gate)
+		result = self.subject.event.fire_in(self.executor)
+		self.assertEqual(len(result), 2)
+		self.assertEqual(self.log, [])
+		gate.set()
+		self.assertEqual(sorted(f.result(5) for f in result), ['a', 'b'])
+	
+	def test_unbound_fire_in(self):
+		self.subject.event += lambda sender, **keywords: keywords
+		event = self.subject.__class__.event
+		result = event.fire_in(self.executor, self.subject, spam = 1)
+		self.assertEqual([f.result(5) for f in result], [{'spam': 1}])
+		other = self.subject.__class__()
+		self.assertEqual(event.fire_in(self.executor, other), [])
+		self.assertRaises(TypeError, event.fire_in, self.executor, self.other)
+	
+	def test_event_executor(self):
+		class Subject(object):
+			event = nmevent.Event(executor = self.executor)
+		subject = Subject()
+		self.assertEqual(subject.event(), [])
+		subject.event += lambda sender: 1
+		self.assertEqual([f.result(5) for f in subject.event()], [1])
+		self.assertEqual([f.result(5) for f in Subject.event(subject)], [1])
+		self.assertEqual(nmevent.Event()(subject), None)
+		self.assertEqual(Subject.event.fire_bound(Subject()), [])
+		self.assertEqual(nmevent.Event(executor = self.executor)(subject), [])
+		combined = nmevent.Event(executor = nmevent.ExecutorDispatch(
+			self.executor, combine = True))
+		self.assertEqual(combined(subject).result(5), [])
+	
+	def test_fire_many(self):
+		class Subject(object):
+			event = nmevent.Event(executor = self.executor)
+		Subject.event += lambda sender, n: n
+		subject = Subject()
+		subject.event += lambda sender, n: -n
+		results = lambda fires: [sorted(f.result(5) for f in futures)
+			for futures in fires]
+		event = Subject.__dict__['event']
+		items = [(subject, (1, )), (Subject(), (2, ))]
+		self.assertEqual(results(event.fire_bound_many(items)), [[-1, 1], [2]])
+		self.assertEqual(results(Subject.event.fire_many(items)), [[-1, 1], [2]])
+		self.assertEqual(results(event.fire_many(items)), [[1], [2]])
+		self.assertEqual(results(subject.event.fire_many([(subject, (3, ))])),
+			[[-3, 3]])
+		store = nmevent.CallbackStore()
+		store.dispatch = nmevent.ExecutorDispatch(self.executor)
+		store += lambda sender, n: n
+		self.assertEqual(results(store.call_many([(None, (4, ))])), [[4]])
+	
+	def test_combine(self):
+		self.subject.event += lambda sender: 1
+		self.subject.event += lambda sender: 2
+		dispatch = nmevent.ExecutorDispatch(self.executor, combine = True)
+		self.assertEqual(sorted(dispatch(self.subject.event).result(5)), [1, 2])
+		def fail(sender):
+			raise ValueError()
+		self.subject.event += fail
+		self.assertRaises(ValueError, dispatch(self.subject.event).result, 5)
+		self.assertEqual(dispatch(self.other.event).result(5), [])
+	
+	def test_serial(self):
+		gate = threading.Event()
+		dispatch = nmevent.ExecutorDispatch(self.executor, 'serial')
+		self.subject.event += self.blocking('a', gate)
+		self.other.event += lambda sender: self.log.append('other')
+		result = dispatch(self.subject.event)
+		result += dispatch(self.subject.event)
+		other = dispatch(self.other.event)
+		other[0].result(5)
+		self.assertEqual(self.log, ['other'])
+		self.assertFalse(result[1].running() or result[1].done())
+		gate.set()
+		self.assertEqual([f.result(5) for f in result], ['a', 'a'])
+		self.assertEqual(dispatch._queues, {})
+	
+	def test_limit(self):
+		gate = threading.Event()
+		self.subject.event += lambda sender: gate.wait(5)
+		dispatch = nmevent.ExecutorDispatch(self.executor, limit = 1)
+		first = dispatch(self.subject.event)
+		thread = threading.Thread(target = dispatch, args = (self.subject.event, ))
+		thread.start()
+		thread.join(0.05)
+		self.assertTrue(thread.is_alive())
+		gate.set()
+		thread.join(5)
+		self.assertFalse(thread.is_alive())
+		self.assertTrue(first[0].result(5))
+	
+	def test_unknown_ordering(self):
+		self.assertRaises(ValueError, nmevent.ExecutorDispatch, self.executor, 'some')
+
 @case
 class DiscoverHandlersTest(unittest.TestCase):
 	def test_simple(self):